@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Benchmark Suite
+Regression benchmarks for the Python control path against emulated boards
+"""
+
+import gc
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import statistics
+
+from esp32_emulator import ESP32Emulator, start_fleet, ROLE_SENSOR
+
+DEFAULT_ROUNDS = 11
+DEFAULT_MAX_REGRESSION = 20.0
+DEFAULT_FLEET_SIZE = 8
+RESULTS_VERSION = 1
+
+# Utterances for the matching benchmark: exact, embedded, compound and misses
+UTTERANCES = (
+    "turn on light",
+    "please turn off fan right now",
+    "turn on light and fan",
+    "turn on relay 3",
+    "turn off all",
+    "what is the weather like today",
+)
+
+
+class Benchmark:
+    """One named measurement.
+
+    setup(context) returns (operation, ops), where operation() performs
+    ops operations per call; emulators and clients it starts are registered
+    on the context and torn down after the run. Results are reported per
+    operation.
+    """
+
+    def __init__(self, name, description, setup, number=1, unit="us"):
+        self.name = name
+        self.description = description
+        self.setup = setup
+        self.number = number
+        self.unit = unit
+
+
+def bench_matching(context):
+    from command_matcher import CommandMatcher
+    from voice_control import DEFAULT_COMMANDS
+    matcher = CommandMatcher(DEFAULT_COMMANDS)
+
+    def operation():
+        for text in UTTERANCES:
+            if not matcher.match_all(text):
+                matcher.match(text)
+    return operation, len(UTTERANCES)
+
+
+def bench_status_parsing(context):
+    from state_sync import StateSync
+    from esp32_emulator import EmulatedBoard
+    board = EmulatedBoard()
+    # Alternate between two bodies so every update is parsed and diffed
+    bodies = []
+    for state in (True, False):
+        board.handle("/api/relay", {"relay": "1", "state": "true" if state else "false"})
+        bodies.append(board.handle("/api/status", {})[2])
+    sync = StateSync()
+
+    def operation():
+        for body in bodies:
+            sync.update("esp32", body)
+    return operation, len(bodies)
+
+
+def bench_relay_round_trip(context):
+    from device_client import ESP32Client
+    emulator = context.emulator()
+    client = context.client(ESP32Client(emulator.url))
+    state = [False]
+
+    def operation():
+        state[0] = not state[0]
+        client.set_relay(1, state[0]).raise_for_status()
+    return operation, 1
+
+
+def bench_bulk_relay_round_trip(context):
+    from device_client import ESP32Client
+    emulator = context.emulator()
+    client = context.client(ESP32Client(emulator.url))
+
+    def operation():
+        client.set_batch(on=(1, 3), off=(2, 4)).raise_for_status()
+        client.set_all(False).raise_for_status()
+    return operation, 2
+
+
+def bench_status_fan_out(context):
+    from fleet_client import FleetClient
+    fleet = context.fleet(DEFAULT_FLEET_SIZE)
+    client = FleetClient({name: emulator.url for name, emulator in fleet.items()})
+    loop = context.loop()
+    loop.run_until_complete(client.open())
+    context.cleanups.append(lambda: loop.run_until_complete(client.close()))
+
+    def operation():
+        results = loop.run_until_complete(client.get_status())
+        if not all(result['ok'] for result in results.values()):
+            raise RuntimeError("Fan-out request failed")
+    return operation, 1
+
+
+def bench_sensor_ingestion(context):
+    from sensor_collector import SensorCollector
+    from esp32_emulator import EmulatedBoard
+    board = EmulatedBoard(ROLE_SENSOR, seed=1)
+    sample = json.loads(board.handle("/api/sensors", {})[2])
+    collector = SensorCollector({}, interval=1.0, retention=3600)
+    clock = [time.time()]
+
+    def operation():
+        for i in range(100):
+            clock[0] += 1.0
+            collector.ingest(f"sensor-{i % 4}", clock[0], sample)
+    return operation, 100
+
+
+def bench_sensor_poll(context):
+    from sensor_collector import SensorCollector
+    fleet = context.fleet(DEFAULT_FLEET_SIZE, ROLE_SENSOR)
+    collector = SensorCollector({name: emulator.url for name, emulator in fleet.items()}, retention=3600)
+    loop = context.loop()
+    context.cleanups.append(lambda: loop.run_until_complete(collector.client.close()))
+
+    def operation():
+        loop.run_until_complete(collector.poll_once())
+    return operation, 1
+
+
+BENCHMARKS = (
+    Benchmark("matching", "CommandMatcher on a mix of utterances (per utterance)", bench_matching, number=200),
+    Benchmark("status_parsing", "StateSync parse and diff of /api/status (per body)", bench_status_parsing, number=200),
+    Benchmark("relay_round_trip", "Single /api/relay request (per request)", bench_relay_round_trip, number=50),
+    Benchmark("bulk_relay_round_trip", "/api/batch and /api/all requests (per request)",
+              bench_bulk_relay_round_trip, number=25),
+    Benchmark("status_fan_out", f"Concurrent /api/status across {DEFAULT_FLEET_SIZE} boards (per sweep)",
+              bench_status_fan_out, number=10),
+    Benchmark("sensor_ingestion", "SensorCollector.ingest of a parsed sample (per sample)",
+              bench_sensor_ingestion, number=20),
+    Benchmark("sensor_poll", f"Sensor poll across {DEFAULT_FLEET_SIZE} boards, parsed and stored (per sweep)",
+              bench_sensor_poll, number=10),
+)
+
+
+class BenchmarkContext:
+    """Emulators, clients and event loops a benchmark needs, torn down after it"""
+
+    def __init__(self):
+        self.cleanups = []
+
+    def emulator(self, **options):
+        emulator = ESP32Emulator(keep_alive=True, **options).start()
+        self.cleanups.append(emulator.stop)
+        return emulator
+
+    def fleet(self, count, role=None, **options):
+        if role is not None:
+            options['role'] = role
+        fleet = start_fleet(count, keep_alive=True, **options)
+        self.cleanups.extend(emulator.stop for emulator in fleet.values())
+        return fleet
+
+    def client(self, client):
+        self.cleanups.append(client.close)
+        return client
+
+    def loop(self):
+        loop = asyncio.new_event_loop()
+        self.cleanups.append(loop.close)
+        return loop
+
+    def close(self):
+        # Clients close before the emulators they talk to
+        for cleanup in reversed(self.cleanups):
+            cleanup()
+        self.cleanups = []
+
+
+def run_benchmark(benchmark, rounds=DEFAULT_ROUNDS, warmup=1):
+    """Time a benchmark over several rounds and summarize per operation"""
+    context = BenchmarkContext()
+    try:
+        operation, ops = benchmark.setup(context)
+        for _ in range(warmup):
+            for _ in range(benchmark.number):
+                operation()
+
+        samples = []
+        # Like timeit, keep the collector from landing inside a round
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(benchmark.number):
+                    operation()
+                elapsed = time.perf_counter() - start
+                samples.append(elapsed / (benchmark.number * ops) * 1e6)
+                gc.collect()
+        finally:
+            if gc_enabled:
+                gc.enable()
+    finally:
+        context.close()
+
+    samples.sort()
+    return {
+        'unit': benchmark.unit,
+        'median': statistics.median(samples),
+        'min': samples[0],
+        'max': samples[-1],
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'rounds': rounds,
+        'ops_per_round': benchmark.number * ops,
+    }
+
+
+def machine_info():
+    import os
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run_suite(names=None, rounds=DEFAULT_ROUNDS):
+    """Run the selected benchmarks and return a results document"""
+    selected = [b for b in BENCHMARKS if names is None or b.name in names]
+    results = {}
+    for benchmark in selected:
+        print(f"Running {benchmark.name}: {benchmark.description}...")
+        results[benchmark.name] = run_benchmark(benchmark, rounds)
+    return {
+        'version': RESULTS_VERSION,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'machine': machine_info(),
+        'benchmarks': results,
+    }
+
+
+def load_results(path):
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError(f"{path}: unsupported results version {results.get('version')}")
+    return results
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+
+
+def compare(results, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """Compare medians against a baseline; returns (rows, regressions).
+
+    A benchmark only counts as regressed when its median is more than
+    max_regression percent slower and even its fastest round is slower
+    than the baseline median, so a single noisy round on a loopback
+    socket does not fail the run.
+    """
+    rows = []
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            rows.append((name, None, current['median'], None, "new"))
+            continue
+        change = (current['median'] / base['median'] - 1) * 100
+        if change > max_regression and current['min'] > base['median']:
+            verdict = "REGRESSED"
+            regressions.append(name)
+        elif change > max_regression:
+            verdict = "noisy"
+        elif change < -max_regression:
+            verdict = "improved"
+        else:
+            verdict = "ok"
+        rows.append((name, base['median'], current['median'], change, verdict))
+    return rows, regressions
+
+
+def format_results(results):
+    lines = [f"{'benchmark':<24} {'median':>10} {'min':>10} {'stdev':>9}"]
+    for name, result in results['benchmarks'].items():
+        unit = result['unit']
+        lines.append(f"{name:<24} {result['median']:>8.2f}{unit} {result['min']:>8.2f}{unit} "
+                     f"{result['stdev']:>7.2f}{unit}")
+    return "\n".join(lines)
+
+
+def format_comparison(rows, max_regression):
+    lines = [f"{'benchmark':<24} {'baseline':>10} {'current':>10} {'change':>8}  (threshold +{max_regression:g}%)"]
+    for name, base, current, change, verdict in rows:
+        base_text = f"{base:.2f}" if base is not None else "-"
+        change_text = f"{change:+.1f}%" if change is not None else "-"
+        lines.append(f"{name:<24} {base_text:>10} {current:>10.2f} {change_text:>8}  {verdict}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Benchmark Suite')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+    parser.add_argument('--only', help='Comma-separated benchmarks to run (default: all)')
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS,
+                        help=f'Timed rounds per benchmark; the median is tracked (default: {DEFAULT_ROUNDS})')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Write results as the new baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare against a saved baseline')
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help=f'Fail when a median is this many percent slower than the baseline (default: {DEFAULT_MAX_REGRESSION:g})')
+
+    args = parser.parse_args()
+
+    if args.list:
+        for benchmark in BENCHMARKS:
+            print(f"{benchmark.name:<24} {benchmark.description}")
+        return
+
+    names = None
+    if args.only:
+        names = set(name.strip() for name in args.only.split(','))
+        unknown = names - {b.name for b in BENCHMARKS}
+        if unknown:
+            parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = load_results(args.baseline)
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not load baseline: {e}")
+            sys.exit(2)
+
+    results = run_suite(names, args.rounds)
+    print()
+    print(format_results(results))
+
+    if args.output:
+        save_results(results, args.output)
+        print(f"Results saved to {args.output}")
+    if args.save_baseline:
+        save_results(results, args.save_baseline)
+        print(f"✅ Baseline saved to {args.save_baseline}")
+
+    if baseline is not None:
+        rows, regressions = compare(results, baseline, args.max_regression)
+        print()
+        print(format_comparison(rows, args.max_regression))
+        if regressions:
+            print(f"❌ {len(regressions)} benchmark(s) regressed by more than {args.max_regression:g}%: "
+                  + ", ".join(regressions))
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.max_regression:g}%")
+
+if __name__ == "__main__":
+    main()
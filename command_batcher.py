@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Command Batcher
+Coalesces relay commands issued close together into one /api/batch request per board
+"""
+
+import time
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from device_client import get_client
+from load_generator import LatencyHistogram
+
+DEFAULT_WINDOW = 0.02
+
+
+class CommandBatcher:
+    """Collects relay commands for a short window and sends one batch per board.
+
+    Commands for the same relay within a window collapse to the last state
+    requested, so an on/off toggle costs nothing on the wire. Each submit()
+    returns a Future resolving to the board's relay states after the batch.
+    Only one batch per board is in flight at a time; commands for a board
+    that is still sending wait in the pending map and go out, in order, as
+    soon as it answers. Boards whose firmware predates /api/batch (HTTP 404) are remembered and
+    driven with one /api/relay call per relay instead.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, max_workers=4):
+        self.window = window
+        self.pending = {}
+        self.sending = set()
+        self.deadline = None
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-send")
+        self.legacy_boards = set()
+        self.is_running = True
+        self.batches_sent = 0
+        self.commands_submitted = 0
+        self.commands_collapsed = 0
+        self.thread = threading.Thread(target=self.run, name="command-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, board_url, relay, state):
+        """Queue one relay command; returns a Future for the board's resulting state"""
+        future = Future()
+        with self.condition:
+            commands = self.pending.setdefault(board_url.rstrip('/'), {})
+            if relay in commands:
+                self.commands_collapsed += 1
+                commands[relay][1].append(future)
+                commands[relay][0] = bool(state)
+            else:
+                commands[relay] = [bool(state), [future]]
+            self.commands_submitted += 1
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.window
+                self.condition.notify()
+        return future
+
+    def apply(self, board_url, states, timeout=10):
+        """Switch several relays ({relay: state}) and wait for the board's resulting state"""
+        futures = [self.submit(board_url, relay, state) for relay, state in states.items()]
+        # The command is complete, so there is nothing to wait for
+        self.flush()
+        results = [future.result(timeout) for future in futures]
+        return results[-1] if results else None
+
+    def flush(self):
+        """Send whatever is pending without waiting for the window to close"""
+        with self.condition:
+            if self.pending:
+                self.deadline = time.monotonic()
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    ready = [board_url for board_url in self.pending if board_url not in self.sending]
+                    if ready and (not self.is_running or self.deadline is None
+                                  or time.monotonic() >= self.deadline):
+                        break
+                    if not self.is_running and not self.pending and not self.sending:
+                        return
+                    # Boards still sending are woken by _send when their batch completes
+                    timeout = self.deadline - time.monotonic() if ready else None
+                    self.condition.wait(timeout)
+                batch = {board_url: self.pending.pop(board_url) for board_url in ready}
+                self.sending.update(batch)
+                self.deadline = None
+            for board_url, commands in batch.items():
+                self.executor.submit(self._send, board_url, commands)
+
+    def _send(self, board_url, commands):
+        futures = [future for _, waiting in commands.values() for future in waiting]
+        try:
+            states = self._send_batch(board_url, {relay: state for relay, (state, _) in commands.items()})
+        except Exception as e:
+            error, states = e, None
+        else:
+            error = None
+        finally:
+            with self.condition:
+                self.sending.discard(board_url)
+                if board_url in self.pending:
+                    # Commands held back behind this batch have already waited long enough
+                    now = time.monotonic()
+                    self.deadline = now if self.deadline is None else min(self.deadline, now)
+                self.condition.notify()
+        for future in futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(states)
+
+    def _send_batch(self, board_url, states):
+        client = get_client(board_url)
+        on = [relay for relay, state in states.items() if state]
+        off = [relay for relay, state in states.items() if not state]
+
+        if board_url not in self.legacy_boards:
+            response = client.set_batch(on, off)
+            self.batches_sent += 1
+            if response.status_code == 200:
+                data = response.json()
+                if data.get('success'):
+                    return {key: value for key, value in data.items() if key.startswith('relay')}
+                raise requests.exceptions.RequestException(f"Batch rejected by {board_url}: {data}")
+            if response.status_code != 404:
+                raise requests.exceptions.RequestException(f"HTTP {response.status_code} from {board_url}")
+            self.legacy_boards.add(board_url)
+
+        # Older firmware: fall back to one request per relay
+        for relay, state in states.items():
+            response = client.set_relay(relay, state)
+            if response.status_code != 200:
+                raise requests.exceptions.RequestException(f"HTTP {response.status_code} from {board_url}")
+        return {f"relay{relay}": state for relay, state in states.items()}
+
+    def stats(self):
+        return {
+            'commands': self.commands_submitted,
+            'collapsed': self.commands_collapsed,
+            'batches': self.batches_sent,
+        }
+
+    def close(self):
+        """Send anything pending and stop the batcher"""
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+
+def run_benchmark(url, relays=(1, 2, 3), iterations=50, window=DEFAULT_WINDOW):
+    """Compare sequential /api/relay calls with one batched request for a multi-device command"""
+    client = get_client(url)
+    sequential = LatencyHistogram()
+    batched = LatencyHistogram()
+    batcher = CommandBatcher(window)
+
+    for i in range(iterations):
+        state = i % 2 == 0
+
+        start = time.perf_counter()
+        for relay in relays:
+            client.set_relay(relay, state)
+        sequential.record(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batcher.apply(url, {relay: not state for relay in relays})
+        batched.record(time.perf_counter() - start)
+
+    batcher.close()
+    for label, histogram in (("sequential", sequential), ("batched", batched)):
+        summary = histogram.summary()
+        print(f"{label:<11} p50 {summary['p50_ms']:.2f}ms  p99 {summary['p99_ms']:.2f}ms  "
+              f"mean {summary['mean_ms']:.2f}ms")
+    print(f"{len(relays)} relays per command, {iterations} commands, {window * 1000:g}ms batching window, "
+          f"{batcher.stats()['batches']} batch requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Command Batcher')
+    parser.add_argument('--url', default='http://192.168.1.100', help='ESP32 IP address')
+    parser.add_argument('--on', default='', help='Comma-separated relays to switch on')
+    parser.add_argument('--off', default='', help='Comma-separated relays to switch off')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW * 1000,
+                        help='Batching window in milliseconds (default: 20)')
+    parser.add_argument('--benchmark', action='store_true', help='Compare sequential and batched multi-relay commands')
+    parser.add_argument('--iterations', type=int, default=50, help='Commands in the benchmark (default: 50)')
+
+    args = parser.parse_args()
+    window = args.window / 1000
+
+    if args.benchmark:
+        run_benchmark(args.url, iterations=args.iterations, window=window)
+        return
+
+    states = {int(relay): True for relay in args.on.split(',') if relay.strip()}
+    states.update({int(relay): False for relay in args.off.split(',') if relay.strip()})
+    if not states:
+        parser.error("--on, --off or --benchmark is required")
+
+    batcher = CommandBatcher(window)
+    try:
+        print(f"✅ Relay states: {batcher.apply(args.url, states)}")
+    except requests.exceptions.RequestException as e:
+        print(f"❌ Batch failed: {e}")
+    finally:
+        batcher.close()
+
+if __name__ == "__main__":
+    main()
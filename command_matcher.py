@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Command Matcher
+Precompiled phrase index used to map voice transcripts to device commands
+"""
+
+import re
+import time
+import random
+import argparse
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# Keywords used by the fallback matcher, grouped by meaning
+STATE_ON_WORDS = ('on', 'enable', 'activate', 'start')
+STATE_OFF_WORDS = ('off', 'disable', 'deactivate', 'stop')
+BULK_WORDS = ('all', 'everything')
+STATUS_WORDS = ('status', 'state', 'check', 'show')
+CONJUNCTIONS = ('and', 'then')
+
+
+def tokenize(text):
+    """Split a transcript into lowercase word tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class CommandMatcher:
+    """Token-level Aho-Corasick automaton over the registered command phrases.
+
+    Phrases are matched on whole words, so "turn on light" no longer fires
+    inside "turn on lights in garage", and the longest registered phrase found
+    anywhere in the transcript wins regardless of registration order.
+    """
+
+    def __init__(self, commands=None):
+        self.build(commands or {})
+
+    def build(self, commands):
+        """Compile the automaton from a phrase -> action mapping"""
+        goto = [{}]
+        output = [None]
+
+        for phrase, action in commands.items():
+            tokens = tokenize(phrase)
+            if not tokens:
+                continue
+
+            node = 0
+            for token in tokens:
+                next_node = goto[node].get(token)
+                if next_node is None:
+                    next_node = len(goto)
+                    goto[node][token] = next_node
+                    goto.append({})
+                    output.append(None)
+                node = next_node
+            output[node] = (len(tokens), phrase, action)
+
+        # Breadth-first pass to compute failure links. Each node's output is its
+        # own phrase or, failing that, the longest phrase on its suffix chain,
+        # which is always shorter than the node's own phrase.
+        fail = [0] * len(goto)
+        frontier = list(goto[0].values())
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for token, child in goto[node].items():
+                    state = fail[node]
+                    while state and token not in goto[state]:
+                        state = fail[state]
+                    fail[child] = goto[state].get(token, 0)
+                    if output[child] is None:
+                        output[child] = output[fail[child]]
+                    next_frontier.append(child)
+            frontier = next_frontier
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+        self.phrase_count = sum(1 for phrase in commands if tokenize(phrase))
+
+    def match(self, text):
+        """Return (phrase, action) for the most specific phrase in text, or None"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        best = None
+        state = 0
+        for token in tokenize(text):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+
+            found = output[state]
+            if found is not None and (best is None or found[0] > best[0]):
+                best = found
+
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def match_exact(self, text):
+        """Return (phrase, action, final) when text is exactly a registered phrase, or None.
+
+        final is True when no longer registered phrase starts with it, so a
+        streaming recognizer can act on the partial hypothesis right away.
+        """
+        node = 0
+        tokens = tokenize(text)
+        for token in tokens:
+            node = self._goto[node].get(token)
+            if node is None:
+                return None
+        found = self._output[node]
+        if not tokens or found is None or found[0] != len(tokens):
+            return None
+        return found[1], found[2], not self._goto[node]
+
+    def match_all(self, text):
+        """Match every clause of a compound command such as "turn on light and fan".
+
+        Clauses are split on conjunctions; a clause without its own on/off word
+        borrows the leading words of the previous clause. Returns a list of
+        (phrase, action), or an empty list unless every clause matched.
+        """
+        clauses = [[]]
+        for token in tokenize(text):
+            if token in CONJUNCTIONS:
+                clauses.append([])
+            else:
+                clauses[-1].append(token)
+        clauses = [clause for clause in clauses if clause]
+        if len(clauses) < 2:
+            return []
+
+        matches = []
+        prefix = []
+        for clause in clauses:
+            if prefix and not any(token in STATE_ON_WORDS or token in STATE_OFF_WORDS for token in clause):
+                clause = prefix + clause
+            else:
+                prefix = clause[:-1]
+            found = self.match(" ".join(clause))
+            if found is None:
+                return []
+            matches.append(found)
+        return matches
+
+    def match_keywords(self, text):
+        """Classify a transcript by keyword for fuzzy matching.
+
+        Returns a dict with the relay number (1-4), the requested state and
+        whether bulk or status words were present, computed in a single pass.
+        """
+        relay_num = None
+        saw_on = saw_off = bulk = status = False
+
+        for token in tokenize(text):
+            if relay_num is None and token.isdigit() and 1 <= int(token) <= 4:
+                relay_num = int(token)
+            elif token in STATE_ON_WORDS:
+                saw_on = True
+            elif token in STATE_OFF_WORDS:
+                saw_off = True
+            elif token in BULK_WORDS:
+                bulk = True
+            elif token in STATUS_WORDS:
+                status = True
+
+        state = True if saw_on else False if saw_off else None
+        return {"relay": relay_num, "state": state, "bulk": bulk, "status": status}
+
+
+def linear_match(commands, text):
+    """Reference implementation of the original first-substring-wins scan"""
+    for command, action in commands.items():
+        if command in text:
+            return command, action
+    return None
+
+
+def generate_phrases(count):
+    """Generate a synthetic phrase table of the given size"""
+    rooms = ["kitchen", "garage", "bedroom", "office", "hallway", "porch",
+             "basement", "attic", "patio", "study"]
+    devices = ["light", "lights", "fan", "heater", "tv", "lamp", "speaker",
+               "pump", "blinds", "outlet"]
+
+    phrases = {}
+    index = 0
+    while len(phrases) < count:
+        room = rooms[index % len(rooms)]
+        device = devices[(index // len(rooms)) % len(devices)]
+        zone = index // (len(rooms) * len(devices))
+        suffix = f" zone {zone}" if zone else ""
+        for state in (True, False):
+            verb = "turn on" if state else "turn off"
+            phrases[f"{verb} {room} {device}{suffix}"] = {"relay": index % 4 + 1, "state": state}
+        index += 1
+    return dict(list(phrases.items())[:count])
+
+
+def run_benchmark(sizes=(10, 100, 1000), utterances=2000, seed=42):
+    """Compare per-utterance matching time against the linear scan"""
+    rng = random.Random(seed)
+    print(f"{'phrases':>8} {'linear (us)':>12} {'matcher (us)':>13} {'build (ms)':>11}")
+
+    for size in sizes:
+        commands = generate_phrases(size)
+        phrases = list(commands)
+        samples = []
+        for _ in range(utterances):
+            if rng.random() < 0.8:
+                samples.append(f"please {rng.choice(phrases)} right now")
+            else:
+                samples.append("what is the weather like today")
+
+        start = time.perf_counter()
+        matcher = CommandMatcher(commands)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # Warm both paths before timing
+        for text in samples[:100]:
+            linear_match(commands, text)
+            matcher.match(text)
+
+        start = time.perf_counter()
+        for text in samples:
+            linear_match(commands, text)
+        linear_us = (time.perf_counter() - start) / utterances * 1e6
+
+        start = time.perf_counter()
+        for text in samples:
+            matcher.match(text)
+        matcher_us = (time.perf_counter() - start) / utterances * 1e6
+
+        print(f"{size:>8} {linear_us:>12.2f} {matcher_us:>13.2f} {build_ms:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Command Matcher')
+    parser.add_argument('--benchmark', action='store_true', help='Run the matching micro-benchmark')
+    parser.add_argument('--utterances', type=int, default=2000, help='Utterances per benchmark size (default: 2000)')
+    parser.add_argument('text', nargs='?', help='Transcript to match against the default command table')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(utterances=args.utterances)
+        return
+
+    if args.text:
+        from voice_control import DEFAULT_COMMANDS
+        result = CommandMatcher(DEFAULT_COMMANDS).match(args.text)
+        print(result if result else "No match")
+        return
+
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
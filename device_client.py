@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Device Client
+Shared, pooled HTTP client used by the voice controller and test suite
+"""
+
+import time
+import threading
+import argparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from metrics import METRICS
+
+# The ESP32 WebServer handles one client at a time, so a small pool is enough
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 5
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.2
+
+
+def format_state(state):
+    """Format a relay state the way the firmware expects ("true"/"false")"""
+    if isinstance(state, str):
+        return state.lower()
+    return "true" if state else "false"
+
+
+def relay_mask(relays):
+    """Bitmask for /api/batch with bit 0 standing for relay 1"""
+    mask = 0
+    for relay in relays:
+        mask |= 1 << (int(relay) - 1)
+    return mask
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that counts requests sent and TCP connections actually opened.
+
+    urllib3 transparently reconnects a pooled connection object after the
+    server closes it, so pool counters alone would report a reused connection.
+    Counting socket connects gives the real number of handshakes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.requests_sent = 0
+        self.connections_opened = 0
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        class CountingHTTPConnection(HTTPConnection):
+            def connect(self):
+                super().connect()
+                adapter.count_connection()
+
+        class CountingHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                super().connect()
+                adapter.count_connection()
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = CountingHTTPConnection
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = CountingHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def count_connection(self):
+        with self.lock:
+            self.connections_opened += 1
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.requests_sent += 1
+        return super().send(request, **kwargs)
+
+
+class ESP32Client:
+    def __init__(self, base_url="http://192.168.1.100", connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, pool_size=DEFAULT_POOL_SIZE,
+                 retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF):
+        self.base_url = base_url.rstrip('/')
+        # Metrics label: host[:port] of the board
+        self.board = self.base_url.split('://', 1)[-1]
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # Retry connection errors and transient gateway errors with backoff.
+        # Every firmware endpoint is an idempotent GET, so retrying is safe.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        self.adapter = CountingAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.headers.update({'Connection': 'keep-alive'})
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def get(self, path, params=None, timeout=None):
+        """Issue a GET request against the board, reusing pooled connections"""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+        outcome = "failure"
+        try:
+            with METRICS.span("http", board=self.board, endpoint=path):
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=timeout)
+            if response.status_code < 400:
+                outcome = "success"
+            return response
+        finally:
+            METRICS.count("requests", board=self.board, endpoint=path, outcome=outcome)
+
+    def get_status(self):
+        """GET /api/status"""
+        return self.get("/api/status")
+
+    def set_relay(self, relay, state):
+        """GET /api/relay for a single relay"""
+        return self.get("/api/relay", params={"relay": relay, "state": format_state(state)})
+
+    def set_all(self, state):
+        """GET /api/all for every relay"""
+        return self.get("/api/all", params={"state": format_state(state)})
+
+    def set_batch(self, on=(), off=()):
+        """GET /api/batch to switch several relays in one request"""
+        return self.get("/api/batch", params={"on": relay_mask(on), "off": relay_mask(off)})
+
+    def get_sensors(self):
+        """GET /api/sensors on a sensor board"""
+        return self.get("/api/sensors")
+
+    def connection_stats(self):
+        """Report how many requests reused a pooled connection versus opening a new one"""
+        with self.adapter.lock:
+            issued = self.adapter.requests_sent
+            opened = self.adapter.connections_opened
+
+        return {
+            'requests': issued,
+            'connections_opened': opened,
+            'connections_reused': max(issued - opened, 0),
+            'reuse_ratio': max(issued - opened, 0) / issued if issued else 0.0,
+        }
+
+    def close(self):
+        """Close every pooled connection"""
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url="http://192.168.1.100", **options):
+    """Return the shared client for a board, creating it on first use"""
+    key = base_url.rstrip('/')
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = ESP32Client(key, **options)
+            _clients[key] = client
+        return client
+
+
+def close_clients():
+    """Close every shared client"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Device Client')
+    parser.add_argument('--url', default='http://192.168.1.100', help='ESP32 IP address')
+    parser.add_argument('--path', default='/api/status', help='Endpoint to request (default: /api/status)')
+    parser.add_argument('--requests', type=int, default=50, help='Number of requests to issue (default: 50)')
+
+    args = parser.parse_args()
+
+    # Compare a fresh connection per request with the pooled client
+    start = time.perf_counter()
+    failures = 0
+    for _ in range(args.requests):
+        try:
+            requests.get(f"{args.url.rstrip('/')}{args.path}", timeout=DEFAULT_READ_TIMEOUT)
+        except requests.exceptions.RequestException:
+            failures += 1
+    unpooled_ms = (time.perf_counter() - start) / args.requests * 1000
+
+    client = ESP32Client(args.url)
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        try:
+            client.get(args.path)
+        except requests.exceptions.RequestException:
+            failures += 1
+    pooled_ms = (time.perf_counter() - start) / args.requests * 1000
+
+    stats = client.connection_stats()
+    print(f"Unpooled: {unpooled_ms:.2f}ms per request")
+    print(f"Pooled:   {pooled_ms:.2f}ms per request")
+    print(f"Connections opened: {stats['connections_opened']}, reused: {stats['connections_reused']} "
+          f"({stats['reuse_ratio'] * 100:.1f}% reuse)")
+    if failures:
+        print(f"❌ {failures} requests failed")
+    client.close()
+
+if __name__ == "__main__":
+    main()
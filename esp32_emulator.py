@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Board Emulator
+Local stand-in for esp32_main.ino and sensors.ino for offline testing and benchmarking
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+RAW_LITERAL = r'String {name}\(\) \{{\s*return R"rawliteral\((.*?)\)rawliteral";'
+
+ROLE_RELAY = "relay"
+ROLE_SENSOR = "sensor"
+
+# Matches sensorReadInterval in sensors.ino
+SENSOR_READ_INTERVAL = 2.0
+
+
+def load_firmware_asset(sketch, function_name):
+    """Extract a raw string literal returned by a function in an .ino sketch"""
+    path = os.path.join(PROJECT_ROOT, sketch)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+    except OSError:
+        return ""
+    match = re.search(RAW_LITERAL.format(name=function_name), source, re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def arduino_float(value):
+    """Render a float the way Arduino's String(float) does (two decimals)"""
+    if math.isnan(value):
+        return "nan"
+    return f"{value:.2f}"
+
+
+class EmulatedBoard:
+    """Firmware state and request routing for one emulated board"""
+
+    def __init__(self, role=ROLE_RELAY, relay_count=4, seed=None, cache_json=True):
+        self.role = role
+        self.cache_json = cache_json
+        self.status_cache = (None, None)
+        self.sensor_cache = (None, None)
+        self.relay_count = relay_count
+        self.relay_states = [False] * relay_count
+        self.started = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+        self.last_sensor_read = None
+        self.sensor_data = {
+            'temperature': 22.0,
+            'humidity': 45.0,
+            'motion': False,
+            'lightLevel': 60,
+            'distance': 120.0,
+            'moisture': 40,
+            'gasLevel': 5,
+            'timestamp': 0,
+        }
+
+        if role == ROLE_RELAY:
+            self.assets = {
+                'html': load_firmware_asset("esp32_main.ino", "getHTML"),
+                'css': load_firmware_asset("esp32_main.ino", "getCSS"),
+                'js': load_firmware_asset("esp32_main.ino", "getJavaScript"),
+            }
+        else:
+            self.assets = {'html': load_firmware_asset("sensors.ino", "getSensorDashboardHTML")}
+
+        self.routes = self._build_routes()
+
+    def millis(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+    def _build_routes(self):
+        if self.role == ROLE_RELAY:
+            return {
+                "/": self.handle_root,
+                "/api/status": self.handle_status,
+                "/api/relay": self.handle_relay,
+                "/api/all": self.handle_all_relays,
+                "/api/batch": self.handle_batch,
+                "/style.css": lambda args: (200, "text/css", self.assets['css']),
+                "/script.js": lambda args: (200, "application/javascript", self.assets['js']),
+            }
+        return {
+            "/": self.handle_root,
+            "/api/sensors": self.handle_sensor_data,
+            "/api/sensors/temperature": lambda args: self._single_sensor('temperature'),
+            "/api/sensors/humidity": lambda args: self._single_sensor('humidity'),
+            "/api/sensors/motion": lambda args: self._single_sensor('motion'),
+            "/api/sensors/light": lambda args: self._single_sensor('lightLevel'),
+            "/api/sensors/distance": lambda args: self._single_sensor('distance'),
+            "/api/sensors/moisture": lambda args: self._single_sensor('moisture'),
+            "/api/sensors/gas": lambda args: self._single_sensor('gasLevel'),
+        }
+
+    def handle(self, path, args):
+        """Route a request, returning (status, content type, body)"""
+        with self.lock:
+            self.request_count += 1
+            handler = self.routes.get(path)
+            if handler is None:
+                # WebServer's default not-found response
+                return 404, "text/plain", f"Not found: {path}"
+            return handler(args)
+
+    def handle_root(self, args):
+        return 200, "text/html", self.assets['html']
+
+    def handle_status(self, args):
+        # Like the firmware, reuse the rendered body until a relay changes
+        key = tuple(self.relay_states)
+        if self.cache_json and self.status_cache[0] == key:
+            return 200, "application/json", self.status_cache[1]
+        parts = [f'"relay{i + 1}":{"true" if state else "false"}' for i, state in enumerate(self.relay_states)]
+        body = "{" + ",".join(parts) + "}"
+        self.status_cache = (key, body)
+        return 200, "application/json", body
+
+    def handle_relay(self, args):
+        if "relay" in args and "state" in args:
+            relay = self._to_int(args["relay"]) - 1
+            state = args["state"] == "true"
+            if 0 <= relay < self.relay_count:
+                self.relay_states[relay] = state
+                return 200, "application/json", '{"success":true}'
+            return 400, "application/json", '{"error":"Invalid relay"}'
+        return 400, "application/json", '{"error":"Missing parameters"}'
+
+    def handle_all_relays(self, args):
+        if "state" in args:
+            state = args["state"] == "true"
+            for i in range(self.relay_count):
+                self.relay_states[i] = state
+            return 200, "application/json", '{"success":true}'
+        return 400, "application/json", '{"error":"Missing state parameter"}'
+
+    def handle_batch(self, args):
+        if "on" in args or "off" in args:
+            on_mask = self._to_int(args.get("on", ""))
+            off_mask = self._to_int(args.get("off", ""))
+        elif "relays" in args and "state" in args:
+            mask = 0
+            for part in args["relays"].split(","):
+                relay = self._to_int(part) - 1
+                if not 0 <= relay < self.relay_count:
+                    return 400, "application/json", '{"error":"Invalid relay"}'
+                mask |= 1 << relay
+            on_mask, off_mask = (mask, 0) if args["state"] == "true" else (0, mask)
+        else:
+            return 400, "application/json", '{"error":"Missing parameters"}'
+
+        limit = (1 << self.relay_count) - 1
+        if not (0 <= on_mask <= limit and 0 <= off_mask <= limit):
+            return 400, "application/json", '{"error":"Invalid relay mask"}'
+        if on_mask & off_mask:
+            return 400, "application/json", '{"error":"Conflicting relays"}'
+
+        for i in range(self.relay_count):
+            if on_mask & (1 << i):
+                self.relay_states[i] = True
+            elif off_mask & (1 << i):
+                self.relay_states[i] = False
+        parts = ['"success":true'] + [f'"relay{i + 1}":{"true" if state else "false"}'
+                                      for i, state in enumerate(self.relay_states)]
+        return 200, "application/json", "{" + ",".join(parts) + "}"
+
+    def handle_sensor_data(self, args):
+        data = self.read_sensors()
+        # The firmware renders once per sensor read; timestamp identifies the read
+        if self.cache_json and self.sensor_cache[0] == data['timestamp']:
+            return 200, "application/json", self.sensor_cache[1]
+        json_text = "{"
+        json_text += f'"temperature":{arduino_float(data["temperature"])},'
+        json_text += f'"humidity":{arduino_float(data["humidity"])},'
+        json_text += f'"motion":{"true" if data["motion"] else "false"},'
+        json_text += f'"lightLevel":{data["lightLevel"]},'
+        json_text += f'"distance":{arduino_float(data["distance"])},'
+        json_text += f'"moisture":{data["moisture"]},'
+        json_text += f'"gasLevel":{data["gasLevel"]},'
+        json_text += f'"timestamp":{data["timestamp"]}'
+        json_text += "}"
+        self.sensor_cache = (data['timestamp'], json_text)
+        return 200, "application/json", json_text
+
+    def _single_sensor(self, field):
+        data = self.read_sensors()
+        value = data[field]
+        if isinstance(value, bool):
+            rendered = "true" if value else "false"
+        elif isinstance(value, float):
+            rendered = arduino_float(value)
+        else:
+            rendered = str(value)
+        return 200, "application/json", f'{{"{field}":{rendered}}}'
+
+    def read_sensors(self):
+        """Advance the simulated sensors on the firmware's read interval"""
+        now = time.monotonic()
+        if self.last_sensor_read is not None and now - self.last_sensor_read < SENSOR_READ_INTERVAL:
+            return self.sensor_data
+        self.last_sensor_read = now
+
+        rng = self.random
+        data = self.sensor_data
+        data['temperature'] = min(max(data['temperature'] + rng.gauss(0, 0.05), -10.0), 50.0)
+        data['humidity'] = min(max(data['humidity'] + rng.gauss(0, 0.2), 0.0), 100.0)
+        if rng.random() < 0.1:
+            data['motion'] = not data['motion']
+        data['lightLevel'] = int(min(max(data['lightLevel'] + rng.randint(-2, 2), 0), 100))
+        distance = data['distance'] if data['distance'] > 0 else 120.0
+        distance += rng.gauss(0, 1.0)
+        data['distance'] = distance if 2 <= distance <= 400 else -1.0
+        data['moisture'] = int(min(max(data['moisture'] + rng.randint(-1, 1), 0), 100))
+        data['gasLevel'] = int(min(max(data['gasLevel'] + rng.randint(-1, 1), 0), 100))
+        data['timestamp'] = self.millis()
+        return data
+
+    @staticmethod
+    def _to_int(text):
+        # Arduino String::toInt() parses a leading integer and returns 0 otherwise
+        match = re.match(r'\s*[-+]?\d+', text)
+        return int(match.group(0)) if match else 0
+
+
+class ESP32RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ESP32-WebServer"
+    sys_version = ""
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_GET(self):
+        emulator = self.server.emulator
+
+        # Simulated handling delay: loop() latency plus network jitter
+        delay = emulator.latency + (emulator.random.uniform(-emulator.jitter, emulator.jitter) if emulator.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if emulator.failure_rate and emulator.random.random() < emulator.failure_rate:
+            emulator.failures += 1
+            if emulator.failure_mode == "error":
+                self._send(500, "text/plain", "Internal Server Error")
+            else:
+                # Drop the connection without a response, like a board reset or WiFi drop
+                self.close_connection = True
+            return
+
+        url = urlsplit(self.path)
+        args = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        status, content_type, body = emulator.board.handle(url.path, args)
+        self._send(status, content_type, body)
+
+    do_POST = do_GET
+
+    def _send(self, status, content_type, body):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        if not self.server.emulator.keep_alive:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.server.emulator.verbose:
+            super().log_message(format, *args)
+
+
+class ESP32Emulator:
+    """Single-threaded HTTP server that behaves like one ESP32 board.
+
+    Requests are served one at a time, like the Arduino WebServer, and by
+    default every response closes the connection as the firmware does.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, role=ROLE_RELAY, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, failure_mode="drop", keep_alive=False, seed=None, verbose=False, cache_json=True):
+        self.board = EmulatedBoard(role, seed=seed, cache_json=cache_json)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.keep_alive = keep_alive
+        self.random = random.Random(seed)
+        self.verbose = verbose
+        self.failures = 0
+
+        self.server = HTTPServer((host, port), ESP32RequestHandler)
+        self.server.emulator = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests on a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f"esp32-emulator-{self.url}",
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def start_fleet(count, role=ROLE_RELAY, host="127.0.0.1", base_port=0, prefix=None, **options):
+    """Start count emulated boards and return {name: emulator}"""
+    prefix = prefix or f"{role}-board"
+    seed = options.pop('seed', None)
+    fleet = {}
+    for i in range(count):
+        port = base_port + i if base_port else 0
+        emulator = ESP32Emulator(host, port, role, seed=None if seed is None else seed + i, **options)
+        fleet[f"{prefix}-{i + 1}"] = emulator.start()
+    return fleet
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Board Emulator')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port for the first board (default: 8080)')
+    parser.add_argument('--role', choices=[ROLE_RELAY, ROLE_SENSOR], default=ROLE_RELAY, help='Firmware to emulate')
+    parser.add_argument('--boards', type=int, default=1, help='Number of boards on consecutive ports (default: 1)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Added handling latency in ms (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Latency jitter in +/- ms (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests that fail (default: 0)')
+    parser.add_argument('--failure-mode', choices=['drop', 'error'], default='drop', help='Drop the connection or return HTTP 500')
+    parser.add_argument('--keep-alive', action='store_true', help='Keep connections open instead of closing after each response')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+    parser.add_argument('--fleet-file', help='Write a fleet JSON file mapping board names to URLs')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    parser.add_argument('--legacy-json', action='store_true',
+                        help='Render /api/status and /api/sensors on every request, like the old String firmware')
+
+    args = parser.parse_args()
+
+    try:
+        fleet = start_fleet(args.boards, args.role, args.host, args.port,
+                            latency=args.latency / 1000, jitter=args.jitter / 1000,
+                            failure_rate=args.failure_rate, failure_mode=args.failure_mode,
+                            keep_alive=args.keep_alive, seed=args.seed, verbose=args.verbose,
+                            cache_json=not args.legacy_json)
+    except OSError as e:
+        print(f"❌ Could not start emulator: {e}")
+        sys.exit(1)
+
+    for name, emulator in fleet.items():
+        print(f"✅ {name} ({args.role}) listening on {emulator.url}")
+
+    if args.fleet_file:
+        with open(args.fleet_file, 'w') as f:
+            json.dump({name: emulator.url for name, emulator in fleet.items()}, f, indent=2)
+        print(f"Fleet file saved to: {args.fleet_file}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping emulator...")
+    finally:
+        for emulator in fleet.values():
+            emulator.stop()
+
+if __name__ == "__main__":
+    main()
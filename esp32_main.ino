@@ -52,6 +52,18 @@ const char* ap_password = "homecontrol123";
 unsigned long lastFirebaseUpdate = 0;
 const unsigned long firebaseUpdateInterval = 1000; // Update every 1 second
 
+// /api/status is the most polled endpoint. Its body is rendered into this
+// fixed buffer only after a relay changes and sent as-is in between, so
+// polling makes no String heap allocations.
+char statusJson[96];
+int statusJsonLength = 0;
+bool statusDirty = true;
+
+// Reused for every Firebase update; relay fields are only rewritten on change
+FirebaseJson firebaseJson;
+bool firebaseDirty = true;
+const char* const relayKeys[] = {"relay1", "relay2", "relay3", "relay4"};
+
 void setup() {
   Serial.begin(115200);
   Serial.println("ESP32 Home Automation System Starting...");
@@ -151,6 +163,7 @@ void setupWebServer() {
   server.on("/api/status", handleStatus);
   server.on("/api/relay", handleRelay);
   server.on("/api/all", handleAllRelays);
+  server.on("/api/batch", handleBatch);
   
   // Serve static files
   server.on("/style.css", HTTP_GET, []() {
@@ -170,15 +183,21 @@ void handleRoot() {
   server.send(200, "text/html", html);
 }
 
-void handleStatus() {
-  String json = "{";
-  for (int i = 0; i < 4; i++) {
-    json += "\"relay" + String(i + 1) + "\":" + String(relayStates[i] ? "true" : "false");
-    if (i < 3) json += ",";
+const char* renderStatus() {
+  if (statusDirty) {
+    statusJsonLength = snprintf(statusJson, sizeof(statusJson),
+                                "{\"relay1\":%s,\"relay2\":%s,\"relay3\":%s,\"relay4\":%s}",
+                                relayStates[0] ? "true" : "false", relayStates[1] ? "true" : "false",
+                                relayStates[2] ? "true" : "false", relayStates[3] ? "true" : "false");
+    statusDirty = false;
   }
-  json += "}";
-  
-  server.send(200, "application/json", json);
+  return statusJson;
+}
+
+void handleStatus() {
+  renderStatus();
+  // send_P takes the buffer and length directly instead of copying it into a String
+  server.send_P(200, "application/json", statusJson, statusJsonLength);
 }
 
 void handleRelay() {
@@ -209,6 +228,63 @@ void handleAllRelays() {
   }
 }
 
+void handleBatch() {
+  // Relays to switch, as bitmasks (bit 0 = relay 1): ?on=3&off=4
+  // or as a list with one target state: ?relays=1,2&state=true
+  long onMask = 0;
+  long offMask = 0;
+  
+  if (server.hasArg("on") || server.hasArg("off")) {
+    onMask = server.arg("on").toInt();
+    offMask = server.arg("off").toInt();
+  } else if (server.hasArg("relays") && server.hasArg("state")) {
+    String relays = server.arg("relays");
+    long mask = 0;
+    int start = 0;
+    while (start <= (int)relays.length()) {
+      int comma = relays.indexOf(',', start);
+      if (comma < 0) comma = relays.length();
+      int relay = relays.substring(start, comma).toInt() - 1;
+      if (relay < 0 || relay >= 4) {
+        server.send(400, "application/json", "{\"error\":\"Invalid relay\"}");
+        return;
+      }
+      mask |= 1 << relay;
+      start = comma + 1;
+    }
+    if (server.arg("state") == "true") {
+      onMask = mask;
+    } else {
+      offMask = mask;
+    }
+  } else {
+    server.send(400, "application/json", "{\"error\":\"Missing parameters\"}");
+    return;
+  }
+  
+  if (onMask < 0 || offMask < 0 || onMask > 15 || offMask > 15) {
+    server.send(400, "application/json", "{\"error\":\"Invalid relay mask\"}");
+    return;
+  }
+  if (onMask & offMask) {
+    server.send(400, "application/json", "{\"error\":\"Conflicting relays\"}");
+    return;
+  }
+  
+  for (int i = 0; i < 4; i++) {
+    if (onMask & (1 << i)) {
+      setRelay(i, true);
+    } else if (offMask & (1 << i)) {
+      setRelay(i, false);
+    }
+  }
+  
+  // Reply with the resulting state so callers don't need another /api/status
+  char json[112];
+  int length = snprintf(json, sizeof(json), "{\"success\":true,%s", renderStatus() + 1);
+  server.send_P(200, "application/json", json, length);
+}
+
 void readButtons() {
   for (int i = 0; i < 4; i++) {
     currentButtonStates[i] = digitalRead(buttonPins[i]);
@@ -228,6 +304,8 @@ void readButtons() {
 void setRelay(int relay, bool state) {
   if (relay >= 0 && relay < 4) {
     relayStates[relay] = state;
+    statusDirty = true;
+    firebaseDirty = true;
     digitalWrite(relayPins[relay], state ? LOW : HIGH); // Active LOW relay
     Serial.println("Relay " + String(relay + 1) + " " + (state ? "ON" : "OFF"));
   }
@@ -235,13 +313,16 @@ void setRelay(int relay, bool state) {
 
 void updateFirebase() {
   if (Firebase.ready()) {
-    FirebaseJson json;
-    for (int i = 0; i < 4; i++) {
-      json.set("relay" + String(i + 1), relayStates[i]);
+    if (firebaseDirty) {
+      for (int i = 0; i < 4; i++) {
+        firebaseJson.set(relayKeys[i], relayStates[i]);
+      }
+      firebaseDirty = false;
     }
-    json.set("timestamp", millis());
+    // The timestamp still changes every update and doubles as a heartbeat
+    firebaseJson.set("timestamp", millis());
     
-    if (Firebase.RTDB.setJSON(&fbdo, "/devices/esp32", &json)) {
+    if (Firebase.RTDB.setJSON(&fbdo, "/devices/esp32", &firebaseJson)) {
       // Success
     } else {
       Serial.println("Firebase update failed: " + fbdo.errorReason());
@@ -544,8 +625,15 @@ class HomeControl {
     
     init() {
         this.setupEventListeners();
-        this.startStatusUpdates();
-        this.loadInitialState();
+        // ?push=http://gateway:8090 switches from polling to push_gateway.py events
+        const params = new URLSearchParams(window.location.search);
+        const gateway = params.get('push');
+        if (gateway && window.EventSource) {
+            this.startPush(gateway, params.get('board') || 'esp32');
+        } else {
+            this.startStatusUpdates();
+            this.loadInitialState();
+        }
     }
     
     setupEventListeners() {
@@ -645,6 +733,39 @@ class HomeControl {
             }
         }, 2000);
     }
+    
+    startPush(gateway, board) {
+        const source = new EventSource(`${gateway.replace(/\/$/, '')}/events?board=${encodeURIComponent(board)}`);
+        const status = document.getElementById('connection-status');
+        
+        source.addEventListener('snapshot', (e) => {
+            const data = JSON.parse(e.data)[board];
+            if (data) this.applyState(data);
+            status.textContent = '🟢 Connected';
+        });
+        source.addEventListener('delta', (e) => {
+            const changes = {};
+            for (const delta of JSON.parse(e.data)) {
+                changes[delta.field] = delta.value;
+            }
+            this.applyState(changes);
+        });
+        // EventSource reconnects by itself and receives a fresh snapshot
+        source.onerror = () => {
+            status.textContent = '🔴 Disconnected';
+        };
+    }
+    
+    applyState(data) {
+        for (let i = 1; i <= 4; i++) {
+            const state = data[`relay${i}`];
+            const checkbox = document.getElementById(`relay${i}`);
+            if (typeof state === 'boolean' && checkbox.checked !== state) {
+                checkbox.checked = state;
+                this.updateRelayStatus(i, state);
+            }
+        }
+    }
 }
 
 // Initialize the home control system
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Fleet Client
+Asyncio client that addresses many relay and sensor boards by name concurrently
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from device_client import format_state, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from metrics import METRICS
+
+# The ESP32 WebServer serves one client at a time; more in-flight requests
+# per board only queue up on the board itself
+DEFAULT_PER_HOST_LIMIT = 1
+DEFAULT_TOTAL_LIMIT = 100
+
+# aiohttp is imported when a FleetClient is first built, so modules that only
+# need load_fleet() do not pay for it at startup
+
+
+def load_fleet(source):
+    """Load a {name: url} mapping from a JSON file or a list of name=url strings"""
+    if isinstance(source, dict):
+        return {name: url.rstrip('/') for name, url in source.items()}
+
+    if isinstance(source, str):
+        with open(source, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            data = {entry['name']: entry['url'] for entry in data}
+        return {name: url.rstrip('/') for name, url in data.items()}
+
+    fleet = {}
+    for entry in source:
+        name, _, url = entry.partition('=')
+        if not url:
+            url, name = name, name
+        if not url.startswith('http'):
+            url = f"http://{url}"
+        fleet[name] = url.rstrip('/')
+    return fleet
+
+
+class FleetClient:
+    def __init__(self, devices, per_host_limit=DEFAULT_PER_HOST_LIMIT, total_limit=DEFAULT_TOTAL_LIMIT,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, retries=1):
+        import aiohttp
+        self.devices = load_fleet(devices)
+        self.per_host_limit = per_host_limit
+        self.total_limit = total_limit
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.session = None
+        self.semaphores = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """Create the shared keep-alive session"""
+        if self.session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.total_limit, limit_per_host=self.per_host_limit)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        # Semaphores bind to the loop they first wait on, and run() starts a new loop each time
+        self.semaphores = {}
+
+    def _semaphore(self, url):
+        # Limit in-flight requests per board, keyed by host so two names that
+        # point at the same board share one limit
+        host = url.split('://', 1)[-1].split('/', 1)[0]
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self.semaphores[host] = semaphore
+        return semaphore
+
+    async def request(self, name, path, params=None):
+        """GET a path on one board and return a result dict"""
+        import aiohttp
+        await self.open()
+        url = self.devices[name]
+        result = {'device': name, 'path': path, 'ok': False, 'status': None, 'data': None,
+                  'body': None, 'error': None, 'latency_ms': None}
+
+        async with self._semaphore(url):
+            start = time.perf_counter()
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self.session.get(f"{url}{path}", params=params) as response:
+                        result['status'] = response.status
+                        body = await response.text()
+                    result['body'] = body
+                    try:
+                        result['data'] = json.loads(body)
+                    except ValueError:
+                        result['data'] = body
+                    result['ok'] = response.status == 200
+                    result['error'] = None
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    result['error'] = str(e) or type(e).__name__
+                    if attempt < self.retries:
+                        await asyncio.sleep(0.1 * (2 ** attempt))
+            elapsed = time.perf_counter() - start
+            result['latency_ms'] = elapsed * 1000
+
+        # Requests interleave on the event loop, so record the duration
+        # directly instead of through a (thread-stacked) span
+        METRICS.observe("http", elapsed, (('board', name), ('endpoint', path)))
+        METRICS.count("requests", board=name, endpoint=path, outcome="success" if result['ok'] else "failure")
+        return result
+
+    async def fan_out(self, path, names=None, params=None):
+        """Issue the same request to many boards concurrently"""
+        names = list(self.devices) if names is None else list(names)
+        results = await asyncio.gather(*(self.request(name, path, params) for name in names))
+        return {result['device']: result for result in results}
+
+    async def get_status(self, names=None):
+        """GET /api/status on every named relay board"""
+        return await self.fan_out("/api/status", names)
+
+    async def get_sensors(self, names=None):
+        """GET /api/sensors on every named sensor board"""
+        return await self.fan_out("/api/sensors", names)
+
+    async def set_relay(self, name, relay, state):
+        """GET /api/relay on one board"""
+        return await self.request(name, "/api/relay", {"relay": relay, "state": format_state(state)})
+
+    async def set_all(self, state, names=None):
+        """GET /api/all on every named board"""
+        return await self.fan_out("/api/all", names, {"state": format_state(state)})
+
+    async def apply(self, commands):
+        """Run a list of (name, relay, state) commands concurrently"""
+        return await asyncio.gather(*(self.set_relay(name, relay, state) for name, relay, state in commands))
+
+    def run(self, coroutine_function, *args, **kwargs):
+        """Run one fleet operation from synchronous code"""
+        async def runner():
+            try:
+                return await coroutine_function(*args, **kwargs)
+            finally:
+                await self.close()
+        return asyncio.run(runner())
+
+
+def summarize(results):
+    """Count reachable boards and relays that are on across a status sweep"""
+    reachable = [result for result in results.values() if result['ok']]
+    relays_on = 0
+    relays_total = 0
+    for result in reachable:
+        if isinstance(result['data'], dict):
+            for key, value in result['data'].items():
+                if key.startswith('relay'):
+                    relays_total += 1
+                    relays_on += 1 if value else 0
+    return {
+        'boards': len(results),
+        'reachable': len(reachable),
+        'relays_on': relays_on,
+        'relays_total': relays_total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Fleet Client')
+    parser.add_argument('--fleet', required=True, help='JSON file mapping board names to URLs')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT, help='Concurrent requests per board (default: 1)')
+    parser.add_argument('command', choices=['status', 'sensors', 'all-on', 'all-off'], help='Operation to run on every board')
+
+    args = parser.parse_args()
+
+    client = FleetClient(args.fleet, per_host_limit=args.per_host)
+    start = time.perf_counter()
+    if args.command == 'status':
+        results = client.run(client.get_status)
+    elif args.command == 'sensors':
+        results = client.run(client.get_sensors)
+    else:
+        results = client.run(client.set_all, args.command == 'all-on')
+    elapsed = (time.perf_counter() - start) * 1000
+
+    for name, result in results.items():
+        status = "✅" if result['ok'] else "❌"
+        detail = result['data'] if result['ok'] else (result['error'] or f"HTTP {result['status']}")
+        print(f"{status} {name:<20} {result['latency_ms']:>8.1f}ms  {detail}")
+
+    slowest = max((result['latency_ms'] for result in results.values()), default=0)
+    print(f"\n{len(results)} boards in {elapsed:.1f}ms (slowest board {slowest:.1f}ms)")
+    sys.exit(0 if all(result['ok'] for result in results.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Load Generator
+Mixed-endpoint load generation with HDR-style latency histograms
+"""
+
+import os
+import time
+import random
+import threading
+import itertools
+
+import requests
+
+from device_client import ESP32Client
+
+# Endpoints the load generator knows how to drive
+ENDPOINTS = ('status', 'relay', 'sensors')
+DEFAULT_MIX = {'status': 6, 'relay': 3, 'sensors': 1}
+
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+# Soak defaults: a handful of dashboards and the odd voice command, for hours
+DEFAULT_SOAK_RATE = 5.0
+DEFAULT_SOAK_WINDOW = 60.0
+DEFAULT_P99_DRIFT = 0.5
+DEFAULT_BASELINE_WINDOWS = 3
+DEFAULT_RSS_GROWTH = 0.25
+DEFAULT_FD_GROWTH = 16
+RESOURCE_FINDINGS = ('rss_growth', 'fd_growth')
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are stored in microseconds. Each power-of-two range is split into
+    sub_bucket_half linear buckets, giving a fixed relative precision (under
+    1% with the default 2 significant digits) and constant-time recording
+    regardless of how many samples are taken.
+    """
+
+    def __init__(self, significant_digits=2):
+        sub_bucket_count = 1
+        while sub_bucket_count < 2 * 10 ** significant_digits:
+            sub_bucket_count <<= 1
+        self.sub_bucket_count = sub_bucket_count
+        self.sub_bucket_half = sub_bucket_count // 2
+        self.unit_bits = sub_bucket_count.bit_length() - 1
+        self.significant_digits = significant_digits
+
+        self.counts = [0] * sub_bucket_count
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def _index(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.unit_bits
+        return self.sub_bucket_count + (shift - 1) * self.sub_bucket_half + ((value >> shift) - self.sub_bucket_half)
+
+    def _value_at(self, index):
+        """Midpoint of the value range covered by a bucket"""
+        if index < self.sub_bucket_count:
+            return index
+        offset = index - self.sub_bucket_count
+        shift = offset // self.sub_bucket_half + 1
+        lower = (offset % self.sub_bucket_half + self.sub_bucket_half) << shift
+        return lower + ((1 << shift) - 1) // 2
+
+    def record(self, seconds):
+        """Record one latency sample given in seconds"""
+        self.record_us(int(seconds * 1e6))
+
+    def record_us(self, value, count=1):
+        value = max(int(value), 0)
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += count
+        self.total += count
+        self.sum_us += value * count
+        if self.min_us is None or value < self.min_us:
+            self.min_us = value
+        if value > self.max_us:
+            self.max_us = value
+
+    def merge(self, other):
+        """Add another histogram's samples into this one"""
+        if other.sub_bucket_count != self.sub_bucket_count:
+            raise ValueError("Cannot merge histograms with different precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None and (self.min_us is None or other.min_us < self.min_us):
+            self.min_us = other.min_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, percentile):
+        """Latency in microseconds at the given percentile (0-100)"""
+        if self.total == 0:
+            return 0
+        target = max(1, int(percentile / 100.0 * self.total + 0.5))
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return min(self._value_at(index), self.max_us)
+        return self.max_us
+
+    @property
+    def mean_us(self):
+        return self.sum_us / self.total if self.total else 0.0
+
+    def summary(self):
+        """Percentiles and extremes in milliseconds"""
+        result = {'count': self.total}
+        for percentile in REPORTED_PERCENTILES:
+            result[f"p{percentile:g}_ms"] = self.percentile(percentile) / 1000
+        result['min_ms'] = (self.min_us or 0) / 1000
+        result['max_ms'] = self.max_us / 1000
+        result['mean_ms'] = self.mean_us / 1000
+        return result
+
+
+def parse_mix(text):
+    """Parse "status=6,relay=3,sensors=1" into a weight mapping"""
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}', expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("Load mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+class EndpointStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.errors += other.errors
+
+
+class LoadGenerator:
+    """Drives a weighted mix of endpoints at a target rate or concurrency.
+
+    With rate set, requests are issued on a fixed schedule and latency is
+    measured from the scheduled send time, so a stalled board shows up as
+    latency instead of silently lowering the request rate. Without rate, each
+    worker sends its next request as soon as the previous one completes.
+    """
+
+    def __init__(self, base_url, sensor_url=None, mix=None, rate=None, concurrency=4, duration=10,
+                 timeout=5, seed=None):
+        self.base_url = base_url.rstrip('/')
+        self.sensor_url = (sensor_url or base_url).rstrip('/')
+        self.mix = dict(mix or DEFAULT_MIX)
+        self.rate = rate
+        self.concurrency = max(1, concurrency)
+        self.duration = duration
+        self.timeout = timeout
+        self.seed = seed
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """End the run early; workers finish their current request"""
+        self.stopped.set()
+
+    def run(self):
+        """Run the load test and return the per-endpoint report"""
+        names = [name for name in self.mix if self.mix[name] > 0]
+        weights = [self.mix[name] for name in names]
+        ticket = itertools.count()
+        ticket_lock = threading.Lock()
+        results = []
+        results_lock = threading.Lock()
+
+        start = time.perf_counter()
+        deadline = start + self.duration
+
+        def worker(worker_id):
+            rng = random.Random(None if self.seed is None else self.seed + worker_id)
+            relay_client = ESP32Client(self.base_url, read_timeout=self.timeout, retries=0)
+            sensor_client = relay_client
+            if self.sensor_url != self.base_url:
+                sensor_client = ESP32Client(self.sensor_url, read_timeout=self.timeout, retries=0)
+            stats = {name: EndpointStats() for name in names}
+
+            while True:
+                if self.rate:
+                    with ticket_lock:
+                        n = next(ticket)
+                    scheduled = start + n / self.rate
+                    if scheduled >= deadline or self.stopped.is_set():
+                        break
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0 and self.stopped.wait(delay):
+                        break
+                else:
+                    scheduled = time.perf_counter()
+                    if scheduled >= deadline or self.stopped.is_set():
+                        break
+
+                name = rng.choices(names, weights)[0]
+                ok = self._issue(name, relay_client, sensor_client, rng)
+                elapsed = time.perf_counter() - scheduled
+                self._record(stats, name, elapsed, ok)
+
+            relay_client.close()
+            if sensor_client is not relay_client:
+                sensor_client.close()
+            with results_lock:
+                results.append(stats)
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+        return self._build_report(names, results, elapsed)
+
+    def _record(self, stats, name, elapsed, ok):
+        stats[name].histogram.record(elapsed)
+        if not ok:
+            stats[name].errors += 1
+
+    def _issue(self, name, relay_client, sensor_client, rng):
+        try:
+            if name == 'status':
+                response = relay_client.get_status()
+            elif name == 'relay':
+                response = relay_client.set_relay(rng.randint(1, 4), rng.random() < 0.5)
+            else:
+                response = sensor_client.get_sensors()
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def _build_report(self, names, results, elapsed):
+        merged = {name: EndpointStats() for name in names}
+        for stats in results:
+            for name, endpoint_stats in stats.items():
+                merged[name].merge(endpoint_stats)
+
+        overall = EndpointStats()
+        report = {
+            'config': {
+                'base_url': self.base_url,
+                'sensor_url': self.sensor_url,
+                'mix': self.mix,
+                'rate': self.rate,
+                'concurrency': self.concurrency,
+                'duration_s': self.duration,
+            },
+            'elapsed_s': elapsed,
+            'endpoints': {},
+        }
+        for name in names:
+            overall.merge(merged[name])
+            report['endpoints'][name] = self._endpoint_report(merged[name], elapsed)
+        report['overall'] = self._endpoint_report(overall, elapsed)
+        return report
+
+    @staticmethod
+    def _endpoint_report(stats, elapsed):
+        summary = stats.histogram.summary()
+        count = summary['count']
+        summary['errors'] = stats.errors
+        summary['error_rate'] = stats.errors / count if count else 0.0
+        summary['throughput_rps'] = count / elapsed if elapsed > 0 else 0.0
+        return summary
+
+
+def compare_reports(baseline, candidate):
+    """Per-endpoint throughput and latency of a candidate run relative to a baseline run"""
+    rows = []
+    names = [name for name in candidate['endpoints'] if name in baseline['endpoints']] + ['overall']
+    for name in names:
+        before = baseline['overall'] if name == 'overall' else baseline['endpoints'][name]
+        after = candidate['overall'] if name == 'overall' else candidate['endpoints'][name]
+        row = {'endpoint': name}
+        for key in ('throughput_rps', 'p50_ms', 'p99_ms', 'error_rate'):
+            row[f"baseline_{key}"] = before[key]
+            row[f"candidate_{key}"] = after[key]
+            row[f"{key}_change"] = after[key] / before[key] - 1 if before[key] else None
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows):
+    """Render compare_reports() output as a table"""
+    def change(value):
+        return f"{value * 100:+.1f}%" if value is not None else "-"
+
+    lines = [f"{'endpoint':<10} {'rps before':>10} {'rps after':>10} {'change':>8} "
+             f"{'p50 before':>10} {'p50 after':>10} {'p99 before':>10} {'p99 after':>10} {'change':>8}"]
+    for row in rows:
+        lines.append(f"{row['endpoint']:<10} {row['baseline_throughput_rps']:>10.1f} {row['candidate_throughput_rps']:>10.1f} "
+                     f"{change(row['throughput_rps_change']):>8} {row['baseline_p50_ms']:>10.2f} "
+                     f"{row['candidate_p50_ms']:>10.2f} {row['baseline_p99_ms']:>10.2f} "
+                     f"{row['candidate_p99_ms']:>10.2f} {change(row['p99_ms_change']):>8}")
+    lines.append("(before = --compare-url, after = --url; latencies in ms)")
+    return "\n".join(lines)
+
+
+def format_report(report):
+    """Render a load report as a table"""
+    lines = [f"{'endpoint':<10} {'count':>7} {'rps':>8} {'err%':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8} {'max':>8}"]
+    rows = list(report['endpoints'].items()) + [('overall', report['overall'])]
+    for name, stats in rows:
+        lines.append(f"{name:<10} {stats['count']:>7} {stats['throughput_rps']:>8.1f} {stats['error_rate'] * 100:>6.2f} "
+                     f"{stats['p50_ms']:>8.2f} {stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+                     f"{stats['p99.9_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+    lines.append("(latencies in ms)")
+    return "\n".join(lines)
+
+
+def process_resources():
+    """Resident memory (bytes) and open file descriptors of this process, None where unknown"""
+    if psutil is not None:
+        process = psutil.Process()
+        try:
+            fds = process.num_fds()
+        except AttributeError:
+            fds = process.num_handles()
+        return {'rss_bytes': process.memory_info().rss, 'open_fds': fds}
+
+    resources = {'rss_bytes': None, 'open_fds': None}
+    try:
+        with open('/proc/self/statm') as f:
+            resources['rss_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        resources['open_fds'] = len(os.listdir('/proc/self/fd'))
+    except (OSError, ValueError, IndexError):
+        pass
+    return resources
+
+
+def slope_per_hour(windows, key):
+    """Least-squares trend of a window field in units per hour, or None"""
+    points = [(window['end_s'], window[key]) for window in windows if window.get(key) is not None]
+    if len(points) < 2:
+        return None
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    variance = sum((t - mean_t) ** 2 for t, _ in points)
+    if variance == 0:
+        return None
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / variance * 3600
+
+
+def detect_drift(windows, p99_drift=DEFAULT_P99_DRIFT, max_error_rate=0.01,
+                 baseline_windows=DEFAULT_BASELINE_WINDOWS, rss_growth=DEFAULT_RSS_GROWTH, fd_growth=DEFAULT_FD_GROWTH):
+    """Findings for a soak time series: p99 drift, error bursts and client resource growth.
+
+    The p99 baseline is the median of the first baseline_windows windows;
+    drift is flagged when two consecutive windows exceed it by more than
+    p99_drift (a fraction). Resource growth compares the last window with
+    the first one, since the first window includes connection setup.
+    """
+    findings = []
+    for window in windows:
+        if window['count'] and window['error_rate'] > max_error_rate:
+            findings.append({'kind': 'error_burst', 'window': window['index'],
+                             'message': f"{window['errors']} errors ({window['error_rate'] * 100:.1f}%) "
+                                        f"in window {window['index']}"})
+
+    measured = [window for window in windows if window['count']]
+    if len(measured) > baseline_windows:
+        baseline = sorted(window['p99_ms'] for window in measured[:baseline_windows])[baseline_windows // 2]
+        limit = baseline * (1 + p99_drift)
+        previous = None
+        for window in measured[baseline_windows:]:
+            if window['p99_ms'] > limit and previous is not None and previous['p99_ms'] > limit:
+                findings.append({'kind': 'p99_drift', 'window': window['index'],
+                                 'message': f"p99 {window['p99_ms']:.1f}ms in window {window['index']} "
+                                            f"vs baseline {baseline:.1f}ms"})
+            previous = window
+
+    if len(windows) >= 2:
+        first, last = windows[0], windows[-1]
+        if first.get('rss_bytes') and last.get('rss_bytes') and last['rss_bytes'] > first['rss_bytes'] * (1 + rss_growth):
+            findings.append({'kind': 'rss_growth', 'window': last['index'],
+                             'message': f"client RSS grew {first['rss_bytes'] / 2 ** 20:.1f}MB -> "
+                                        f"{last['rss_bytes'] / 2 ** 20:.1f}MB"})
+        if first.get('open_fds') is not None and last.get('open_fds') is not None \
+                and last['open_fds'] - first['open_fds'] >= fd_growth:
+            findings.append({'kind': 'fd_growth', 'window': last['index'],
+                             'message': f"client open FDs grew {first['open_fds']} -> {last['open_fds']}"})
+    return findings
+
+
+class SoakTest(LoadGenerator):
+    """Long-running load with per-window percentiles and client resource samples.
+
+    Traffic is generated exactly as in LoadGenerator, by default at a modest
+    fixed rate. Every window seconds the samples of that window are summarized
+    on their own, together with this process's RSS and open file descriptors,
+    so slow degradation on the board (latency creep, error bursts) or in the
+    client (leaked memory or sockets) shows up as a trend instead of being
+    averaged away over hours.
+    """
+
+    def __init__(self, base_url, sensor_url=None, mix=None, rate=DEFAULT_SOAK_RATE, concurrency=4, duration=3600,
+                 window=DEFAULT_SOAK_WINDOW, timeout=5, seed=None, on_window=None, p99_drift=DEFAULT_P99_DRIFT,
+                 max_error_rate=0.01, baseline_windows=DEFAULT_BASELINE_WINDOWS, rss_growth=DEFAULT_RSS_GROWTH,
+                 fd_growth=DEFAULT_FD_GROWTH):
+        super().__init__(base_url, sensor_url, mix, rate, concurrency, duration, timeout, seed)
+        self.window = window
+        self.on_window = on_window
+        self.drift_options = {'p99_drift': p99_drift, 'max_error_rate': max_error_rate,
+                              'baseline_windows': baseline_windows, 'rss_growth': rss_growth, 'fd_growth': fd_growth}
+        self.window_lock = threading.Lock()
+        self.window_stats = {}
+        self.windows = []
+        self.findings = []
+
+    def _record(self, stats, name, elapsed, ok):
+        super()._record(stats, name, elapsed, ok)
+        with self.window_lock:
+            current = self.window_stats.get(name)
+            if current is None:
+                current = self.window_stats[name] = EndpointStats()
+            current.histogram.record(elapsed)
+            if not ok:
+                current.errors += 1
+
+    def _close_window(self, started, now):
+        with self.window_lock:
+            stats, self.window_stats = self.window_stats, {}
+
+        overall = EndpointStats()
+        for endpoint_stats in stats.values():
+            overall.merge(endpoint_stats)
+        window = self._endpoint_report(overall, now - started)
+        window['index'] = len(self.windows)
+        window['end_s'] = now - self.run_started
+        window['endpoint_p99_ms'] = {name: endpoint_stats.histogram.percentile(99) / 1000
+                                     for name, endpoint_stats in stats.items()}
+        window.update(process_resources())
+        self.windows.append(window)
+
+        # Resource growth is re-detected every window once it starts; report it once
+        known = {(finding['kind'], finding['window']) for finding in self.findings}
+        known_kinds = {finding['kind'] for finding in self.findings}
+        new = [finding for finding in detect_drift(self.windows, **self.drift_options)
+               if (finding['kind'], finding['window']) not in known
+               and not (finding['kind'] in RESOURCE_FINDINGS and finding['kind'] in known_kinds)]
+        self.findings.extend(new)
+        if self.on_window is not None:
+            self.on_window(window, new)
+
+    def run(self):
+        """Run the soak and return the load report with 'windows' and 'findings' added"""
+        result = {}
+        done = threading.Event()
+
+        def load():
+            try:
+                result['report'] = super(SoakTest, self).run()
+            finally:
+                done.set()
+
+        self.run_started = time.perf_counter()
+        threading.Thread(target=load, name="soak-load", daemon=True).start()
+
+        # Waiting on an Event rather than Thread.join(), which a Ctrl+C can leave
+        # reporting the thread as finished while it is still running
+        window_start = self.run_started
+        try:
+            while not done.wait(max(0.0, window_start + self.window - time.perf_counter())):
+                now = time.perf_counter()
+                if now >= window_start + self.window:
+                    self._close_window(window_start, now)
+                    window_start = now
+        except KeyboardInterrupt:
+            # Keep what was measured so far
+            self.stop()
+            done.wait()
+
+        now = time.perf_counter()
+        if self.window_stats:
+            self._close_window(window_start, now)
+
+        report = result['report']
+        report['config']['window_s'] = self.window
+        report['windows'] = self.windows
+        report['findings'] = self.findings
+        report['trends'] = {
+            'p99_ms_per_hour': slope_per_hour(self.windows, 'p99_ms'),
+            'rss_bytes_per_hour': slope_per_hour(self.windows, 'rss_bytes'),
+            'open_fds_per_hour': slope_per_hour(self.windows, 'open_fds'),
+        }
+        return report
+
+
+def format_window(window):
+    """One-line summary of a soak window"""
+    rss = f"{window['rss_bytes'] / 2 ** 20:.1f}MB" if window.get('rss_bytes') else "-"
+    fds = window['open_fds'] if window.get('open_fds') is not None else "-"
+    return (f"window {window['index']:>4} @ {window['end_s'] / 60:>7.1f}min: {window['count']:>6} req, "
+            f"{window['error_rate'] * 100:>5.2f}% err, p50 {window['p50_ms']:.1f}ms, p99 {window['p99_ms']:.1f}ms, "
+            f"max {window['max_ms']:.1f}ms, rss {rss}, fds {fds}")
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Proxy Gateway
+Caching reverse proxy that keeps dashboard traffic off the boards
+"""
+
+import os
+import gzip
+import time
+import asyncio
+import hashlib
+import argparse
+
+from aiohttp import web
+
+from fleet_client import FleetClient, load_fleet
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_PORT = 8080
+DEFAULT_ASSET_TTL = 3600.0
+
+# Static pages and the content type the firmware serves them with
+ASSETS = {
+    '/': 'text/html',
+    '/style.css': 'text/css',
+    '/script.js': 'application/javascript',
+}
+READ_PATHS = ('/api/status', '/api/sensors')
+MUTATING_PATHS = ('/api/relay', '/api/all', '/api/batch')
+
+# Smaller bodies are not worth the compression framing
+MIN_COMPRESS_SIZE = 256
+
+
+def accepted_encodings(header):
+    """Content codings from an Accept-Encoding header, ignoring q=0"""
+    accepted = set()
+    for token in header.split(','):
+        coding, _, params = token.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if coding:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class CachedAsset:
+    __slots__ = ('digest', 'content_type', 'variants')
+
+    def __init__(self, digest, content_type, variants):
+        self.digest = digest
+        self.content_type = content_type
+        self.variants = variants
+
+    def etag(self, encoding):
+        return f'"{self.digest}"' if encoding == 'identity' else f'"{self.digest}-{encoding}"'
+
+    def negotiate(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return 'identity'
+
+
+class AssetCache:
+    """Static assets stored once per content hash, precompressed.
+
+    Boards running the same firmware serve identical pages, so the whole
+    fleet shares one copy of each. Each (board, path) is fetched from the
+    board at most once per ttl; compressed variants are written next to the
+    raw file under cache_dir and reused across restarts.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_ASSET_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.assets = {}
+        self.index = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def lookup(self, board, path, now=None):
+        """Cached asset for a board's path, or None when missing or expired"""
+        entry = self.index.get((board, path))
+        if entry is None:
+            return None
+        asset, fetched = entry
+        if (time.monotonic() if now is None else now) - fetched >= self.ttl:
+            return None
+        return asset
+
+    def store(self, board, path, content_type, body, now=None):
+        """Remember a freshly fetched body and return its cached asset"""
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        asset = self.assets.get(digest)
+        if asset is None:
+            asset = CachedAsset(digest, content_type, self._variants(digest, body))
+            self.assets[digest] = asset
+        self.index[(board, path)] = (asset, time.monotonic() if now is None else now)
+        return asset
+
+    def _variants(self, digest, body):
+        variants = {'identity': body}
+        if len(body) < MIN_COMPRESS_SIZE:
+            return variants
+        compressors = {'gzip': lambda data: gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            compressors['br'] = lambda data: brotli.compress(data, quality=11)
+
+        for encoding, compress in compressors.items():
+            path = os.path.join(self.cache_dir, f"{digest}.{encoding}") if self.cache_dir else None
+            if path and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    variants[encoding] = f.read()
+                continue
+            variants[encoding] = compress(body)
+            if path:
+                with open(path, 'wb') as f:
+                    f.write(variants[encoding])
+        if self.cache_dir:
+            raw = os.path.join(self.cache_dir, digest)
+            if not os.path.exists(raw):
+                with open(raw, 'wb') as f:
+                    f.write(body)
+        return variants
+
+
+class ProxyGateway:
+    """Reverse proxy for a fleet of boards.
+
+    Static pages come from the asset cache with ETag revalidation, so a
+    browser reload costs the board nothing. Concurrent identical reads
+    share one upstream request (single-flight) and may optionally be served
+    from a short-lived cache. Only mutating calls are always forwarded, and
+    each one invalidates the cached reads of its board.
+
+    Boards are addressed as /boards/<name>/...; plain paths go to the board
+    whose dashboard was last opened (cookie) or the first configured board.
+    """
+
+    def __init__(self, boards, asset_cache=None, read_ttl=0.0, fleet=None):
+        self.boards = load_fleet(boards)
+        self.default_board = next(iter(self.boards))
+        self.fleet = fleet or FleetClient(self.boards)
+        self.assets = asset_cache or AssetCache()
+        self.read_ttl = read_ttl
+        self.reads = {}
+        self.inflight = {}
+        self.stats_data = {
+            'requests': 0,
+            'asset_hits': 0,
+            'asset_fetches': 0,
+            'not_modified': 0,
+            'reads': 0,
+            'read_hits': 0,
+            'coalesced': 0,
+            'mutations': 0,
+            'upstream_requests': 0,
+            'bytes_sent': 0,
+            'bytes_saved': 0,
+        }
+
+    def route(self, request):
+        """(board, path) for a request"""
+        path = request.path
+        if path.startswith('/boards/'):
+            board, _, tail = path[len('/boards/'):].partition('/')
+            return board, '/' + tail
+        board = request.cookies.get('board')
+        return (board if board in self.boards else self.default_board), path
+
+    async def handle(self, request):
+        self.stats_data['requests'] += 1
+        board, path = self.route(request)
+        if board not in self.boards:
+            return web.json_response({'error': 'Unknown board'}, status=404)
+
+        if path in ASSETS:
+            response = await self.serve_asset(request, board, path)
+            if path == '/' and request.path.startswith('/boards/'):
+                # Remember the board so the page's absolute /api/... calls reach it
+                response.set_cookie('board', board, path='/')
+            return response
+        if path in READ_PATHS:
+            return await self.serve_read(request, board, path)
+        if path in MUTATING_PATHS:
+            return await self.forward_mutation(request, board, path)
+        return web.Response(status=404, text=f"Not found: {path}")
+
+    async def serve_asset(self, request, board, path):
+        asset = self.assets.lookup(board, path)
+        if asset is None:
+            # Dashboards opened together after a restart or expiry share one fetch
+            key = (board, path)
+            task = self.inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch_asset(board, path))
+                self.inflight[key] = task
+                task.add_done_callback(lambda done, key=key: self._fetch_done(key, done))
+            else:
+                self.stats_data['coalesced'] += 1
+            asset, result = await asyncio.shield(task)
+            if asset is None:
+                return self._upstream_error(result)
+        else:
+            self.stats_data['asset_hits'] += 1
+
+        encoding = asset.negotiate(request.headers.get('Accept-Encoding', ''))
+        etag = asset.etag(encoding)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        identity_size = len(asset.variants['identity'])
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*':
+            self.stats_data['not_modified'] += 1
+            self.stats_data['bytes_saved'] += identity_size
+            return web.Response(status=304, headers=headers)
+
+        body = asset.variants[encoding]
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        self.stats_data['bytes_sent'] += len(body)
+        self.stats_data['bytes_saved'] += identity_size - len(body)
+        return web.Response(body=body, content_type=asset.content_type, charset='utf-8', headers=headers)
+
+    async def _fetch_asset(self, board, path):
+        result = await self._upstream(board, path)
+        if not result['ok']:
+            return None, result
+        self.stats_data['asset_fetches'] += 1
+        return self.assets.store(board, path, ASSETS[path], result['body'].encode('utf-8')), result
+
+    def _fetch_done(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+
+    async def serve_read(self, request, board, path):
+        self.stats_data['reads'] += 1
+        key = (board, path, request.query_string)
+
+        cached = self.reads.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.read_ttl:
+            self.stats_data['read_hits'] += 1
+            return self._json(cached[1])
+
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._upstream(board, path, dict(request.query) or None))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._read_done(key, done))
+        else:
+            self.stats_data['coalesced'] += 1
+
+        # shield() so one client disconnecting does not cancel the shared request
+        result = await asyncio.shield(task)
+        return self._json(result)
+
+    def _read_done(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+            if not task.cancelled() and task.result()['ok'] and self.read_ttl > 0:
+                self.reads[key] = (time.monotonic(), task.result())
+
+    async def forward_mutation(self, request, board, path):
+        self.stats_data['mutations'] += 1
+        # Reads that start from now on must see the new state
+        for key in [key for key in self.reads if key[0] == board]:
+            del self.reads[key]
+        for key in [key for key in self.inflight if key[0] == board and key[1] in READ_PATHS]:
+            del self.inflight[key]
+        result = await self._upstream(board, path, dict(request.query) or None)
+        return self._json(result)
+
+    async def _upstream(self, board, path, params=None):
+        self.stats_data['upstream_requests'] += 1
+        return await self.fleet.request(board, path, params)
+
+    def _json(self, result):
+        if result['status'] is None:
+            return self._upstream_error(result)
+        return web.Response(body=result['body'].encode('utf-8'), status=result['status'],
+                            content_type='application/json', headers={'Cache-Control': 'no-store'})
+
+    @staticmethod
+    def _upstream_error(result):
+        status = result['status'] or 502
+        return web.json_response({'error': result['error'] or f"HTTP {status} from board"},
+                                 status=502 if status < 500 else status)
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    def stats(self):
+        stats = dict(self.stats_data)
+        stats['cached_assets'] = len(self.assets.assets)
+        stats['brotli'] = brotli is not None
+        return stats
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/gateway/stats', self.handle_stats)
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app):
+        await self.fleet.close()
+
+
+async def run_benchmark(dashboards=20, rounds=10, readers=25, latency=0.005):
+    """Board requests and bytes for dashboard loads plus concurrent status reads, direct vs proxied"""
+    import aiohttp
+    from esp32_emulator import ESP32Emulator
+
+    async def fetch(session, url, **kwargs):
+        async with session.get(url, **kwargs) as response:
+            return await response.read()
+
+    async def workload(session, base):
+        # Every dashboard loads the page, revalidating its assets after the first visit
+        etags = {}
+        for _ in range(dashboards):
+            for path in ASSETS:
+                headers = {'Accept-Encoding': 'br, gzip'}
+                if path in etags:
+                    headers['If-None-Match'] = etags[path]
+                async with session.get(f"{base}{path}", headers=headers) as response:
+                    await response.read()
+                    if 'ETag' in response.headers:
+                        etags[path] = response.headers['ETag']
+        # Then polls status in bursts, as open dashboards do
+        for _ in range(rounds):
+            await asyncio.gather(*(fetch(session, f"{base}/api/status") for _ in range(readers)))
+        await fetch(session, f"{base}/api/relay", params={'relay': 1, 'state': 'true'})
+
+    for label in ("direct", "proxied"):
+        with ESP32Emulator(latency=latency) as emulator:
+            board = emulator.board
+            sent = [0]
+            handle = board.handle
+
+            def counting_handle(path, args):
+                status, content_type, body = handle(path, args)
+                sent[0] += len(body.encode('utf-8'))
+                return status, content_type, body
+            board.handle = counting_handle
+
+            runner = None
+            base = emulator.url
+            gateway = None
+            if label == "proxied":
+                gateway = ProxyGateway({'esp32': emulator.url})
+                runner = web.AppRunner(gateway.create_app())
+                await runner.setup()
+                site = web.TCPSite(runner, '127.0.0.1', 0)
+                await site.start()
+                base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+            start = time.perf_counter()
+            async with aiohttp.ClientSession(auto_decompress=False) as session:
+                await workload(session, base)
+            elapsed = time.perf_counter() - start
+            if runner is not None:
+                await runner.cleanup()
+
+            busy = board.request_count * latency
+            print(f"{label:<8} board requests {board.request_count:>4}, board bytes {sent[0]:>7}, "
+                  f"~{busy * 1000:.0f}ms board busy, wall {elapsed * 1000:.0f}ms")
+            if gateway is not None:
+                stats = gateway.stats()
+                print(f"         {stats['coalesced']} reads coalesced, {stats['not_modified']} asset 304s, "
+                      f"{stats['bytes_saved']} bytes saved by compression and revalidation "
+                      f"(brotli {'on' if stats['brotli'] else 'not installed'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Proxy Gateway')
+    parser.add_argument('--fleet', help='JSON file mapping board names to URLs')
+    parser.add_argument('--url', help='Single board (named "esp32")')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--cache-dir', help='Directory for the content-hashed asset cache')
+    parser.add_argument('--asset-ttl', type=float, default=DEFAULT_ASSET_TTL,
+                        help='Seconds before assets are fetched from the board again (default: 3600)')
+    parser.add_argument('--read-ttl', type=float, default=0.0,
+                        help='Serve status reads from cache for this many seconds (default: 0, coalescing only)')
+    parser.add_argument('--benchmark', action='store_true', help='Compare board load with and without the proxy')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        asyncio.run(run_benchmark())
+        return
+
+    boards = load_fleet(args.fleet) if args.fleet else {}
+    if args.url:
+        boards['esp32'] = args.url.rstrip('/')
+    if not boards:
+        parser.error("--url or --fleet is required")
+
+    gateway = ProxyGateway(boards, AssetCache(args.cache_dir, args.asset_ttl), args.read_ttl)
+    print(f"Proxy gateway for {len(boards)} boards on http://{args.host}:{args.port}/")
+    if brotli is None:
+        print("brotli not installed, serving gzip only")
+    web.run_app(gateway.create_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
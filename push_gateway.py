@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Push Gateway
+Polls each board once and pushes state changes to any number of dashboards over Server-Sent Events
+"""
+
+import json
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from fleet_client import FleetClient, load_fleet
+from state_sync import StateSync
+
+DEFAULT_PORT = 8090
+DEFAULT_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 64
+HEARTBEAT_INTERVAL = 15.0
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+def format_event(event, data):
+    """Encode one SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class PushClient:
+    """One connected browser with a bounded queue of pending events.
+
+    A client that falls behind never blocks polling or other clients: when
+    its queue is full the backlog is discarded and the client is resynced
+    with a single fresh snapshot once it catches up.
+    """
+
+    def __init__(self, boards=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.boards = set(boards) if boards else None
+        self.queue = asyncio.Queue(queue_size)
+        self.resync = False
+        self.sent = 0
+        self.dropped = 0
+
+    def wants(self, board):
+        return self.boards is None or board in self.boards
+
+    def offer(self, payload):
+        if self.resync:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync = True
+            # Wake the sender so it can send the snapshot
+            self.queue.put_nowait(None)
+
+
+class PushGateway:
+    """Single poller per board, fan-out to every subscribed browser.
+
+    Relay boards are polled on /api/status and sensor boards on /api/sensors
+    at a fixed interval regardless of how many dashboards are open. Bodies
+    go through StateSync, so unchanged responses cost no parsing and clients
+    only receive the fields that changed.
+    """
+
+    def __init__(self, relay_boards=None, sensor_boards=None, interval=DEFAULT_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE, deadbands=None):
+        self.relay_boards = load_fleet(relay_boards) if relay_boards else {}
+        self.sensor_boards = load_fleet(sensor_boards) if sensor_boards else {}
+        self.fleet = FleetClient({**self.relay_boards, **self.sensor_boards})
+        self.interval = interval
+        self.queue_size = queue_size
+        self.sync = StateSync(deadbands)
+        self.sync.subscribe(self.broadcast)
+        self.clients = set()
+        self.upstream_requests = 0
+        self.upstream_failures = 0
+        self.started = time.monotonic()
+        self.poll_task = None
+
+    def snapshot(self, client):
+        return {board: self.sync.state(board) for board in list(self.relay_boards) + list(self.sensor_boards)
+                if client.wants(board) and self.sync.state(board) is not None}
+
+    def broadcast(self, deltas):
+        """StateSync subscriber: queue each client's share of a delta batch"""
+        for client in list(self.clients):
+            selected = [{'board': d['board'], 'field': d['field'], 'value': d['value']}
+                        for d in deltas if client.wants(d['board'])]
+            if selected:
+                client.offer(selected)
+
+    async def poll(self):
+        while True:
+            started = time.monotonic()
+            sweeps = []
+            if self.relay_boards:
+                sweeps.append(self.fleet.fan_out("/api/status", self.relay_boards))
+            if self.sensor_boards:
+                sweeps.append(self.fleet.fan_out("/api/sensors", self.sensor_boards))
+            for results in await asyncio.gather(*sweeps):
+                for name, result in results.items():
+                    self.upstream_requests += 1
+                    if result['ok'] and result['body'] is not None:
+                        try:
+                            self.sync.update(name, result['body'].encode())
+                        except ValueError as e:
+                            print(f"❌ {e}")
+                            self.upstream_failures += 1
+                    else:
+                        self.upstream_failures += 1
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    async def handle_events(self, request):
+        boards = request.query.get('board') or request.query.get('boards')
+        client = PushClient(boards.split(',') if boards else None, self.queue_size)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            **CORS_HEADERS,
+        })
+        await response.prepare(request)
+
+        self.clients.add(client)
+        try:
+            await response.write(format_event('snapshot', self.snapshot(client)))
+            while True:
+                try:
+                    payload = await asyncio.wait_for(client.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if client.resync:
+                    client.resync = False
+                    await response.write(format_event('snapshot', self.snapshot(client)))
+                elif payload is not None:
+                    await response.write(format_event('delta', payload))
+                client.sent += 1
+        except ConnectionResetError:
+            pass
+        finally:
+            self.clients.discard(client)
+        return response
+
+    async def handle_state(self, request):
+        """Latest cached state, for clients that cannot use SSE"""
+        board = request.query.get('board')
+        if board:
+            state = self.sync.state(board)
+            if state is None:
+                return web.json_response({'error': 'Unknown board'}, status=404, headers=CORS_HEADERS)
+            return web.json_response(state, headers=CORS_HEADERS)
+        return web.json_response(self.snapshot(PushClient()), headers=CORS_HEADERS)
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats(), headers=CORS_HEADERS)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'clients': len(self.clients),
+            'boards': len(self.relay_boards) + len(self.sensor_boards),
+            'upstream_requests': self.upstream_requests,
+            'upstream_failures': self.upstream_failures,
+            'upstream_rps': self.upstream_requests / elapsed if elapsed > 0 else 0.0,
+            'events_dropped': sum(client.dropped for client in self.clients),
+            'sync': self.sync.stats(),
+        }
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/events', self.handle_events)
+        app.router.add_get('/api/state', self.handle_state)
+        app.router.add_get('/stats', self.handle_stats)
+        app.on_startup.append(self._start_polling)
+        app.on_cleanup.append(self._stop_polling)
+        return app
+
+    async def _start_polling(self, app):
+        self.started = time.monotonic()
+        self.poll_task = asyncio.create_task(self.poll())
+
+    async def _stop_polling(self, app):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        await self.fleet.close()
+
+
+async def run_benchmark(client_counts=(1, 10, 100), duration=5.0, interval=0.5):
+    """Board request rate with N SSE clients versus N polling dashboards"""
+    import aiohttp
+    from esp32_emulator import ESP32Emulator
+
+    with ESP32Emulator() as emulator:
+        board = emulator.board
+        for count in client_counts:
+            gateway = PushGateway({'esp32': emulator.url}, interval=interval)
+            runner = web.AppRunner(gateway.create_app())
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+
+            received = [0]
+
+            async def listen(session):
+                async with session.get(f"http://127.0.0.1:{port}/events?board=esp32") as response:
+                    async for line in response.content:
+                        if line.startswith(b"event:"):
+                            received[0] += 1
+
+            before = board.request_count
+            async with aiohttp.ClientSession() as session:
+                listeners = [asyncio.create_task(listen(session)) for _ in range(count)]
+                start = time.monotonic()
+                toggles = 0
+                while time.monotonic() - start < duration:
+                    await asyncio.sleep(0.25)
+                    with board.lock:
+                        board.relay_states[toggles % 4] ^= True
+                    toggles += 1
+                for listener in listeners:
+                    listener.cancel()
+                await asyncio.gather(*listeners, return_exceptions=True)
+            board_rps = (board.request_count - before) / duration
+            await runner.cleanup()
+
+            polling_rps = count / 2.0
+            print(f"{count:>4} dashboards: board sees {board_rps:.1f} req/s through the gateway "
+                  f"(polling every 2s would be {polling_rps:.1f} req/s), "
+                  f"{received[0] / count:.0f} events per dashboard for {toggles} relay changes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Push Gateway')
+    parser.add_argument('--fleet', help='JSON file mapping relay board names to URLs')
+    parser.add_argument('--url', help='Single relay board (named "esp32")')
+    parser.add_argument('--sensor-fleet', help='JSON file mapping sensor board names to URLs')
+    parser.add_argument('--sensor-url', help='Single sensor board (named "sensors")')
+    parser.add_argument('--host', default='0.0.0.0', help='Address to listen on (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='Board polling interval in seconds (default: 1)')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE, help='Pending events per client before resync (default: 64)')
+    parser.add_argument('--benchmark', action='store_true', help='Compare board load for 1, 10 and 100 dashboards')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        asyncio.run(run_benchmark())
+        return
+
+    relay_boards = load_fleet(args.fleet) if args.fleet else {}
+    if args.url:
+        relay_boards['esp32'] = args.url.rstrip('/')
+    sensor_boards = load_fleet(args.sensor_fleet) if args.sensor_fleet else {}
+    if args.sensor_url:
+        sensor_boards['sensors'] = args.sensor_url.rstrip('/')
+    if not relay_boards and not sensor_boards:
+        parser.error("at least one of --url, --fleet, --sensor-url or --sensor-fleet is required")
+
+    gateway = PushGateway(relay_boards, sensor_boards, args.interval, args.queue_size)
+    print(f"Push gateway for {len(relay_boards) + len(sensor_boards)} boards on http://{args.host}:{args.port}/events")
+    print(f"Open a dashboard with ?push=http://<this host>:{args.port} to switch it to push updates")
+    web.run_app(gateway.create_app(), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
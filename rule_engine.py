@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Rule Engine
+Compiled sensor rules indexed by (board, channel) that drive relays
+"""
+
+import re
+import json
+import time
+import random
+import bisect
+import operator
+import argparse
+import threading
+
+from load_generator import LatencyHistogram
+from scene_scheduler import SceneScheduler
+from sensor_collector import CHANNEL_NAMES
+
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+DURATION_UNITS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600}
+
+_MISSING = object()
+
+CONDITION_PATTERN = re.compile(r"^\s*([\w.-]+)\.(\w+)\s*(?:(<=|>=|==|!=|<|>)\s*(\S+))?\s*$")
+ACTION_PATTERN = re.compile(r"^\s*([\w.-]+)\.relay(\d+)\s+(on|off)(?:\s+for\s+(\d+(?:\.\d+)?)\s*([a-z]*))?\s*$")
+
+
+def parse_value(text):
+    lowered = text.lower()
+    if lowered in ('true', 'on'):
+        return True
+    if lowered in ('false', 'off'):
+        return False
+    return float(text)
+
+
+class Rule:
+    """One parsed rule: all conditions must hold to switch a relay.
+
+    Text form: "sensor-a.motion and sensor-a.lightLevel < 20 -> hall.relay1 on for 5 min".
+    A bare channel means "is truthy". With a duration the relay is switched
+    back once the conditions have stopped holding for that long.
+    """
+
+    def __init__(self, text, name=None):
+        self.text = text
+        self.name = name or text
+        when, arrow, then = text.partition('->')
+        if not arrow:
+            raise ValueError(f"Rule needs '->' between conditions and action: {text}")
+
+        self.conditions = []
+        for clause in re.split(r"\s+and\s+", when.strip()):
+            match = CONDITION_PATTERN.match(clause)
+            if match is None:
+                raise ValueError(f"Cannot parse condition '{clause}'")
+            board, channel, op, value = match.groups()
+            if channel not in CHANNEL_NAMES:
+                raise ValueError(f"Unknown channel '{channel}' in '{clause}'")
+            self.conditions.append((board, channel, op or '==', True if op is None else parse_value(value)))
+
+        match = ACTION_PATTERN.match(then)
+        if match is None:
+            raise ValueError(f"Cannot parse action '{then.strip()}'")
+        board, relay, state, amount, unit = match.groups()
+        self.board = board
+        self.relay = int(relay)
+        self.state = state == 'on'
+        self.duration = None
+        if amount:
+            unit = unit or 's'
+            if unit not in DURATION_UNITS:
+                # Plurals: "mins", "hours", "seconds"
+                unit = unit[:-1] if unit.endswith('s') else unit
+            if unit not in DURATION_UNITS:
+                raise ValueError(f"Unknown duration unit in '{then.strip()}'")
+            self.duration = float(amount) * DURATION_UNITS[unit]
+
+        # Runtime state: which conditions currently hold, and the pending revert
+        self.satisfied = 0
+        self.all_bits = (1 << len(self.conditions)) - 1
+        self.active = False
+        self.revert = None
+        self.fired = 0
+
+
+def compile_predicate(op, value):
+    """Single-argument predicate for a condition; missing readings never match"""
+    compare = OPERATORS[op]
+    if isinstance(value, bool):
+        return lambda reading: reading is not None and compare(bool(reading), value)
+    return lambda reading: reading is not None and compare(reading, value)
+
+
+class ChannelIndex:
+    """Conditions on one (board, channel).
+
+    Ordering conditions (<, <=, >, >=) are kept sorted by threshold: when a
+    reading moves from a to b, only thresholds between a and b can change
+    their outcome, so a bisect narrows the work to the conditions that were
+    actually crossed. Equality conditions are always evaluated.
+    """
+
+    def __init__(self):
+        self.thresholds = []
+        self.ordered = []
+        self.other = []
+
+    def add(self, op, value, entry):
+        if op in ('<', '<=', '>', '>=') and not isinstance(value, bool):
+            position = bisect.bisect_right(self.thresholds, value)
+            self.thresholds.insert(position, value)
+            self.ordered.insert(position, entry)
+        else:
+            self.other.append(entry)
+
+    def __len__(self):
+        return len(self.ordered) + len(self.other)
+
+    def candidates(self, previous, reading):
+        """Conditions whose outcome may differ between two readings"""
+        if previous is _MISSING or not isinstance(previous, (int, float)) or not isinstance(reading, (int, float)):
+            return self.ordered + self.other
+        low, high = (previous, reading) if previous <= reading else (reading, previous)
+        first = bisect.bisect_left(self.thresholds, low)
+        last = bisect.bisect_right(self.thresholds, high)
+        if first == last:
+            return self.other
+        return self.ordered[first:last] + self.other
+
+
+class RuleEngine:
+    """Evaluates rules against incoming sensor samples.
+
+    Conditions are compiled into predicates and indexed by (board, channel),
+    so a sample only evaluates conditions on its own board's channels, only
+    for channels whose value changed since the board's previous sample, and
+    only for thresholds the change crossed.
+    Each rule keeps a bitmask of satisfied conditions and fires on the edge
+    where every bit becomes set. Actions go through a SceneScheduler, which
+    batches relay changes per board and owns the timers that switch a relay
+    back once a "for <duration>" rule's conditions stop holding.
+    """
+
+    def __init__(self, scheduler=None, fleet=None):
+        self.scheduler = scheduler or SceneScheduler(fleet)
+        self.rules = []
+        self.index = {}
+        self.last_values = {}
+        self.lock = threading.Lock()
+        self.latency = LatencyHistogram()
+        self.samples = 0
+        self.evaluations = 0
+        self.actions = 0
+
+    def add_rule(self, rule, name=None):
+        """Compile and index a rule (a Rule or its text form)"""
+        if isinstance(rule, str):
+            rule = Rule(rule, name)
+        with self.lock:
+            self.rules.append(rule)
+            for bit, (board, channel, op, value) in enumerate(rule.conditions):
+                predicate = compile_predicate(op, value)
+                self.index.setdefault((board, channel), ChannelIndex()).add(op, value, (predicate, rule, 1 << bit))
+                # Start from the board's latest readings, if any have been seen
+                reading = self.last_values.get(board, {}).get(channel, _MISSING)
+                if reading is not _MISSING and predicate(reading):
+                    rule.satisfied |= 1 << bit
+        return rule
+
+    def load(self, source):
+        """Load rules from a JSON list of strings or {"name", "rule"} objects"""
+        if isinstance(source, str):
+            with open(source, 'r') as f:
+                source = json.load(f)
+        for item in source:
+            if isinstance(item, str):
+                self.add_rule(item)
+            else:
+                self.add_rule(item['rule'], item.get('name'))
+        return self
+
+    def on_sample(self, board, timestamp, sample):
+        """Evaluate the rules that depend on a sample; usable as a SensorCollector listener"""
+        started = time.perf_counter()
+        scheduler = self.scheduler
+        actions = {}
+        with self.lock:
+            self.samples += 1
+            last = self.last_values.setdefault(board, {})
+            index = self.index
+            for channel, reading in sample.items():
+                previous = last.get(channel, _MISSING)
+                if previous == reading:
+                    continue
+                last[channel] = reading
+                channel_index = index.get((board, channel))
+                if channel_index is None:
+                    continue
+                entries = channel_index.candidates(previous, reading)
+                self.evaluations += len(entries)
+                for predicate, rule, bit in entries:
+                    if predicate(reading):
+                        rule.satisfied |= bit
+                        if rule.satisfied == rule.all_bits and not rule.active:
+                            # Rising edge: every condition now holds
+                            rule.active = True
+                            rule.fired += 1
+                            if rule.revert is not None:
+                                scheduler.cancel(rule.revert)
+                                rule.revert = None
+                            actions.setdefault(scheduler.resolve(rule.board), {})[rule.relay] = rule.state
+                    else:
+                        rule.satisfied &= ~bit
+                        if rule.active:
+                            # Falling edge: start the countdown back to the other state
+                            rule.active = False
+                            if rule.duration is not None:
+                                rule.revert = scheduler.schedule(scheduler.clock() + rule.duration, rule.board,
+                                                                 {rule.relay: not rule.state})
+            self.actions += sum(len(states) for states in actions.values())
+
+        for target, states in actions.items():
+            scheduler.dispatch(target, states)
+        if actions:
+            self.latency.record(time.perf_counter() - started)
+        return len(actions)
+
+    def stats(self):
+        summary = self.latency.summary()
+        return {
+            'rules': len(self.rules),
+            'samples': self.samples,
+            'evaluations': self.evaluations,
+            'actions': self.actions,
+            'sample_to_action_p50_ms': summary['p50_ms'],
+            'sample_to_action_p99_ms': summary['p99_ms'],
+        }
+
+
+def generate_rules(count, sensor_boards, relay_boards, rng):
+    """Random rules over the sensor channels for benchmarking"""
+    templates = (
+        "{s}.motion and {s}.lightLevel < {light} -> {r}.relay{n} on for 5 min",
+        "{s}.gasLevel > {gas} -> {r}.relay{n} on",
+        "{s}.temperature >= {temp} -> {r}.relay{n} on",
+        "{s}.temperature < {temp} -> {r}.relay{n} off",
+        "{s}.humidity > {hum} and {s}.moisture < {moist} -> {r}.relay{n} on for 10 min",
+    )
+    rules = []
+    for _ in range(count):
+        rules.append(rng.choice(templates).format(
+            s=rng.choice(sensor_boards), r=rng.choice(relay_boards), n=rng.randint(1, 4),
+            light=rng.randint(5, 50), gas=rng.randint(20, 80), temp=round(rng.uniform(18, 28), 1),
+            hum=rng.randint(40, 80), moist=rng.randint(10, 50)))
+    return rules
+
+
+def run_benchmark(rule_count=10000, sensor_boards=100, rate=1000, duration=10, seed=3):
+    """10k rules over 100 sensor boards, fed a simulated 1k samples/s stream"""
+    rng = random.Random(seed)
+    sensors = [f"sensor-{i + 1}" for i in range(sensor_boards)]
+    relays = [f"relay-{i + 1}" for i in range(sensor_boards)]
+    simulated = [0.0]
+    dispatched = []
+    scheduler = SceneScheduler(dispatch=lambda board, states: dispatched.append((board, states)),
+                               clock=lambda: simulated[0])
+    engine = RuleEngine(scheduler)
+
+    start = time.perf_counter()
+    for text in generate_rules(rule_count, sensors, relays, rng):
+        engine.add_rule(text)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    readings = {name: {'temperature': 22.0, 'humidity': 50.0, 'motion': False, 'lightLevel': 40,
+                       'distance': 100.0, 'moisture': 30, 'gasLevel': 10} for name in sensors}
+    samples = rate * duration
+    busy = 0.0
+    for n in range(samples):
+        simulated[0] = n / rate
+        board = sensors[n % sensor_boards]
+        data = dict(readings[board])
+        data['temperature'] = round(data['temperature'] + rng.gauss(0, 0.3), 2)
+        data['humidity'] = round(min(max(data['humidity'] + rng.gauss(0, 1), 0), 100), 2)
+        if rng.random() < 0.05:
+            data['motion'] = not data['motion']
+        data['lightLevel'] = min(max(data['lightLevel'] + rng.randint(-3, 3), 0), 100)
+        data['moisture'] = min(max(data['moisture'] + rng.randint(-1, 1), 0), 100)
+        data['gasLevel'] = min(max(data['gasLevel'] + rng.randint(-2, 3), 0), 100)
+        readings[board] = data
+
+        started = time.perf_counter()
+        engine.on_sample(board, simulated[0], data)
+        scheduler.tick(simulated[0])
+        busy += time.perf_counter() - started
+
+    stats = engine.stats()
+    print(f"Compiled {rule_count} rules in {compile_ms:.0f}ms "
+          f"({len(engine.index)} (board, channel) index keys)")
+    print(f"{samples} samples ({rate}/s for {duration}s simulated): {busy * 1000:.0f}ms busy "
+          f"({busy / duration * 100:.1f}% of one core), {samples / busy:,.0f} samples/s capacity")
+    print(f"{stats['evaluations']:,} predicate evaluations ({stats['evaluations'] / busy:,.0f}/s), "
+          f"{stats['actions']} actions, {len(dispatched)} board dispatches")
+    print(f"Sample to relay action: p50 {stats['sample_to_action_p50_ms'] * 1000:.0f}us, "
+          f"p99 {stats['sample_to_action_p99_ms'] * 1000:.0f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Rule Engine')
+    parser.add_argument('--rules', help='JSON file with a list of rules')
+    parser.add_argument('--fleet', help='JSON file mapping sensor and relay board names to URLs')
+    parser.add_argument('--interval', type=float, default=1.0, help='Sensor polling interval in seconds (default: 1)')
+    parser.add_argument('--check', action='store_true', help='Parse the rules and exit')
+    parser.add_argument('--benchmark', action='store_true', help='Benchmark 10k rules at 1k samples/s')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark()
+        return
+
+    if not args.rules:
+        parser.error("--rules is required unless --benchmark is given")
+
+    engine = RuleEngine(fleet=args.fleet)
+    try:
+        engine.load(args.rules)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    print(f"✅ Loaded {len(engine.rules)} rules")
+    if args.check:
+        return
+    if not args.fleet:
+        parser.error("--fleet is required to run rules")
+
+    from fleet_client import load_fleet
+    from sensor_collector import SensorCollector
+    fleet = load_fleet(args.fleet)
+    sensor_boards = {board for rule in engine.rules for board, _, _, _ in rule.conditions}
+    collector = SensorCollector({name: url for name, url in fleet.items() if name in sensor_boards}, args.interval)
+    collector.add_listener(engine.on_sample)
+    engine.scheduler.start()
+    collector.start()
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Stats: {engine.stats()}")
+    except KeyboardInterrupt:
+        print("\nStopping rule engine...")
+    finally:
+        collector.stop()
+        engine.scheduler.stop()
+
+if __name__ == "__main__":
+    main()
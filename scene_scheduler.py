@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Scene Scheduler
+Scenes and timed relay actions across the fleet, driven by a heap-based timer
+"""
+
+import json
+import time
+import heapq
+import random
+import argparse
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+from command_batcher import CommandBatcher
+from fleet_client import load_fleet
+
+
+class TimerEntry:
+    __slots__ = ('when', 'seq', 'board', 'states', 'repeat', 'scene', 'cancelled')
+
+    def __init__(self, when, seq, board, states, repeat=None, scene=None):
+        self.when = when
+        self.seq = seq
+        self.board = board
+        self.states = states
+        self.repeat = repeat
+        self.scene = scene
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+
+class TimerHeap:
+    """Binary heap of timer entries with lazy cancellation.
+
+    Insert is O(log n); cancel only flags the entry (O(1)) and it is dropped
+    when it reaches the top. The heap is rebuilt once cancelled entries
+    outnumber live ones so memory stays bounded.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def push(self, entry):
+        heapq.heappush(self.heap, entry)
+
+    def cancel(self, entry):
+        if entry.cancelled:
+            return False
+        entry.cancelled = True
+        self.cancelled += 1
+        if self.cancelled > 1024 and self.cancelled * 2 > len(self.heap):
+            self.heap = [item for item in self.heap if not item.cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+        return True
+
+    def next_time(self):
+        """Fire time of the earliest live entry, or None"""
+        heap = self.heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+            self.cancelled -= 1
+        return heap[0].when if heap else None
+
+    def pop_due(self, now):
+        """Remove and return every live entry due at or before now"""
+        due = []
+        heap = self.heap
+        while heap and heap[0].when <= now:
+            entry = heapq.heappop(heap)
+            if entry.cancelled:
+                self.cancelled -= 1
+            else:
+                due.append(entry)
+        return due
+
+
+def next_daily(clock_time, now=None):
+    """Timestamp of the next occurrence of "HH:MM" local time"""
+    now = datetime.fromtimestamp(time.time() if now is None else now)
+    hour, minute = (int(part) for part in clock_time.split(':'))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target.timestamp()
+
+
+class SceneScheduler:
+    """Runs scenes and scheduled relay actions through the command batcher.
+
+    Everything due at the same tick is merged per board, with later entries
+    overriding earlier ones for the same relay, so a schedule that switches
+    a hundred relays on one board at 07:00 becomes a single /api/batch request.
+    A batcher passed in is shared with its owner and left open by stop().
+    """
+
+    def __init__(self, fleet=None, scenes=None, dispatch=None, clock=time.time, batcher=None):
+        self.fleet = load_fleet(fleet) if fleet else {}
+        self.scenes = {}
+        for name, boards in (scenes or {}).items():
+            self.add_scene(name, boards)
+        self.timers = TimerHeap()
+        self.seq = itertools.count()
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.batcher = batcher
+        self.owns_batcher = batcher is None
+        self.dispatch = dispatch or self.send
+        self.is_running = False
+        self.thread = None
+        self.fired = 0
+        self.dispatches = 0
+        self.errors = 0
+
+    def resolve(self, board):
+        """Board URL for a fleet name (or a URL passed through)"""
+        return self.fleet.get(board, board).rstrip('/')
+
+    def add_scene(self, name, boards):
+        """Register a scene: {board: {relay: state}}"""
+        self.scenes[name.lower()] = {self.resolve(board): {int(relay): bool(state) for relay, state in states.items()}
+                                     for board, states in boards.items()}
+
+    def schedule(self, when, board, states, repeat=None):
+        """Switch relays ({relay: state}) on a board at when; returns a handle for cancel().
+
+        repeat is an interval in seconds, or "HH:MM" to repeat daily at that
+        local time across DST changes.
+        """
+        entry = TimerEntry(when, next(self.seq), self.resolve(board),
+                           {int(relay): bool(state) for relay, state in states.items()}, repeat)
+        self._push(entry)
+        return entry
+
+    def schedule_scene(self, when, name, repeat=None):
+        """Apply a scene at when; returns a handle for cancel()"""
+        if name.lower() not in self.scenes:
+            raise ValueError(f"Unknown scene '{name}'")
+        entry = TimerEntry(when, next(self.seq), None, None, repeat, scene=name.lower())
+        self._push(entry)
+        return entry
+
+    def _push(self, entry):
+        with self.condition:
+            wake = self.timers.next_time()
+            self.timers.push(entry)
+            if wake is None or entry.when < wake:
+                self.condition.notify()
+
+    def cancel(self, entry):
+        with self.condition:
+            return self.timers.cancel(entry)
+
+    def tick(self, now=None):
+        """Fire everything due by now; returns the number of board dispatches"""
+        now = self.clock() if now is None else now
+        with self.condition:
+            # Firing order is fixed before repeating entries move to their next time
+            due = sorted(self.timers.pop_due(now))
+            for entry in due:
+                if isinstance(entry.repeat, str):
+                    entry.when = next_daily(entry.repeat, now)
+                    self.timers.push(entry)
+                elif entry.repeat:
+                    entry.when += entry.repeat
+                    while entry.when <= now:
+                        entry.when += entry.repeat
+                    self.timers.push(entry)
+                else:
+                    # Fired one-shot entries can no longer be cancelled
+                    entry.cancelled = True
+        if not due:
+            return 0
+
+        # Merge per board in firing order; later entries win per relay
+        merged = {}
+        for entry in due:
+            targets = self.scenes[entry.scene] if entry.scene else {entry.board: entry.states}
+            for board, states in targets.items():
+                merged.setdefault(board, {}).update(states)
+        self.fired += len(due)
+        for board, states in merged.items():
+            self.dispatch(board, states)
+        self.dispatches += len(merged)
+        return len(merged)
+
+    def apply_scene(self, name):
+        """Apply a scene now"""
+        scene = self.scenes.get(name.lower())
+        if scene is None:
+            raise ValueError(f"Unknown scene '{name}'")
+        for board, states in scene.items():
+            self.dispatch(board, states)
+        return True
+
+    def send(self, board, states):
+        """Default dispatcher: queue the states on the batcher without waiting"""
+        if self.batcher is None:
+            self.batcher = CommandBatcher()
+        futures = [self.batcher.submit(board, relay, state) for relay, state in states.items()]
+        self.batcher.flush()
+        for future in futures:
+            future.add_done_callback(self._check_result)
+
+    def _check_result(self, future):
+        if future.exception() is not None:
+            self.errors += 1
+            print(f"❌ Scheduled action failed: {future.exception()}")
+
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            with self.condition:
+                next_time = self.timers.next_time()
+                delay = None if next_time is None else next_time - self.clock()
+                if delay is None or delay > 0:
+                    self.condition.wait(delay)
+                    continue
+            self.tick()
+
+    def start(self):
+        """Fire timers on a background thread"""
+        self.thread = threading.Thread(target=self.run, name="scene-scheduler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.batcher is not None and self.owns_batcher:
+            self.batcher.close()
+            self.batcher = None
+
+    def load(self, config):
+        """Load scenes and schedules from a JSON file or dict.
+
+        {"scenes": {"movie mode": {"living-room": {"1": false, "3": true}}},
+         "schedules": [{"at": "07:00", "scene": "morning"},
+                       {"at": "22:30", "board": "porch", "relay": 1, "state": false}]}
+
+        "at" is local HH:MM and repeats daily unless "repeat" is false.
+        """
+        if isinstance(config, str):
+            with open(config, 'r') as f:
+                config = json.load(f)
+        for name, boards in config.get('scenes', {}).items():
+            self.add_scene(name, boards)
+
+        entries = []
+        for item in config.get('schedules', []):
+            when = next_daily(item['at'], self.clock())
+            repeat = item['at'] if item.get('repeat', True) else None
+            if 'scene' in item:
+                entries.append(self.schedule_scene(when, item['scene'], repeat))
+            else:
+                entries.append(self.schedule(when, item['board'], {item['relay']: item['state']}, repeat))
+        return entries
+
+
+def run_benchmark(sizes=(1000, 10000, 100000), boards=100, fires=20000, seed=7):
+    """Show that insert, cancel and per-tick cost stay flat as the timer population grows"""
+    for size in sizes:
+        rng = random.Random(seed)
+        dispatched = []
+        scheduler = SceneScheduler(dispatch=lambda board, states: dispatched.append(len(states)),
+                                   clock=lambda: 0.0)
+        horizon = float(size)
+
+        start = time.perf_counter()
+        entries = [scheduler.schedule(rng.uniform(1, horizon), f"http://board-{rng.randrange(boards)}",
+                                      {rng.randint(1, 4): rng.random() < 0.5}, repeat=horizon)
+                   for _ in range(size)]
+        insert_us = (time.perf_counter() - start) / size * 1e6
+
+        victims = rng.sample(entries, size // 10)
+        start = time.perf_counter()
+        for entry in victims:
+            scheduler.cancel(entry)
+        cancel_us = (time.perf_counter() - start) / len(victims) * 1e6
+
+        # Advance the clock one second per tick; every entry repeats, so the
+        # population stays at its full size for the whole run
+        now = 0.0
+        ticks = 0
+        start = time.perf_counter()
+        while scheduler.fired < fires:
+            now += 1.0
+            scheduler.tick(now)
+            ticks += 1
+        elapsed = time.perf_counter() - start
+
+        print(f"{size:>7} timers: insert {insert_us:.2f}us, cancel {cancel_us:.2f}us, "
+              f"{elapsed / scheduler.fired * 1e6:.2f}us per fired entry, "
+              f"{elapsed / ticks * 1e6:.2f}us per tick ({scheduler.fired / ticks:.1f} entries, "
+              f"{scheduler.dispatches / ticks:.1f} board batches per tick)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Scene Scheduler')
+    parser.add_argument('--config', help='JSON file with scenes and schedules')
+    parser.add_argument('--fleet', help='JSON file mapping board names to URLs')
+    parser.add_argument('--scene', help='Apply a scene now and exit')
+    parser.add_argument('--benchmark', action='store_true', help='Measure timer overhead up to 100k entries')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark()
+        return
+
+    if not args.config:
+        parser.error("--config is required unless --benchmark is given")
+
+    scheduler = SceneScheduler(args.fleet)
+    entries = scheduler.load(args.config)
+
+    if args.scene:
+        try:
+            scheduler.apply_scene(args.scene)
+        except ValueError as e:
+            print(f"❌ {e}")
+        finally:
+            scheduler.stop()
+        return
+
+    print(f"✅ {len(scheduler.scenes)} scenes, {len(entries)} schedules loaded")
+    for entry in sorted(entries):
+        target = f"scene '{entry.scene}'" if entry.scene else f"{entry.board} {entry.states}"
+        print(f"  {datetime.fromtimestamp(entry.when):%Y-%m-%d %H:%M} {target}")
+
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping scheduler...")
+    finally:
+        scheduler.stop()
+
+if __name__ == "__main__":
+    main()
@@ -18,8 +18,16 @@ class HomeAutomationDashboard {
     init() {
         this.hideLoadingOverlay();
         this.setupEventListeners();
-        this.startStatusUpdates();
-        this.loadInitialState();
+        
+        // Push mode: ?push=http://gateway:8090 (or localStorage 'pushGateway') uses push_gateway.py
+        const params = new URLSearchParams(window.location.search);
+        const gateway = params.get('push') || localStorage.getItem('pushGateway');
+        if (gateway && window.EventSource) {
+            this.startPush(gateway, params.get('board') || 'esp32');
+        } else {
+            this.startStatusUpdates();
+            this.loadInitialState();
+        }
         this.setupServiceWorker();
     }
     
@@ -203,6 +211,45 @@ class HomeAutomationDashboard {
         }, 2000);
     }
     
+    startPush(gateway, board) {
+        this.eventSource = new EventSource(`${gateway.replace(/\/$/, '')}/events?board=${encodeURIComponent(board)}`);
+        
+        this.eventSource.addEventListener('snapshot', (e) => {
+            const data = JSON.parse(e.data)[board];
+            if (data) this.applyState(data);
+            this.isConnected = true;
+            this.updateConnectionStatus(true);
+            this.retryCount = 0;
+        });
+        
+        this.eventSource.addEventListener('delta', (e) => {
+            const changes = {};
+            for (const delta of JSON.parse(e.data)) {
+                changes[delta.field] = delta.value;
+            }
+            this.applyState(changes);
+        });
+        
+        // EventSource reconnects on its own; the gateway sends a fresh snapshot on reconnect
+        this.eventSource.onerror = () => {
+            console.error('Push connection interrupted');
+            this.handleConnectionError();
+        };
+    }
+    
+    applyState(data) {
+        for (let i = 1; i <= 4; i++) {
+            const state = data[`relay${i}`];
+            const checkbox = document.getElementById(`relay${i}`);
+            
+            // Only update if state changed (to avoid disrupting user interaction)
+            if (checkbox && typeof state === 'boolean' && checkbox.checked !== state) {
+                checkbox.checked = state;
+                this.updateRelayStatus(i, state);
+            }
+        }
+    }
+    
     async refreshStatus() {
         this.showToast('Refreshing status...', 'info');
         await this.loadInitialState();
@@ -338,4 +385,7 @@ window.addEventListener('beforeunload', () => {
     if (window.dashboard && window.dashboard.updateInterval) {
         clearInterval(window.dashboard.updateInterval);
     }
+    if (window.dashboard && window.dashboard.eventSource) {
+        window.dashboard.eventSource.close();
+    }
 });
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Segment Store
+Append-only, memory-mapped binary history for sensor samples and relay changes
+"""
+
+import os
+import json
+import mmap
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from sensor_collector import CHANNELS, CHANNEL_NAMES, _LIMITS, decode
+
+# Fixed-size records. Sensor channels use the collector's scaled-integer
+# encoding, so a sample is 20 bytes on disk and decodes the same way.
+SENSOR_RECORD = np.dtype([('timestamp', '<f8'), ('board', '<u2')] +
+                         [(name, np.dtype(dtype).newbyteorder('<')) for name, dtype, _, _ in CHANNELS])
+RELAY_RECORD = np.dtype([('timestamp', '<f8'), ('board', '<u2'), ('relay', 'u1'), ('state', 'u1')])
+
+FAMILIES = {'sensors': SENSOR_RECORD, 'relays': RELAY_RECORD}
+RELAY_COUNT = 4
+
+# Segment header: magic, format version, record size, segment start time
+MAGIC = b'ESPSEG\x00\x01'
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u2'), ('record_size', '<u2'), ('reserved', '<u4'),
+                   ('start', '<f8'), ('padding', 'V8')])
+VERSION = 1
+
+# Sparse index sidecar: one entry per block of records, holding the block's
+# time bounds so a range query only touches blocks that can match
+INDEX_ENTRY = np.dtype([('first', '<u8'), ('count', '<u4'), ('reserved', '<u4'),
+                        ('t_min', '<f8'), ('t_max', '<f8')])
+DEFAULT_BLOCK_RECORDS = 4096
+DEFAULT_SEGMENT_SECONDS = 24 * 3600
+
+
+class SegmentWriter:
+    """Appends records to one segment file and maintains its sparse index"""
+
+    def __init__(self, path, dtype, start, block_records=DEFAULT_BLOCK_RECORDS):
+        self.path = path
+        self.index_path = path[:-len('.seg')] + '.idx'
+        self.dtype = dtype
+        self.start = start
+        self.block_records = block_records
+
+        exists = os.path.exists(path)
+        self.file = open(path, 'ab')
+        if not exists or os.path.getsize(path) == 0:
+            header = np.zeros(1, dtype=HEADER)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['record_size'] = dtype.itemsize
+            header['start'] = start
+            self.file.write(header.tobytes())
+            self.records = 0
+        else:
+            # Resume after a restart, ignoring any torn record at the end
+            size = os.path.getsize(path) - HEADER.itemsize
+            self.records = size // dtype.itemsize
+            self.file.truncate(HEADER.itemsize + self.records * dtype.itemsize)
+
+        # Records past the last indexed block are kept in memory until the block fills
+        self.indexed = 0
+        if os.path.exists(self.index_path):
+            index = np.fromfile(self.index_path, dtype=INDEX_ENTRY)
+            if len(index):
+                self.indexed = int(index['first'][-1] + index['count'][-1])
+        self.pending_min = np.inf
+        self.pending_max = -np.inf
+        if self.records > self.indexed:
+            tail = read_records(path, dtype)[self.indexed:]
+            self.pending_min = float(tail['timestamp'].min())
+            self.pending_max = float(tail['timestamp'].max())
+
+    def append(self, records):
+        """Append a structured array of records"""
+        offset = 0
+        while offset < len(records):
+            room = self.block_records - (self.records - self.indexed)
+            chunk = records[offset:offset + room]
+            self.file.write(chunk.tobytes())
+            self.records += len(chunk)
+            self.pending_min = min(self.pending_min, float(chunk['timestamp'].min()))
+            self.pending_max = max(self.pending_max, float(chunk['timestamp'].max()))
+            if self.records - self.indexed == self.block_records:
+                self._write_index_entry()
+            offset += len(chunk)
+
+    def _write_index_entry(self):
+        entry = np.zeros(1, dtype=INDEX_ENTRY)
+        entry['first'] = self.indexed
+        entry['count'] = self.records - self.indexed
+        entry['t_min'] = self.pending_min
+        entry['t_max'] = self.pending_max
+        # Records must reach the disk before the index entry that points at them
+        self.file.flush()
+        with open(self.index_path, 'ab') as index_file:
+            index_file.write(entry.tobytes())
+        self.indexed = self.records
+        self.pending_min = np.inf
+        self.pending_max = -np.inf
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Index the partial last block and close the segment"""
+        if self.records > self.indexed:
+            self._write_index_entry()
+        self.file.close()
+
+
+def read_records(path, dtype):
+    """Memory-map a segment and return its records as a zero-copy NumPy view"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= HEADER.itemsize:
+            return np.empty(0, dtype=dtype)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header = np.frombuffer(mapped, dtype=HEADER, count=1)[0]
+    if header['magic'] != MAGIC or header['record_size'] != dtype.itemsize:
+        raise ValueError(f"{path} is not a {dtype.itemsize}-byte record segment")
+    count = (size - HEADER.itemsize) // dtype.itemsize
+    # The view keeps the mapping alive for as long as it is referenced
+    return np.frombuffer(mapped, dtype=dtype, count=count, offset=HEADER.itemsize)
+
+
+class SegmentReader:
+    """Range queries over one segment using its sparse time index"""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.records = read_records(path, dtype)
+        index_path = path[:-len('.seg')] + '.idx'
+        index = np.fromfile(index_path, dtype=INDEX_ENTRY) if os.path.exists(index_path) else \
+            np.empty(0, dtype=INDEX_ENTRY)
+        # Ignore index entries for records a crash never wrote
+        self.index = index[index['first'] + index['count'] <= len(self.records)]
+        self.indexed = int(self.index['first'][-1] + self.index['count'][-1]) if len(self.index) else 0
+
+    def bounds(self):
+        """(t_min, t_max) of the segment, or None when it is empty"""
+        if not len(self.records):
+            return None
+        t_min = float(self.index['t_min'].min()) if len(self.index) else np.inf
+        t_max = float(self.index['t_max'].max()) if len(self.index) else -np.inf
+        tail = self.records['timestamp'][self.indexed:]
+        if len(tail):
+            t_min = min(t_min, float(tail.min()))
+            t_max = max(t_max, float(tail.max()))
+        return t_min, t_max
+
+    def blocks(self, start, end):
+        """Zero-copy record views for every block whose time bounds overlap [start, end]"""
+        hits = np.flatnonzero((self.index['t_max'] >= start) & (self.index['t_min'] <= end))
+        if len(hits):
+            # Merge adjacent blocks into contiguous runs so each run is one view
+            breaks = np.flatnonzero(np.diff(hits) != 1) + 1
+            for run in np.split(hits, breaks):
+                first = int(self.index['first'][run[0]])
+                last = int(self.index['first'][run[-1]] + self.index['count'][run[-1]])
+                yield self.records[first:last]
+        if self.indexed < len(self.records):
+            yield self.records[self.indexed:]
+
+    def query(self, start, end, boards=None):
+        """Records in [start, end], optionally restricted to board ids"""
+        parts = []
+        for view in self.blocks(start, end):
+            timestamps = view['timestamp']
+            mask = (timestamps >= start) & (timestamps <= end)
+            if boards is not None:
+                mask &= np.isin(view['board'], boards)
+            parts.append(view[mask])
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+class SegmentStore:
+    """Directory of time-rotated segments per record family plus a board registry.
+
+    Layout: <root>/boards.json and <root>/<family>/<start>.seg with a
+    matching <start>.idx sparse index. A segment covers segment_seconds of
+    wall-clock time; writers rotate to a new file when a record falls past
+    the current segment's end.
+    """
+
+    def __init__(self, root, segment_seconds=DEFAULT_SEGMENT_SECONDS, block_records=DEFAULT_BLOCK_RECORDS):
+        self.root = root
+        self.segment_seconds = segment_seconds
+        self.block_records = block_records
+        self.lock = threading.RLock()
+        self.writers = {}
+        self.last_relays = {}
+        for family in FAMILIES:
+            os.makedirs(os.path.join(root, family), exist_ok=True)
+
+        self.registry_path = os.path.join(root, 'boards.json')
+        self.board_ids = {}
+        if os.path.exists(self.registry_path):
+            with open(self.registry_path) as f:
+                self.board_ids = json.load(f)
+        self.board_names = {board_id: name for name, board_id in self.board_ids.items()}
+
+    def board_id(self, name):
+        """Stable numeric id for a board name, registered on first use"""
+        board_id = self.board_ids.get(name)
+        if board_id is None:
+            with self.lock:
+                board_id = self.board_ids.get(name)
+                if board_id is None:
+                    board_id = len(self.board_ids)
+                    self.board_ids[name] = board_id
+                    self.board_names[board_id] = name
+                    temp_path = self.registry_path + '.tmp'
+                    with open(temp_path, 'w') as f:
+                        json.dump(self.board_ids, f, indent=2)
+                    os.replace(temp_path, self.registry_path)
+        return board_id
+
+    def _writer(self, family, timestamp):
+        start = int(timestamp // self.segment_seconds) * self.segment_seconds
+        writer = self.writers.get(family)
+        if writer is not None and (start > writer.start):
+            writer.close()
+            writer = None
+        if writer is None:
+            path = os.path.join(self.root, family, f"{start:010d}.seg")
+            writer = SegmentWriter(path, FAMILIES[family], start, self.block_records)
+            self.writers[family] = writer
+        return writer
+
+    def append(self, family, records):
+        """Append a time-ordered structured array, rotating segments as needed.
+
+        Late records for an already rotated segment go into the current one;
+        the per-block time bounds keep them visible to range queries.
+        """
+        if not len(records):
+            return
+        with self.lock:
+            starts = (records['timestamp'] // self.segment_seconds).astype(np.int64) * self.segment_seconds
+            breaks = np.flatnonzero(np.diff(starts) > 0) + 1
+            for chunk in np.split(records, breaks):
+                self._writer(family, float(chunk['timestamp'][0])).append(chunk)
+
+    def append_sample(self, board, timestamp, sample):
+        """Append one /api/sensors reading; usable as a SensorCollector listener"""
+        record = np.zeros(1, dtype=SENSOR_RECORD)
+        record['timestamp'] = timestamp
+        record['board'] = self.board_id(board)
+        for name, _, scale, sentinel in CHANNELS:
+            value = sample.get(name)
+            if value is None or value != value:
+                record[name] = sentinel
+            else:
+                low, high = _LIMITS[name]
+                record[name] = min(max(int(round(float(value) * scale)), low), high)
+        self.append('sensors', record)
+
+    def append_relay(self, board, timestamp, relay, state):
+        """Append one relay state change"""
+        record = np.zeros(1, dtype=RELAY_RECORD)
+        record['timestamp'] = timestamp
+        record['board'] = self.board_id(board)
+        record['relay'] = relay
+        record['state'] = 1 if state else 0
+        self.append('relays', record)
+
+    def record_status(self, board, timestamp, status):
+        """Append relay changes between an /api/status response and the last one seen"""
+        last = self.last_relays.setdefault(board, {})
+        changes = 0
+        for relay in range(1, RELAY_COUNT + 1):
+            state = status.get(f"relay{relay}")
+            if state is None or last.get(relay) == bool(state):
+                continue
+            last[relay] = bool(state)
+            self.append_relay(board, timestamp, relay, state)
+            changes += 1
+        return changes
+
+    def attach(self, collector):
+        """Persist every sample a SensorCollector stores"""
+        collector.add_listener(self.append_sample)
+        return self
+
+    def flush(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.flush()
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
+
+    def segments(self, family):
+        """Segment paths for a family in time order"""
+        directory = os.path.join(self.root, family)
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.seg')]
+
+    def readers(self, family, start=None, end=None):
+        """Readers for segments that may hold records in [start, end]"""
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        self.flush()
+        for path in self.segments(family):
+            segment_start = int(os.path.basename(path)[:-len('.seg')])
+            # Late records can land in later segments, but never past a segment's end
+            if segment_start + self.segment_seconds <= start:
+                continue
+            reader = SegmentReader(path, FAMILIES[family])
+            bounds = reader.bounds()
+            if bounds is not None and bounds[1] >= start and bounds[0] <= end:
+                yield reader
+
+    def query(self, family, start=None, end=None, boards=None):
+        """Records of a family in [start, end], optionally for some board names"""
+        board_ids = None
+        if boards is not None:
+            board_ids = [self.board_ids[name] for name in boards if name in self.board_ids]
+        lower = -np.inf if start is None else start
+        upper = np.inf if end is None else end
+        parts = [reader.query(lower, upper, board_ids) for reader in self.readers(family, start, end)]
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return np.empty(0, dtype=FAMILIES[family])
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def samples(self, board, start=None, end=None, channels=CHANNEL_NAMES):
+        """Decoded sensor history for one board as (timestamps, {name: float32 array})"""
+        records = self.query('sensors', start, end, [board])
+        order = np.argsort(records['timestamp'], kind='stable')
+        records = records[order]
+        return records['timestamp'], {name: decode(name, records[name]) for name in channels}
+
+
+def run_benchmark(root, boards=10, days=30, interval=1.0):
+    """Write days of 1 Hz history for several boards, then scan it back"""
+    store = SegmentStore(root)
+    names = [f"board-{i + 1}" for i in range(boards)]
+    board_ids = np.array([store.board_id(name) for name in names], dtype=np.uint16)
+    start = 1_700_000_000 - 1_700_000_000 % DEFAULT_SEGMENT_SECONDS
+    per_day = int(86400 / interval)
+    rng = np.random.default_rng(1)
+
+    written = time.perf_counter()
+    for day in range(days):
+        records = np.zeros(per_day * boards, dtype=SENSOR_RECORD)
+        records['timestamp'] = np.repeat(start + day * 86400 + np.arange(per_day) * interval, boards)
+        records['board'] = np.tile(board_ids, per_day)
+        records['temperature'] = rng.normal(2000, 100, len(records)).astype(np.int16)
+        records['humidity'] = rng.normal(5000, 300, len(records)).astype(np.uint16)
+        store.append('sensors', records)
+    store.close()
+    written = time.perf_counter() - written
+
+    total_bytes = sum(os.path.getsize(path) for path in store.segments('sensors'))
+    print(f"Wrote {days} days x {boards} boards ({total_bytes / 1024 ** 2:.0f} MiB) in {written:.1f}s")
+
+    end = start + days * 86400
+    scan = time.perf_counter()
+    count = 0
+    total = 0.0
+    for reader in store.readers('sensors', start, end):
+        for view in reader.blocks(start, end):
+            count += len(view)
+            total += float(view['temperature'].sum(dtype=np.int64))
+    scan = time.perf_counter() - scan
+    print(f"Full scan of {count:,} records: {scan * 1000:.0f}ms "
+          f"({total_bytes / scan / 1024 ** 3:.2f} GiB/s), mean temperature {total / count / 100:.2f}")
+
+    day_start = start + (days // 2) * 86400
+    query = time.perf_counter()
+    timestamps, columns = store.samples(names[0], day_start, day_start + 3600)
+    query = time.perf_counter() - query
+    print(f"One board, one hour from the middle of the range: {len(timestamps)} samples in {query * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Segment Store')
+    parser.add_argument('--root', default='history', help='Store directory (default: history)')
+    parser.add_argument('--info', action='store_true', help='List segments and their time ranges')
+    parser.add_argument('--query', metavar='BOARD', help='Print the sensor history of a board')
+    parser.add_argument('--hours', type=float, default=1, help='Hours of history for --query (default: 1)')
+    parser.add_argument('--fleet', help='Collect from a fleet of sensor boards into the store')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to collect with --fleet (default: 60)')
+    parser.add_argument('--benchmark', action='store_true', help='Write and scan a synthetic month of history')
+    parser.add_argument('--boards', type=int, default=10, help='Boards in the benchmark (default: 10)')
+    parser.add_argument('--days', type=int, default=30, help='Days in the benchmark (default: 30)')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.root, args.boards, args.days)
+        return
+
+    store = SegmentStore(args.root)
+
+    if args.fleet:
+        from sensor_collector import SensorCollector
+        collector = SensorCollector(args.fleet)
+        store.attach(collector)
+        collector.start()
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            collector.stop()
+            store.close()
+        print(f"✅ Stored {collector.polls - collector.failures} samples in {args.root}")
+        return
+
+    if args.info:
+        for family in FAMILIES:
+            for reader in store.readers(family):
+                t_min, t_max = reader.bounds()
+                print(f"{reader.path}: {len(reader.records):,} records, {len(reader.index)} index blocks, "
+                      f"{time.ctime(t_min)} - {time.ctime(t_max)}")
+        return
+
+    if args.query:
+        end = time.time()
+        timestamps, columns = store.samples(args.query, end - args.hours * 3600, end)
+        for i, timestamp in enumerate(timestamps):
+            values = ", ".join(f"{name}={columns[name][i]:g}" for name in CHANNEL_NAMES)
+            print(f"{time.ctime(timestamp)}: {values}")
+        return
+
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Sensor Aggregates
+Vectorized window statistics and incrementally maintained downsampled tiers
+"""
+
+import time
+import argparse
+import warnings
+
+import numpy as np
+
+from sensor_collector import CHANNEL_NAMES, SensorRingBuffer
+
+# (bucket width in seconds, buckets kept): 1 s for an hour, 1 min for a week,
+# 1 h for a year. Each bucket costs 14 bytes per channel.
+DEFAULT_TIERS = ((1, 3600), (60, 7 * 24 * 60), (3600, 365 * 24))
+
+WINDOWS = {'1m': 60, '1h': 3600, '1d': 86400}
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+class DownsampleTier:
+    """Ring of fixed-width time buckets holding count, sum, min and max per channel"""
+
+    def __init__(self, resolution, capacity, channel_count=len(CHANNEL_NAMES)):
+        self.resolution = resolution
+        self.capacity = int(capacity)
+        shape = (self.capacity, channel_count)
+        self.bucket_ids = np.full(self.capacity, -1, dtype=np.int64)
+        self.count = np.zeros(shape, dtype=np.uint16)
+        self.sum = np.zeros(shape, dtype=np.float32)
+        self.min = np.full(shape, np.inf, dtype=np.float32)
+        self.max = np.full(shape, -np.inf, dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return self.bucket_ids.nbytes + self.count.nbytes + self.sum.nbytes + self.min.nbytes + self.max.nbytes
+
+    def _reset(self, rows, bucket_ids):
+        self.bucket_ids[rows] = bucket_ids
+        self.count[rows] = 0
+        self.sum[rows] = 0
+        self.min[rows] = np.inf
+        self.max[rows] = -np.inf
+
+    def add(self, timestamp, values):
+        """Fold one sample (a float32 vector, NaN for missing) into its bucket"""
+        bucket = int(timestamp // self.resolution)
+        row = bucket % self.capacity
+        if self.bucket_ids[row] != bucket:
+            if self.bucket_ids[row] > bucket:
+                return
+            self._reset(row, bucket)
+
+        valid = ~np.isnan(values)
+        self.count[row] += valid
+        self.sum[row] += np.where(valid, values, 0)
+        np.fmin(self.min[row], values, out=self.min[row])
+        np.fmax(self.max[row], values, out=self.max[row])
+
+    def add_many(self, timestamps, values):
+        """Fold a batch of samples (timestamps[n], values[n, channels]) into the tier"""
+        buckets = (np.asarray(timestamps) // self.resolution).astype(np.int64)
+        if len(buckets) == 0:
+            return
+        order = np.argsort(buckets, kind='stable')
+        buckets = buckets[order]
+        values = np.asarray(values, dtype=np.float32)[order]
+
+        # Reduce each run of equal buckets in one pass per statistic
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        groups = buckets[bounds]
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid, bounds, axis=0).astype(np.uint16)
+        sums = np.add.reduceat(np.where(valid, values, 0), bounds, axis=0)
+        minimums = np.fmin.reduceat(values, bounds, axis=0)
+        maximums = np.fmax.reduceat(values, bounds, axis=0)
+
+        # Only the newest capacity buckets of the batch can be retained
+        keep = groups > groups[-1] - self.capacity
+        groups, counts, sums = groups[keep], counts[keep], sums[keep]
+        minimums, maximums = minimums[keep], maximums[keep]
+        rows = groups % self.capacity
+
+        stale = self.bucket_ids[rows] < groups
+        self._reset(rows[stale], groups[stale])
+        current = self.bucket_ids[rows] == groups
+        rows = rows[current]
+
+        self.count[rows] += counts[current]
+        self.sum[rows] += sums[current]
+        self.min[rows] = np.fmin(self.min[rows], minimums[current])
+        self.max[rows] = np.fmax(self.max[rows], maximums[current])
+
+    def query(self, start, end, channel=None):
+        """Buckets covering [start, end] as (timestamps, count, mean, min, max).
+
+        Arrays are shaped (buckets, channels), or (buckets,) when a channel
+        index is given; empty buckets are NaN.
+        """
+        first = int(start // self.resolution)
+        last = int(end // self.resolution)
+        first = max(first, last - self.capacity + 1)
+        buckets = np.arange(first, last + 1, dtype=np.int64)
+        rows = buckets % self.capacity
+        columns = slice(None) if channel is None else channel
+
+        present = self.bucket_ids[rows] == buckets
+        if channel is None:
+            present = present[:, None]
+        count = np.where(present, self.count[rows, columns], 0)
+        empty = count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(empty, np.nan, self.sum[rows, columns] / count)
+        minimum = np.where(empty, np.nan, self.min[rows, columns])
+        maximum = np.where(empty, np.nan, self.max[rows, columns])
+        return buckets * self.resolution, count, mean.astype(np.float32), minimum, maximum
+
+
+class BoardTiers:
+    """All downsampled tiers for one board"""
+
+    def __init__(self, tiers=DEFAULT_TIERS, channels=CHANNEL_NAMES):
+        self.channels = tuple(channels)
+        self.tiers = [DownsampleTier(resolution, capacity, len(self.channels)) for resolution, capacity in tiers]
+
+    def add(self, timestamp, sample):
+        values = np.array([np.nan if sample.get(name) is None else float(sample[name]) for name in self.channels],
+                          dtype=np.float32)
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def add_many(self, timestamps, values):
+        for tier in self.tiers:
+            tier.add_many(timestamps, values)
+
+    def tier_for(self, span, max_points):
+        """Finest tier that answers a query of span seconds in at most max_points buckets"""
+        for tier in self.tiers:
+            if span / tier.resolution <= max_points and span <= tier.resolution * tier.capacity:
+                return tier
+        return self.tiers[-1]
+
+    @property
+    def nbytes(self):
+        return sum(tier.nbytes for tier in self.tiers)
+
+
+class SensorAggregator:
+    """Maintains downsampled tiers per board and answers chart and window queries.
+
+    Attach it to a SensorCollector to update tiers as samples arrive; window
+    statistics with percentiles are computed from the collector's raw history.
+    """
+
+    def __init__(self, collector=None, tiers=DEFAULT_TIERS):
+        self.tier_spec = tiers
+        self.boards = {}
+        self.collector = collector
+        if collector is not None:
+            collector.add_listener(self.add_sample)
+
+    def board(self, name):
+        tiers = self.boards.get(name)
+        if tiers is None:
+            tiers = BoardTiers(self.tier_spec)
+            self.boards[name] = tiers
+        return tiers
+
+    def add_sample(self, board, timestamp, sample):
+        """Fold one /api/sensors sample into the board's tiers"""
+        self.board(board).add(timestamp, sample)
+
+    def chart(self, boards, channel, start, end, max_points=1500):
+        """Downsampled series for a channel across boards.
+
+        Returns (timestamps, mean, min, max) where the value arrays are shaped
+        (boards, points). Served from the coarsest tier needed, never from raw samples.
+        """
+        boards = list(boards)
+        index = CHANNEL_NAMES.index(channel)
+        tier = self.board(boards[0]).tier_for(end - start, max_points)
+        resolution = tier.resolution
+
+        timestamps = None
+        means, mins, maxes = [], [], []
+        for name in boards:
+            board_tier = next(t for t in self.board(name).tiers if t.resolution == resolution)
+            timestamps, _, mean, minimum, maximum = board_tier.query(start, end, index)
+            means.append(mean)
+            mins.append(minimum)
+            maxes.append(maximum)
+        return timestamps, np.vstack(means), np.vstack(mins), np.vstack(maxes)
+
+    def window_stats(self, board, window, now=None, percentiles=DEFAULT_PERCENTILES):
+        """Min, max, mean, percentiles and rate of change per channel over the last window"""
+        if self.collector is None:
+            raise ValueError("Window statistics need the collector's raw history")
+        if isinstance(window, str):
+            window = WINDOWS[window]
+        buffer = self.collector.buffer(board)
+        if now is None:
+            now = time.time() if buffer.head_slot is None else buffer.head_slot * buffer.interval
+        return window_stats(buffer, now - window + buffer.interval, now, percentiles)
+
+
+def window_stats(buffer, start, end, percentiles=DEFAULT_PERCENTILES):
+    """Vectorized statistics for every channel of a ring buffer between two timestamps"""
+    timestamps, columns = buffer.window(start, end)
+    matrix = np.vstack([columns[name] for name in CHANNEL_NAMES]) if len(timestamps) else \
+        np.empty((len(CHANNEL_NAMES), 0), dtype=np.float32)
+    return matrix_stats(timestamps, matrix, percentiles)
+
+
+def matrix_stats(timestamps, matrix, percentiles=DEFAULT_PERCENTILES):
+    """Statistics over a (channels, samples) matrix with NaN for missing samples"""
+    # All-NaN channels yield NaN statistics rather than warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        valid = ~np.isnan(matrix)
+        count = valid.sum(axis=1)
+        minimum = np.nanmin(matrix, axis=1) if matrix.shape[1] else np.full(len(matrix), np.nan)
+        maximum = np.nanmax(matrix, axis=1) if matrix.shape[1] else np.full(len(matrix), np.nan)
+        mean = np.nanmean(matrix, axis=1) if matrix.shape[1] else np.full(len(matrix), np.nan)
+        if matrix.shape[1]:
+            quantiles = np.nanpercentile(matrix, percentiles, axis=1)
+        else:
+            quantiles = np.full((len(percentiles), len(matrix)), np.nan)
+
+        # Rate of change: least-squares slope per channel, in units per second
+        t = np.where(valid, timestamps[None, :] - (timestamps[0] if len(timestamps) else 0), np.nan)
+        t_mean = np.nanmean(t, axis=1) if matrix.shape[1] else np.full(len(matrix), np.nan)
+        dt = t - t_mean[:, None]
+        dv = matrix - mean[:, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.nansum(dt * dv, axis=1) / np.nansum(dt * dt, axis=1)
+        slope[count < 2] = np.nan
+
+    stats = {}
+    for i, name in enumerate(CHANNEL_NAMES[:len(matrix)]):
+        entry = {
+            'count': int(count[i]),
+            'min': float(minimum[i]),
+            'max': float(maximum[i]),
+            'mean': float(mean[i]),
+            'rate_per_s': float(slope[i]),
+        }
+        for j, percentile in enumerate(percentiles):
+            entry[f"p{percentile:g}"] = float(quantiles[j][i])
+        stats[name] = entry
+    return stats
+
+
+def rolling(values, window, statistic='mean'):
+    """Trailing rolling statistic over a 1-D series (NaN-aware, no Python loops)"""
+    values = np.asarray(values, dtype=np.float64)
+    if window <= 1 or len(values) == 0:
+        return values.copy()
+    if statistic == 'mean':
+        valid = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        index = np.arange(1, len(values) + 1)
+        lower = np.maximum(index - window, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (sums[index] - sums[lower]) / (counts[index] - counts[lower])
+
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    view = np.lib.stride_tricks.sliding_window_view(padded, window)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if statistic == 'min':
+            return np.nanmin(view, axis=1)
+        if statistic == 'max':
+            return np.nanmax(view, axis=1)
+    raise ValueError(f"Unknown rolling statistic: {statistic}")
+
+
+def run_benchmark(boards=100, hours=24):
+    """Backfill boards with 1 Hz history, then time a chart query against a raw rescan"""
+    seconds = hours * 3600
+    end = 1_700_000_000
+    start = end - seconds + 1
+    timestamps = np.arange(start, end + 1, dtype=np.float64)
+    rng = np.random.default_rng(1)
+
+    aggregator = SensorAggregator()
+    buffers = {}
+    backfill = time.perf_counter()
+    for i in range(boards):
+        name = f"board-{i + 1}"
+        values = np.empty((seconds, len(CHANNEL_NAMES)), dtype=np.float32)
+        values[:] = rng.normal(20, 1, size=(seconds, 1)).astype(np.float32)
+        aggregator.board(name).add_many(timestamps, values)
+
+        buffer = SensorRingBuffer(seconds)
+        buffer.first_slot = start
+        buffer.head_slot = end
+        buffer.columns['temperature'][(timestamps.astype(np.int64) % seconds)] = (values[:, 0] * 100).astype(np.int16)
+        buffers[name] = buffer
+    backfill = time.perf_counter() - backfill
+
+    names = list(buffers)
+    query = time.perf_counter()
+    chart_timestamps, mean, _, _ = aggregator.chart(names, 'temperature', start, end)
+    query_ms = (time.perf_counter() - query) * 1000
+
+    rescan = time.perf_counter()
+    for name in names:
+        _, columns = buffers[name].window(start, end, channels=('temperature',))
+        column = columns['temperature']
+        column[:len(column) // 60 * 60].reshape(-1, 60).mean(axis=1)
+    rescan_ms = (time.perf_counter() - rescan) * 1000
+
+    memory = sum(tiers.nbytes for tiers in aggregator.boards.values())
+    print(f"Backfilled {boards} boards x {hours}h of 1 Hz samples in {backfill:.1f}s")
+    print(f"Tier memory: {memory / 1024 ** 2:.1f} MiB ({memory / boards / 1024 ** 2:.2f} MiB per board)")
+    print(f"{hours}h chart over {boards} boards from tiers: {query_ms:.2f}ms "
+          f"({mean.shape[1]} points per board)")
+    print(f"Same chart by rescanning raw samples: {rescan_ms:.2f}ms")
+
+    stats = window_stats(buffers[names[0]], end - 3600 + 1, end)
+    print(f"1h window on {names[0]}: temperature {stats['temperature']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Sensor Aggregates')
+    parser.add_argument('--benchmark', action='store_true', help='Run the chart query benchmark')
+    parser.add_argument('--boards', type=int, default=100, help='Boards in the benchmark (default: 100)')
+    parser.add_argument('--hours', type=int, default=24, help='Hours of history in the benchmark (default: 24)')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.boards, args.hours)
+        return
+
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
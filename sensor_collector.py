@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Sensor Collector
+Polls /api/sensors across many boards into compact columnar ring buffers
+"""
+
+import time
+import asyncio
+import argparse
+import threading
+
+import numpy as np
+
+from fleet_client import FleetClient
+
+# Channel layout: (JSON field, storage dtype, scale, missing-value sentinel).
+# Values are stored as scaled integers, so a sample costs 10 bytes across all
+# seven channels; the sample time is implied by its slot in the ring.
+CHANNELS = (
+    ('temperature', np.int16, 100, np.iinfo(np.int16).min),   # 0.01 °C
+    ('humidity', np.uint16, 100, np.iinfo(np.uint16).max),    # 0.01 %
+    ('motion', np.uint8, 1, np.iinfo(np.uint8).max),
+    ('lightLevel', np.uint8, 1, np.iinfo(np.uint8).max),      # %
+    ('distance', np.int16, 10, np.iinfo(np.int16).min),       # 0.1 cm, -1 = invalid reading
+    ('moisture', np.uint8, 1, np.iinfo(np.uint8).max),        # %
+    ('gasLevel', np.uint8, 1, np.iinfo(np.uint8).max),        # %
+)
+CHANNEL_NAMES = tuple(channel[0] for channel in CHANNELS)
+BYTES_PER_SAMPLE = sum(np.dtype(channel[1]).itemsize for channel in CHANNELS)
+
+_CHANNEL_SPECS = {name: (dtype, scale, sentinel) for name, dtype, scale, sentinel in CHANNELS}
+
+# Storable range for each channel, keeping the sentinel out of reach
+_LIMITS = {}
+for _name, _dtype, _, _sentinel in CHANNELS:
+    _info = np.iinfo(_dtype)
+    _LIMITS[_name] = (_info.min + 1, _info.max) if _sentinel == _info.min else (_info.min, _info.max - 1)
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_RETENTION = 7 * 24 * 3600
+
+
+def memory_estimate(boards, retention=DEFAULT_RETENTION, interval=DEFAULT_INTERVAL):
+    """Bytes needed to hold retention seconds of samples for a number of boards"""
+    return boards * int(retention / interval) * BYTES_PER_SAMPLE
+
+
+class SensorRingBuffer:
+    """Fixed-capacity columnar history for one board.
+
+    Each channel is a preallocated NumPy array indexed by time slot
+    (timestamp // interval) modulo capacity. Appending writes one element per
+    channel, and slots skipped by missed polls are filled with the channel's
+    missing-value sentinel so every slot stays aligned to wall-clock time.
+    """
+
+    def __init__(self, capacity, interval=DEFAULT_INTERVAL):
+        self.capacity = int(capacity)
+        self.interval = interval
+        self.columns = {name: np.full(self.capacity, sentinel, dtype=dtype)
+                        for name, dtype, _, sentinel in CHANNELS}
+        self.first_slot = None
+        self.head_slot = None
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def _clear(self, first_slot, last_slot):
+        """Mark an inclusive slot range as missing"""
+        length = min(last_slot - first_slot + 1, self.capacity)
+        if length <= 0:
+            return
+        start = first_slot % self.capacity
+        end = start + length
+        for name, _, _, sentinel in CHANNELS:
+            column = self.columns[name]
+            if end <= self.capacity:
+                column[start:end] = sentinel
+            else:
+                column[start:] = sentinel
+                column[:end - self.capacity] = sentinel
+
+    def append(self, timestamp, sample):
+        """Store one /api/sensors reading taken at timestamp (seconds)"""
+        slot = int(timestamp // self.interval)
+
+        if self.head_slot is None:
+            self.first_slot = self.head_slot = slot
+        elif slot > self.head_slot:
+            self._clear(self.head_slot + 1, slot - 1)
+            self.head_slot = slot
+        elif slot <= self.head_slot - self.capacity or slot < self.first_slot:
+            # Older than anything still retained
+            return False
+
+        # Late or duplicate readings simply overwrite their slot
+        index = slot % self.capacity
+        for name, _, scale, sentinel in CHANNELS:
+            value = sample.get(name)
+            if value is None or value != value:
+                self.columns[name][index] = sentinel
+            else:
+                low, high = _LIMITS[name]
+                self.columns[name][index] = min(max(int(round(float(value) * scale)), low), high)
+        return True
+
+    def _slot_range(self, start=None, end=None):
+        if self.head_slot is None:
+            return None
+        oldest = max(self.first_slot, self.head_slot - self.capacity + 1)
+        first = oldest if start is None else max(oldest, int(np.ceil(start / self.interval)))
+        last = self.head_slot if end is None else min(self.head_slot, int(end // self.interval))
+        if last < first:
+            return None
+        return first, last
+
+    def raw(self, start=None, end=None):
+        """Raw stored columns between two timestamps, as (slots, {name: array})"""
+        slot_range = self._slot_range(start, end)
+        if slot_range is None:
+            return np.empty(0, dtype=np.int64), {name: self.columns[name][:0] for name in CHANNEL_NAMES}
+
+        first, last = slot_range
+        slots = np.arange(first, last + 1, dtype=np.int64)
+        start_index = first % self.capacity
+        end_index = start_index + len(slots)
+        columns = {}
+        for name in CHANNEL_NAMES:
+            column = self.columns[name]
+            if end_index <= self.capacity:
+                columns[name] = column[start_index:end_index]
+            else:
+                columns[name] = np.concatenate((column[start_index:], column[:end_index - self.capacity]))
+        return slots, columns
+
+    def window(self, start=None, end=None, channels=CHANNEL_NAMES):
+        """Decoded samples between two timestamps as (timestamps, {name: float32 array}).
+
+        Missing samples are NaN.
+        """
+        slots, raw = self.raw(start, end)
+        timestamps = slots * self.interval
+        return timestamps, {name: decode(name, raw[name]) for name in channels}
+
+    def latest(self):
+        """Most recent sample as a dict, or None"""
+        if self.head_slot is None:
+            return None
+        index = self.head_slot % self.capacity
+        sample = {'timestamp': self.head_slot * self.interval}
+        for name in CHANNEL_NAMES:
+            value = decode(name, self.columns[name][index:index + 1])[0]
+            sample[name] = None if np.isnan(value) else round(float(value), 2)
+        return sample
+
+
+def decode(name, raw):
+    """Convert stored integers for a channel back to float32 with NaN for missing"""
+    _, scale, sentinel = _CHANNEL_SPECS[name]
+    values = raw.astype(np.float32)
+    if scale != 1:
+        values /= scale
+    values[raw == sentinel] = np.nan
+    return values
+
+
+class SensorCollector:
+    """Polls /api/sensors on a fleet of boards at a fixed cadence"""
+
+    def __init__(self, fleet, interval=DEFAULT_INTERVAL, retention=DEFAULT_RETENTION, per_host_limit=1):
+        self.client = FleetClient(fleet, per_host_limit=per_host_limit, read_timeout=max(interval, 1.0))
+        self.interval = interval
+        self.capacity = int(retention / interval)
+        self.buffers = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.is_running = False
+        self.thread = None
+        self.polls = 0
+        self.failures = 0
+        self.late_ticks = 0
+
+    def buffer(self, board):
+        """Ring buffer for a board, allocated on first use"""
+        buffer = self.buffers.get(board)
+        if buffer is None:
+            with self.lock:
+                buffer = self.buffers.get(board)
+                if buffer is None:
+                    buffer = SensorRingBuffer(self.capacity, self.interval)
+                    self.buffers[board] = buffer
+        return buffer
+
+    def add_listener(self, callback):
+        """Call callback(board, timestamp, sample) for every stored sample"""
+        self.listeners.append(callback)
+
+    def ingest(self, board, timestamp, sample):
+        """Store one sample, whatever its source"""
+        stored = self.buffer(board).append(timestamp, sample)
+        if stored:
+            for callback in self.listeners:
+                callback(board, timestamp, sample)
+        return stored
+
+    async def poll_once(self):
+        """Poll every board once and store the results"""
+        timestamp = time.time()
+        results = await self.client.get_sensors()
+        for board, result in results.items():
+            self.polls += 1
+            if result['ok'] and isinstance(result['data'], dict):
+                self.ingest(board, timestamp, result['data'])
+            else:
+                self.failures += 1
+        return results
+
+    async def run(self):
+        """Poll on a fixed cadence until stopped"""
+        self.is_running = True
+        next_tick = time.monotonic()
+        try:
+            while self.is_running:
+                await self.poll_once()
+                next_tick += self.interval
+                delay = next_tick - time.monotonic()
+                if delay < 0:
+                    # A sweep overran the interval; skip ahead instead of bursting
+                    self.late_ticks += 1
+                    next_tick = time.monotonic()
+                    delay = 0
+                await asyncio.sleep(delay)
+        finally:
+            await self.client.close()
+
+    def start(self):
+        """Poll on a background thread"""
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()), name="sensor-collector", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def memory_usage(self):
+        """Bytes currently allocated for history"""
+        return sum(buffer.nbytes for buffer in self.buffers.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Sensor Collector')
+    parser.add_argument('--fleet', help='JSON file mapping sensor board names to URLs')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='Polling interval in seconds (default: 1)')
+    parser.add_argument('--retention', type=float, default=7, help='Days of history to keep (default: 7)')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to collect before printing (default: 10)')
+    parser.add_argument('--estimate', type=int, metavar='BOARDS', help='Print the memory needed for BOARDS boards and exit')
+
+    args = parser.parse_args()
+    retention = args.retention * 24 * 3600
+
+    if args.estimate:
+        total = memory_estimate(args.estimate, retention, args.interval)
+        print(f"{BYTES_PER_SAMPLE} bytes per sample across {len(CHANNELS)} channels")
+        print(f"{args.estimate} boards x {args.retention:g} days at {args.interval:g}s: {total / 1024 ** 2:.1f} MiB")
+        return
+
+    if not args.fleet:
+        parser.error("--fleet is required unless --estimate is given")
+
+    collector = SensorCollector(args.fleet, args.interval, retention).start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.stop()
+
+    for board, buffer in sorted(collector.buffers.items()):
+        print(f"{board}: {buffer.latest()}")
+    print(f"{collector.polls} polls, {collector.failures} failures, "
+          f"{collector.memory_usage() / 1024 ** 2:.1f} MiB allocated")
+
+if __name__ == "__main__":
+    main()
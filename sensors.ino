@@ -62,6 +62,14 @@ unsigned long lastFirebaseUpdate = 0;
 const unsigned long sensorReadInterval = 2000;  // Read sensors every 2 seconds
 const unsigned long firebaseUpdateInterval = 5000;  // Update Firebase every 5 seconds
 
+// /api/sensors body, rendered into this fixed buffer once per sensor read
+// and sent unchanged to every poll in between, without String allocations
+char sensorJson[224];
+int sensorJsonLength = 0;
+
+// Reused for every Firebase update instead of being rebuilt each time
+FirebaseJson firebaseJson;
+
 // Motion detection variables
 bool lastMotionState = false;
 unsigned long motionStartTime = 0;
@@ -162,6 +170,7 @@ void readAllSensors() {
   
   // Update timestamp
   sensorData.timestamp = millis();
+  renderSensorJson();
   
   // Print sensor data
   printSensorData();
@@ -268,19 +277,21 @@ void handleSensorDashboard() {
   server.send(200, "text/html", html);
 }
 
+void renderSensorJson() {
+  // %.2f matches String(float), including "nan" for a failed DHT read
+  sensorJsonLength = snprintf(sensorJson, sizeof(sensorJson),
+                              "{\"temperature\":%.2f,\"humidity\":%.2f,\"motion\":%s,\"lightLevel\":%d,"
+                              "\"distance\":%.2f,\"moisture\":%d,\"gasLevel\":%d,\"timestamp\":%lu}",
+                              sensorData.temperature, sensorData.humidity, sensorData.motion ? "true" : "false",
+                              sensorData.lightLevel, sensorData.distance, sensorData.moisture,
+                              sensorData.gasLevel, sensorData.timestamp);
+}
+
 void handleSensorData() {
-  String json = "{";
-  json += "\"temperature\":" + String(sensorData.temperature) + ",";
-  json += "\"humidity\":" + String(sensorData.humidity) + ",";
-  json += "\"motion\":" + String(sensorData.motion ? "true" : "false") + ",";
-  json += "\"lightLevel\":" + String(sensorData.lightLevel) + ",";
-  json += "\"distance\":" + String(sensorData.distance) + ",";
-  json += "\"moisture\":" + String(sensorData.moisture) + ",";
-  json += "\"gasLevel\":" + String(sensorData.gasLevel) + ",";
-  json += "\"timestamp\":" + String(sensorData.timestamp);
-  json += "}";
-  
-  server.send(200, "application/json", json);
+  if (sensorJsonLength == 0) {
+    renderSensorJson();
+  }
+  server.send_P(200, "application/json", sensorJson, sensorJsonLength);
 }
 
 void handleTemperature() {
@@ -313,17 +324,16 @@ void handleGas() {
 
 void updateFirebase() {
   if (Firebase.ready()) {
-    FirebaseJson json;
-    json.set("temperature", sensorData.temperature);
-    json.set("humidity", sensorData.humidity);
-    json.set("motion", sensorData.motion);
-    json.set("lightLevel", sensorData.lightLevel);
-    json.set("distance", sensorData.distance);
-    json.set("moisture", sensorData.moisture);
-    json.set("gasLevel", sensorData.gasLevel);
-    json.set("timestamp", sensorData.timestamp);
+    firebaseJson.set("temperature", sensorData.temperature);
+    firebaseJson.set("humidity", sensorData.humidity);
+    firebaseJson.set("motion", sensorData.motion);
+    firebaseJson.set("lightLevel", sensorData.lightLevel);
+    firebaseJson.set("distance", sensorData.distance);
+    firebaseJson.set("moisture", sensorData.moisture);
+    firebaseJson.set("gasLevel", sensorData.gasLevel);
+    firebaseJson.set("timestamp", sensorData.timestamp);
     
-    if (Firebase.RTDB.setJSON(&fbdo, "/sensors/esp32", &json)) {
+    if (Firebase.RTDB.setJSON(&fbdo, "/sensors/esp32", &firebaseJson)) {
       // Success
     } else {
       Serial.println("Firebase update failed: " + fbdo.errorReason());
@@ -509,7 +519,14 @@ String getSensorDashboardHTML() {
             }
             
             init() {
-                this.startUpdates();
+                // ?push=http://gateway:8090 switches from polling to push_gateway.py events
+                const params = new URLSearchParams(window.location.search);
+                const gateway = params.get('push');
+                if (gateway && window.EventSource) {
+                    this.startPush(gateway, params.get('board') || 'sensors');
+                } else {
+                    this.startUpdates();
+                }
             }
             
             startUpdates() {
@@ -517,28 +534,46 @@ String getSensorDashboardHTML() {
                 this.updateSensors(); // Initial update
             }
             
+            startPush(gateway, board) {
+                const source = new EventSource(`${gateway.replace(/\/$/, '')}/events?board=${encodeURIComponent(board)}`);
+                
+                source.addEventListener('snapshot', (e) => {
+                    const data = JSON.parse(e.data)[board];
+                    if (data) this.render(data);
+                });
+                source.addEventListener('delta', (e) => {
+                    for (const delta of JSON.parse(e.data)) {
+                        this.data[delta.field] = delta.value;
+                    }
+                    this.render(this.data);
+                });
+            }
+            
             async updateSensors() {
                 try {
                     const response = await fetch('/api/sensors');
-                    const data = await response.json();
-                    
-                    document.getElementById('temperature').textContent = data.temperature.toFixed(1) + '°C';
-                    document.getElementById('humidity').textContent = data.humidity.toFixed(1) + '%';
-                    document.getElementById('light').textContent = data.lightLevel + '%';
-                    document.getElementById('distance').textContent = data.distance.toFixed(1) + 'cm';
-                    document.getElementById('moisture').textContent = data.moisture + '%';
-                    document.getElementById('gas').textContent = data.gasLevel + '%';
-                    
-                    const motionElement = document.getElementById('motion');
-                    if (data.motion) {
-                        motionElement.innerHTML = '<span class="status-indicator status-on"></span>Motion Detected';
-                    } else {
-                        motionElement.innerHTML = '<span class="status-indicator status-off"></span>No Motion';
-                    }
+                    this.render(await response.json());
                 } catch (error) {
                     console.error('Error updating sensors:', error);
                 }
             }
+            
+            render(data) {
+                this.data = data;
+                document.getElementById('temperature').textContent = data.temperature.toFixed(1) + '°C';
+                document.getElementById('humidity').textContent = data.humidity.toFixed(1) + '%';
+                document.getElementById('light').textContent = data.lightLevel + '%';
+                document.getElementById('distance').textContent = data.distance.toFixed(1) + 'cm';
+                document.getElementById('moisture').textContent = data.moisture + '%';
+                document.getElementById('gas').textContent = data.gasLevel + '%';
+                
+                const motionElement = document.getElementById('motion');
+                if (data.motion) {
+                    motionElement.innerHTML = '<span class="status-indicator status-on"></span>Motion Detected';
+                } else {
+                    motionElement.innerHTML = '<span class="status-indicator status-off"></span>No Motion';
+                }
+            }
         }
         
         // Initialize dashboard
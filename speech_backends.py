@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Speech Backends
+Pluggable speech recognizers for voice control, including offline streaming recognition
+"""
+
+import json
+import time
+import wave
+import argparse
+
+from command_matcher import CommandMatcher, tokenize, CONJUNCTIONS
+
+DEFAULT_SAMPLE_RATE = 16000
+
+# Frame size fed to streaming recognizers (20ms at 16kHz, 16-bit mono)
+STREAM_FRAME_BYTES = 640
+
+
+class RecognizerBackend:
+    """Turns audio into a lowercase transcript.
+
+    Batch backends implement recognize(); streaming backends also return a
+    stream from open_stream() that is fed raw 16-bit mono frames as they
+    are captured and reports partial hypotheses along the way.
+    """
+
+    name = "base"
+    streaming = False
+    sample_rate = None
+
+    def set_phrases(self, phrases):
+        """Restrict recognition to these command phrases where supported"""
+
+    def recognize(self, audio):
+        raise NotImplementedError
+
+    def open_stream(self):
+        raise NotImplementedError(f"{self.name} does not support streaming")
+
+
+class GoogleBackend(RecognizerBackend):
+    """Google Web Speech API: the full phrase is uploaded once it has ended"""
+
+    name = "google"
+
+    def __init__(self, recognizer=None):
+        import speech_recognition as sr
+        self.sr = sr
+        self.recognizer = recognizer or sr.Recognizer()
+
+    def recognize(self, audio):
+        sr = self.sr
+        try:
+            return self.recognizer.recognize_google(audio).lower()
+        except sr.UnknownValueError:
+            print("Could not understand speech")
+            return None
+        except sr.RequestError as e:
+            print(f"Speech recognition error: {e}")
+            return None
+
+
+class VoskStream:
+    """One continuous recognition session over a microphone stream"""
+
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+
+    def accept(self, frame):
+        """Feed raw audio; returns (text, final) where final marks an utterance end"""
+        if self.recognizer.AcceptWaveform(frame):
+            return json.loads(self.recognizer.Result()).get('text', ''), True
+        return json.loads(self.recognizer.PartialResult()).get('partial', ''), False
+
+    def finish(self):
+        """Flush buffered audio and return the last transcript"""
+        return json.loads(self.recognizer.FinalResult()).get('text', '')
+
+
+class VoskBackend(RecognizerBackend):
+    """Offline Kaldi recognizer from the vosk package, run on the CPU.
+
+    With set_phrases() the decoder only considers words of the registered
+    commands, which makes it both faster and far less likely to hear a
+    command in unrelated speech.
+    """
+
+    name = "vosk"
+    streaming = True
+
+    def __init__(self, model_path, sample_rate=DEFAULT_SAMPLE_RATE):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("The vosk backend needs the vosk package (pip install vosk)")
+        vosk.SetLogLevel(-1)
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+        self.sample_rate = sample_rate
+        self.grammar = None
+
+    def set_phrases(self, phrases):
+        phrases = sorted({" ".join(tokenize(phrase)) for phrase in phrases} - {""})
+        # Conjunctions allow compound commands; [unk] absorbs everything else
+        self.grammar = json.dumps(phrases + list(CONJUNCTIONS) + ["[unk]"])
+
+    def open_stream(self):
+        if self.grammar is None:
+            recognizer = self.vosk.KaldiRecognizer(self.model, self.sample_rate)
+        else:
+            recognizer = self.vosk.KaldiRecognizer(self.model, self.sample_rate, self.grammar)
+        return VoskStream(recognizer)
+
+    def recognize(self, audio):
+        stream = self.open_stream()
+        stream.accept(audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        return stream.finish().replace('[unk]', '').strip() or None
+
+
+BACKENDS = ('google', 'vosk')
+
+
+def create_backend(name, recognizer=None, model_path=None):
+    """Build a backend by name"""
+    if name == 'google':
+        return GoogleBackend(recognizer)
+    if name == 'vosk':
+        if not model_path:
+            raise ValueError("The vosk backend needs a model directory (--vosk-model)")
+        return VoskBackend(model_path)
+    raise ValueError(f"Unknown recognizer '{name}'")
+
+
+class StreamingSession:
+    """Turns partial hypotheses into commands as early as they are certain.
+
+    A partial that is exactly a registered phrase which no longer phrase
+    extends is returned immediately, before the recognizer has even
+    detected the end of the utterance. Everything else waits for the final
+    result. When a command was already fired and the final transcript
+    continues it ("turn on light" ... "and fan"), only the remaining
+    clauses are returned.
+    """
+
+    def __init__(self, stream, matcher):
+        self.stream = stream
+        self.matcher = matcher
+        self.fired = None
+        self.early = 0
+
+    def feed(self, frame):
+        """Feed one frame; returns a transcript to execute, or None"""
+        text, final = self.stream.accept(frame)
+        text = text.replace('[unk]', '').strip()
+
+        if not final:
+            if self.fired is None and text:
+                found = self.matcher.match_exact(text)
+                if found and found[2]:
+                    self.fired = found[0]
+                    self.early += 1
+                    return text
+            return None
+
+        fired, self.fired = self.fired, None
+        if not text:
+            return None
+        if fired is None:
+            return text
+        if tokenize(text) == tokenize(fired):
+            return None
+        # The utterance went on after the early command
+        matches = self.matcher.match_all(text)
+        if len(matches) > 1 and matches[0][0] == fired:
+            return " and ".join(phrase for phrase, _ in matches[1:])
+        return None
+
+
+def speech_end(frames, threshold=500):
+    """Index of the frame after the last one above the RMS threshold"""
+    import numpy as np
+    end = 0
+    for i, frame in enumerate(frames):
+        samples = np.frombuffer(frame, dtype='<i2').astype(np.float64)
+        if samples.size and np.sqrt(np.mean(samples ** 2)) > threshold:
+            end = i + 1
+    return end
+
+
+def run_benchmark(audio_path, model_path=None, iterations=3, threshold=500):
+    """Time from end of speech to relay action for each available backend"""
+    import speech_recognition as sr
+    from esp32_emulator import ESP32Emulator
+    from device_client import get_client
+    from voice_control import DEFAULT_COMMANDS
+
+    matcher = CommandMatcher(DEFAULT_COMMANDS)
+    with wave.open(audio_path, 'rb') as wav:
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError("Benchmark audio must be 16-bit mono WAV")
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    # Streaming recognizers are opened at 16kHz, so frame the audio at that rate
+    # the same way live capture is converted
+    audio = sr.AudioData(raw, rate, 2)
+    pcm = audio.get_raw_data(convert_rate=DEFAULT_SAMPLE_RATE, convert_width=2)
+    frames = [pcm[i:i + STREAM_FRAME_BYTES] for i in range(0, len(pcm), STREAM_FRAME_BYTES)]
+    frame_seconds = STREAM_FRAME_BYTES / 2 / DEFAULT_SAMPLE_RATE
+    end_index = speech_end(frames, threshold)
+    print(f"{audio_path}: {len(frames) * frame_seconds:.2f}s audio, speech ends at {end_index * frame_seconds:.2f}s")
+
+    with ESP32Emulator() as emulator:
+        client = get_client(emulator.url)
+
+        def act(text):
+            found = matcher.match(text) if text else None
+            if found and "relay" in found[1]:
+                client.set_relay(found[1]["relay"], found[1]["state"])
+                return True
+            return False
+
+        backends = []
+        for name in BACKENDS:
+            try:
+                backend = create_backend(name, model_path=model_path)
+            except (RuntimeError, ValueError) as e:
+                print(f"{name:<7} skipped: {e}")
+                continue
+            backend.set_phrases(DEFAULT_COMMANDS)
+            backends.append(backend)
+
+        for backend in backends:
+            latencies = []
+            transcript = None
+            for _ in range(iterations):
+                if backend.streaming:
+                    # Real-time feed; the clock starts when the speaker stops
+                    session = StreamingSession(backend.open_stream(), matcher)
+                    start = time.perf_counter()
+                    spoke_until = None
+                    acted_at = None
+                    for i, frame in enumerate(frames):
+                        target = start + (i + 1) * frame_seconds
+                        time.sleep(max(0.0, target - time.perf_counter()))
+                        if i + 1 == end_index:
+                            spoke_until = time.perf_counter()
+                        text = session.feed(frame)
+                        if text and acted_at is None and act(text):
+                            transcript = text
+                            acted_at = time.perf_counter()
+                    if acted_at is None:
+                        text = session.stream.finish()
+                        if act(text):
+                            transcript = text
+                            acted_at = time.perf_counter()
+                    if acted_at is not None:
+                        latencies.append(acted_at - (spoke_until or acted_at))
+                else:
+                    # listen() only returns after pause_threshold seconds of silence
+                    start = time.perf_counter()
+                    transcript = backend.recognize(audio)
+                    if act(transcript):
+                        latencies.append(sr.Recognizer().pause_threshold + time.perf_counter() - start)
+
+            if latencies:
+                latencies.sort()
+                print(f"{backend.name:<7} heard {transcript!r}: end of speech to relay "
+                      f"median {latencies[len(latencies) // 2] * 1000:.0f}ms, best {latencies[0] * 1000:.0f}ms")
+            else:
+                print(f"{backend.name:<7} no command recognized (heard {transcript!r})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Speech Backends')
+    parser.add_argument('--benchmark', action='store_true', help='Compare end-of-speech to relay latency per backend')
+    parser.add_argument('--audio', help='16-bit mono WAV of a spoken command, e.g. "turn on light"')
+    parser.add_argument('--vosk-model', help='Vosk model directory (enables the offline backend)')
+    parser.add_argument('--iterations', type=int, default=3, help='Runs per backend (default: 3)')
+    parser.add_argument('--threshold', type=int, default=500, help='RMS level that counts as speech (default: 500)')
+
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        parser.print_help()
+        return
+    if not args.audio:
+        parser.error("--audio is required for --benchmark")
+    run_benchmark(args.audio, args.vosk_model, args.iterations, args.threshold)
+
+if __name__ == "__main__":
+    main()
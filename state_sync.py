@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - State Sync
+Last-known board state with change detection, deadband deltas and a compact delta log
+"""
+
+import json
+import time
+import struct
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from device_client import get_client
+from fleet_client import load_fleet
+
+# Minimum movement before a numeric field is reported again. Fields not
+# listed report any change; relay and motion flags always report.
+DEFAULT_DEADBANDS = {
+    'temperature': 0.1,
+    'humidity': 0.5,
+    'distance': 2.0,
+    'lightLevel': 1,
+    'moisture': 1,
+    'gasLevel': 1,
+}
+
+# Fields that change on every response without describing the board's state
+IGNORED_FIELDS = frozenset(['timestamp'])
+
+
+def encode_varint(value, out):
+    """Append an unsigned LEB128 varint to a bytearray"""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, pos):
+    """Read an unsigned LEB128 varint, returning (value, next position)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def float_bits(value):
+    return struct.unpack('<I', struct.pack('<f', value))[0]
+
+
+def bits_float(bits):
+    return struct.unpack('<f', struct.pack('<I', bits))[0]
+
+
+class DeltaLog:
+    """Append-only byte log of state changes.
+
+    Each entry is: varint timestamp delta (ms, zigzag), varint board id, then
+    varint (field id << 1 | value bit). Boolean fields carry their value in
+    that bit. Numeric fields are followed by the XOR of their float32 bits
+    with the field's previous value, stored as a trailing-zero count byte
+    plus the remaining bits as a varint, so a value that moved slightly
+    costs a few bytes instead of a full snapshot.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.boards = []
+        self.fields = []
+        self.kinds = []
+        self.board_ids = {}
+        self.field_ids = {}
+        self.last_ms = 0
+        self.last_bits = {}
+        self.entries = 0
+
+    def _id(self, names, ids, name):
+        index = ids.get(name)
+        if index is None:
+            index = len(names)
+            names.append(name)
+            ids[name] = index
+        return index
+
+    def append(self, timestamp, board, field, value):
+        out = self.data
+        ms = int(timestamp * 1000)
+        encode_varint(zigzag(ms - self.last_ms), out)
+        self.last_ms = ms
+        encode_varint(self._id(self.boards, self.board_ids, board), out)
+        field_id = self._id(self.fields, self.field_ids, field)
+        if field_id == len(self.kinds):
+            self.kinds.append('bool' if isinstance(value, bool) else 'float')
+
+        if self.kinds[field_id] == 'bool':
+            encode_varint(field_id << 1 | int(bool(value)), out)
+        else:
+            encode_varint(field_id << 1, out)
+            bits = float_bits(float(value))
+            xor = bits ^ self.last_bits.get((board, field), 0)
+            self.last_bits[(board, field)] = bits
+            if xor == 0:
+                out.append(32)
+            else:
+                trailing = (xor & -xor).bit_length() - 1
+                out.append(trailing)
+                encode_varint(xor >> trailing, out)
+        self.entries += 1
+
+    def replay(self):
+        """Decode entries as (timestamp, board, field, value)"""
+        data = self.data
+        pos = 0
+        ms = 0
+        last_bits = {}
+        while pos < len(data):
+            delta, pos = decode_varint(data, pos)
+            ms += unzigzag(delta)
+            board_id, pos = decode_varint(data, pos)
+            tag, pos = decode_varint(data, pos)
+            board = self.boards[board_id]
+            field = self.fields[tag >> 1]
+            if self.kinds[tag >> 1] == 'bool':
+                value = bool(tag & 1)
+            else:
+                trailing = data[pos]
+                pos += 1
+                xor = 0
+                if trailing != 32:
+                    xor, pos = decode_varint(data, pos)
+                    xor <<= trailing
+                bits = xor ^ last_bits.get((board, field), 0)
+                last_bits[(board, field)] = bits
+                value = round(bits_float(bits), 2)
+            yield ms / 1000, board, field, value
+
+    def save(self, path):
+        """Write the name tables as a JSON header line followed by the raw log"""
+        with open(path, 'wb') as f:
+            f.write(json.dumps({'boards': self.boards, 'fields': self.fields, 'kinds': self.kinds}).encode() + b"\n")
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        log = cls()
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            log.data = bytearray(f.read())
+        log.boards = header['boards']
+        log.fields = header['fields']
+        log.kinds = header['kinds']
+        log.board_ids = {name: i for i, name in enumerate(log.boards)}
+        log.field_ids = {name: i for i, name in enumerate(log.fields)}
+        return log
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class StateSync:
+    """Keeps the last-known state of every board and publishes only what changed.
+
+    update() takes the raw response body. A body identical to the previous
+    one for that board is dropped without parsing; otherwise each field is
+    compared with the last value reported to subscribers, and numeric
+    fields must move past their deadband before a new delta is emitted.
+    A body that is not a JSON object raises ValueError and leaves the
+    board's state untouched.
+    """
+
+    def __init__(self, deadbands=None, log=None):
+        self.deadbands = dict(DEFAULT_DEADBANDS)
+        if deadbands:
+            self.deadbands.update(deadbands)
+        self.log = log
+        self.states = {}
+        self.reported = {}
+        self.last_bodies = {}
+        self.updated_at = {}
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.stats_data = {
+            'updates': 0,
+            'unchanged': 0,
+            'parsed': 0,
+            'deltas': 0,
+            'invalid': 0,
+            'body_bytes': 0,
+        }
+
+    def subscribe(self, callback, boards=None, fields=None):
+        """Call callback(deltas) with each batch of deltas, optionally filtered"""
+        subscriber = (callback, set(boards) if boards else None, set(fields) if fields else None)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s[0] is not callback]
+
+    def update(self, board, body, timestamp=None):
+        """Feed one raw /api/status or /api/sensors body; returns the deltas emitted"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.stats_data['updates'] += 1
+            self.stats_data['body_bytes'] += len(body)
+            if self.last_bodies.get(board) == body:
+                self.updated_at[board] = timestamp
+                self.stats_data['unchanged'] += 1
+                return []
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                # Not cached, so a retry with the same body is parsed again
+                self.stats_data['invalid'] += 1
+                raise ValueError(f"{board}: response is not a JSON object")
+            self.stats_data['parsed'] += 1
+            deltas = self._diff(board, data, timestamp)
+            self.last_bodies[board] = body
+            self.updated_at[board] = timestamp
+            subscribers = list(self.subscribers)
+        self._publish(deltas, subscribers)
+        return deltas
+
+    def apply(self, board, changes, timestamp=None):
+        """Merge a known partial state (e.g. a relay just set) as if it had been polled"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            # The next poll must be parsed, since its body will differ from the cached one
+            self.last_bodies.pop(board, None)
+            deltas = self._diff(board, changes, timestamp)
+            subscribers = list(self.subscribers)
+        self._publish(deltas, subscribers)
+        return deltas
+
+    @staticmethod
+    def _publish(deltas, subscribers):
+        if not deltas:
+            return
+        for callback, boards, fields in subscribers:
+            selected = [d for d in deltas
+                        if (boards is None or d['board'] in boards) and (fields is None or d['field'] in fields)]
+            if selected:
+                callback(selected)
+
+    def _diff(self, board, data, timestamp):
+        state = self.states.setdefault(board, {})
+        reported = self.reported.setdefault(board, {})
+        deltas = []
+        for field, value in data.items():
+            if field in IGNORED_FIELDS:
+                continue
+            state[field] = value
+            previous = reported.get(field)
+
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                changed = previous != value
+            elif previous is None:
+                changed = True
+            else:
+                changed = abs(value - previous) >= self.deadbands.get(field, 0) and value != previous
+
+            if changed:
+                reported[field] = value
+                deltas.append({'board': board, 'field': field, 'value': value,
+                               'previous': previous, 'timestamp': timestamp})
+                if self.log is not None and isinstance(value, (bool, int, float)):
+                    self.log.append(timestamp, board, field, value)
+        self.stats_data['deltas'] += len(deltas)
+        return deltas
+
+    def state(self, board):
+        """Copy of the last-known state of a board, or None"""
+        with self.lock:
+            state = self.states.get(board)
+            return dict(state) if state is not None else None
+
+    def age(self, board, now=None):
+        """Seconds since the board's state was last confirmed, or None"""
+        updated = self.updated_at.get(board)
+        if updated is None:
+            return None
+        return (time.time() if now is None else now) - updated
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.stats_data)
+        stats['log_bytes'] = self.log.nbytes if self.log is not None else 0
+        if stats['log_bytes']:
+            stats['compression_ratio'] = stats['body_bytes'] / stats['log_bytes']
+        return stats
+
+
+class DeviceStateCache:
+    """Last-known relay state of one board, answered from memory.
+
+    The cache is refreshed in the background every ttl seconds and updated
+    write-through after successful relay commands. Writes only confirm the
+    relays they touched, so the state's age is measured from the last full
+    status read, and get() never returns a state older than max_staleness
+    without first trying a blocking refresh.
+    With verify enabled, every write is confirmed against the board on a
+    worker thread and on_mismatch(expected, actual) is called if the board
+    disagrees.
+    """
+
+    def __init__(self, client, board=None, sync=None, ttl=5.0, max_staleness=15.0, verify=False,
+                 on_mismatch=None):
+        self.client = client
+        self.board = board or client.base_url
+        self.sync = sync or StateSync()
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self.verify = verify
+        self.on_mismatch = on_mismatch
+        self.is_running = False
+        self.thread = None
+        self.wake = threading.Event()
+        self.verifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-verify") if verify else None
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.mismatches = 0
+
+    def refresh(self):
+        """Fetch /api/status now; returns True when the board answered"""
+        try:
+            response = self.client.get_status()
+        except requests.exceptions.RequestException:
+            self.failures += 1
+            return False
+        if response.status_code != 200:
+            self.failures += 1
+            return False
+        try:
+            self.sync.update(self.board, response.content)
+        except ValueError as e:
+            print(f"❌ {e}")
+            self.failures += 1
+            return False
+        self.refreshes += 1
+        return True
+
+    def age(self, now=None):
+        """Seconds since the whole state was last read from the board, or None"""
+        return self.sync.age(self.board, now)
+
+    def get(self):
+        """(state, age in seconds), refreshing first only if the cache is past its staleness bound"""
+        age = self.age()
+        if age is None or age > self.max_staleness:
+            self.refresh()
+            age = self.age()
+        else:
+            self.hits += 1
+        return self.sync.state(self.board), age
+
+    def write_through(self, changes):
+        """Record a state the board just acknowledged"""
+        self.sync.apply(self.board, changes)
+        if self.verifier is not None:
+            self.verifier.submit(self._verify, dict(changes))
+
+    def _verify(self, expected):
+        if not self.refresh():
+            return
+        state = self.sync.state(self.board) or {}
+        actual = {key: state.get(key) for key in expected}
+        if actual != expected:
+            self.mismatches += 1
+            if self.on_mismatch is not None:
+                self.on_mismatch(expected, actual)
+
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            age = self.age()
+            if age is None or age >= self.ttl:
+                self.refresh()
+                age = 0
+            self.wake.wait(max(self.ttl - age, 0.05))
+
+    def start(self):
+        """Refresh in the background every ttl seconds"""
+        self.thread = threading.Thread(target=self.run, name="state-cache", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.is_running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.verifier is not None:
+            self.verifier.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'mismatches': self.mismatches,
+            'age_s': self.age(),
+        }
+
+
+class StatePoller:
+    """Polls an endpoint on a set of boards and feeds the raw bodies into a StateSync"""
+
+    def __init__(self, sync, boards, path="/api/status", interval=2.0):
+        self.sync = sync
+        self.boards = dict(boards)
+        self.path = path
+        self.interval = interval
+        self.is_running = False
+        self.thread = None
+        self.failures = 0
+
+    def poll_once(self):
+        for name, url in self.boards.items():
+            try:
+                response = get_client(url).get(self.path)
+                if response.status_code == 200:
+                    self.sync.update(name, response.content)
+                else:
+                    self.failures += 1
+            except (requests.exceptions.RequestException, ValueError):
+                self.failures += 1
+
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            started = time.monotonic()
+            self.poll_once()
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="state-poller", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def run_benchmark(boards=100, polls=1000, seed=1):
+    """Simulate mostly idle boards and compare parsing every body with StateSync"""
+    import random
+    from esp32_emulator import EmulatedBoard, ROLE_SENSOR
+
+    rng = random.Random(seed)
+    relay_boards = [EmulatedBoard(seed=seed + i) for i in range(boards)]
+    sensor_board = EmulatedBoard(role=ROLE_SENSOR, seed=seed)
+    bodies = []
+    for n in range(polls):
+        for i, board in enumerate(relay_boards):
+            # Roughly one relay change per board every 500 polls
+            if rng.random() < 0.002:
+                board.relay_states[rng.randrange(4)] ^= True
+            bodies.append((f"board-{i}", n * 2.0, board.handle_status({})[2].encode()))
+    sensor_bodies = []
+    for n in range(polls):
+        sensor_board.last_sensor_read = None
+        sensor_bodies.append(("sensor-1", n * 2.0, sensor_board.handle_sensor_data({})[2].encode()))
+
+    for label, stream in (("status", bodies), ("sensors", sensor_bodies)):
+        start = time.perf_counter()
+        for _, _, body in stream:
+            json.loads(body)
+        full_ms = (time.perf_counter() - start) * 1000
+
+        sync = StateSync(log=DeltaLog())
+        start = time.perf_counter()
+        for name, timestamp, body in stream:
+            sync.update(name, body, timestamp)
+        sync_ms = (time.perf_counter() - start) * 1000
+
+        stats = sync.stats()
+        print(f"{label}: {len(stream)} bodies, {stats['parsed']} parsed, {stats['deltas']} deltas")
+        print(f"  parse every body: {full_ms:.1f}ms, state sync: {sync_ms:.1f}ms")
+        print(f"  snapshots: {stats['body_bytes'] / 1024:.1f} KiB, delta log: {stats['log_bytes'] / 1024:.1f} KiB "
+              f"({stats.get('compression_ratio', 0):.0f}x smaller)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation State Sync')
+    parser.add_argument('--url', help='Board to watch')
+    parser.add_argument('--fleet', help='JSON file mapping board names to URLs')
+    parser.add_argument('--path', default='/api/status', help='Endpoint to poll (default: /api/status)')
+    parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds (default: 2)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to watch (default: 30)')
+    parser.add_argument('--log', help='Save the delta log to this file when done')
+    parser.add_argument('--benchmark', action='store_true', help='Compare full parsing with delta sync')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark()
+        return
+
+    if args.fleet:
+        boards = load_fleet(args.fleet)
+    elif args.url:
+        boards = {'esp32': args.url}
+    else:
+        parser.error("--url or --fleet is required")
+
+    sync = StateSync(log=DeltaLog())
+    sync.subscribe(lambda deltas: [print(f"{d['board']}: {d['field']} {d['previous']} -> {d['value']}")
+                                   for d in deltas])
+    poller = StatePoller(sync, boards, args.path, args.interval).start()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        poller.stop()
+
+    print(f"Stats: {sync.stats()}")
+    if args.log:
+        sync.log.save(args.log)
+        print(f"✅ Delta log saved to {args.log}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Suite Scheduler
+Runs independent tests concurrently based on the board resources they touch
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Board resources a test can declare
+STATUS = "status"        # Reads /api/status
+ASSETS = "assets"        # Reads /, /style.css, /script.js
+ALL_RELAYS = "relays"    # Writes every relay
+
+
+def relay(number):
+    """Resource name for a single relay"""
+    return f"relay:{number}"
+
+
+def expand(resources, relay_count=4):
+    """Expand the all-relays resource into the individual relays it covers"""
+    expanded = set()
+    for resource in resources:
+        if resource == ALL_RELAYS:
+            expanded.update(relay(i) for i in range(1, relay_count + 1))
+        else:
+            expanded.add(resource)
+    return expanded
+
+
+class SuiteTask:
+    def __init__(self, name, func, reads=(), writes=(), after=(), relay_count=4):
+        self.name = name
+        self.func = func
+        self.reads = expand(reads, relay_count)
+        self.writes = expand(writes, relay_count)
+        self.after = set(after)
+        self.result = None
+        self.error = None
+        self.duration = 0.0
+
+    def conflicts_with(self, other):
+        """Two tasks conflict when either one writes something the other uses"""
+        return bool(self.writes & (other.reads | other.writes) or other.writes & self.reads)
+
+
+class SuiteScheduler:
+    """Runs tasks on a thread pool as soon as their dependencies have finished
+    and no running task holds a conflicting resource.
+
+    A task whose dependency failed (returned False or raised) is skipped.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.tasks = {}
+        self.order = []
+
+    def add(self, name, func, reads=(), writes=(), after=()):
+        """Register a test with the resources it reads and writes"""
+        for dependency in after:
+            if dependency not in self.tasks:
+                raise ValueError(f"Unknown dependency '{dependency}' for test '{name}'")
+        self.tasks[name] = SuiteTask(name, func, reads, writes, after)
+        self.order.append(name)
+        return self.tasks[name]
+
+    def run(self):
+        """Run every registered task and return {name: result}"""
+        pending = list(self.order)
+        running = {}
+        finished = {}
+        skipped = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                progressed = False
+                for name in list(pending):
+                    task = self.tasks[name]
+
+                    if any(dependency in skipped or finished.get(dependency) is False for dependency in task.after):
+                        pending.remove(name)
+                        skipped.add(name)
+                        finished[name] = None
+                        progressed = True
+                        continue
+                    if any(dependency not in finished for dependency in task.after):
+                        continue
+                    if len(running) >= self.max_workers:
+                        break
+                    if any(task.conflicts_with(other) for other in running.values()):
+                        continue
+
+                    pending.remove(name)
+                    running[executor.submit(self._run_task, task)] = task
+                    progressed = True
+
+                if not running:
+                    if pending and not progressed:
+                        raise RuntimeError(f"Test dependencies cannot be satisfied: {', '.join(pending)}")
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    finished[task.name] = task.result
+
+        return {name: self.tasks[name].result for name in self.order}
+
+    @staticmethod
+    def _run_task(task):
+        start = time.perf_counter()
+        try:
+            result = task.func()
+            # Tests that only record results return None; treat that as success
+            task.result = True if result is None else bool(result)
+        except Exception as e:
+            task.error = e
+            task.result = False
+        task.duration = time.perf_counter() - start
+        return task.result
+
+
+def wait_until(predicate, timeout=2.0, interval=0.05):
+    """Poll predicate until it returns True or the deadline passes.
+
+    Returns the elapsed time in seconds, or None if the deadline passed.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    while True:
+        try:
+            if predicate():
+                return time.perf_counter() - start
+        except Exception:
+            pass
+        if time.perf_counter() >= deadline:
+            return None
+        time.sleep(interval)
@@ -12,17 +12,36 @@ import argparse
 from datetime import datetime
 import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from device_client import get_client
+from command_batcher import CommandBatcher
+from fleet_client import FleetClient, summarize, load_fleet
+from suite_scheduler import SuiteScheduler, STATUS, ASSETS, ALL_RELAYS, relay, wait_until
+from load_generator import (LoadGenerator, SoakTest, parse_mix, format_report, format_window, compare_reports,
+                            format_comparison, DEFAULT_MIX,
+                            DEFAULT_SOAK_RATE, DEFAULT_SOAK_WINDOW, DEFAULT_P99_DRIFT)
 
 class ESP32Tester:
-    def __init__(self, base_url="http://192.168.1.100", timeout=5):
+    def __init__(self, base_url="http://192.168.1.100", timeout=5, name=None, workers=4, state_timeout=2.0):
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
+        self.name = name
+        self.workers = workers
+        self.state_timeout = state_timeout
+        self.client = get_client(self.base_url, read_timeout=timeout)
         self.test_results = []
+        self.results_lock = threading.Lock()
+        self.board_testers = []
+        self.load_results = None
+        self.soak_results = None
+        self.load_comparison = None
         self.test_queue = queue.Queue()
         
     def log(self, message, level="INFO"):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] [{level}] {message}")
+        board = f" [{self.name}]" if self.name else ""
+        print(f"[{timestamp}] [{level}]{board} {message}")
         
     def add_test_result(self, test_name, passed, message=""):
         result = {
@@ -31,7 +50,10 @@ class ESP32Tester:
             'message': message,
             'timestamp': datetime.now().isoformat()
         }
-        self.test_results.append(result)
+        if self.name:
+            result['board'] = self.name
+        with self.results_lock:
+            self.test_results.append(result)
         
         status = "✅ PASS" if passed else "❌ FAIL"
         self.log(f"{status} - {test_name}: {message}")
@@ -39,7 +61,7 @@ class ESP32Tester:
     def test_connection(self):
         """Test basic connectivity to ESP32"""
         try:
-            response = requests.get(f"{self.base_url}/", timeout=self.timeout)
+            response = self.client.get("/")
             if response.status_code == 200:
                 self.add_test_result("Connection Test", True, "ESP32 is reachable")
                 return True
@@ -53,7 +75,7 @@ class ESP32Tester:
     def test_api_status(self):
         """Test API status endpoint"""
         try:
-            response = requests.get(f"{self.base_url}/api/status", timeout=self.timeout)
+            response = self.client.get_status()
             if response.status_code == 200:
                 data = response.json()
                 if all(key in data for key in ['relay1', 'relay2', 'relay3', 'relay4']):
@@ -75,8 +97,7 @@ class ESP32Tester:
     def test_relay_control(self, relay_num, state):
         """Test individual relay control"""
         try:
-            url = f"{self.base_url}/api/relay?relay={relay_num}&state={state}"
-            response = requests.get(url, timeout=self.timeout)
+            response = self.client.set_relay(relay_num, state)
             
             if response.status_code == 200:
                 data = response.json()
@@ -96,8 +117,7 @@ class ESP32Tester:
     def test_all_relays_control(self, state):
         """Test bulk relay control"""
         try:
-            url = f"{self.base_url}/api/all?state={state}"
-            response = requests.get(url, timeout=self.timeout)
+            response = self.client.set_all(state)
             
             if response.status_code == 200:
                 data = response.json()
@@ -114,38 +134,88 @@ class ESP32Tester:
             self.add_test_result("Bulk Relay Control", False, f"Request failed: {str(e)}")
             return False
             
+    def relays_match(self, expected):
+        """Check /api/status against a {relay number: state} mapping"""
+        response = self.client.get_status()
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        return all(data.get(f"relay{number}") == state for number, state in expected.items())
+        
+    def wait_for_relays(self, test_name, expected):
+        """Poll status until the relays report the expected states or the deadline passes"""
+        elapsed = wait_until(lambda: self.relays_match(expected), timeout=self.state_timeout)
+        if elapsed is None:
+            self.add_test_result(test_name, False, f"State not confirmed within {self.state_timeout:.1f}s")
+            return False
+        self.add_test_result(test_name, True, f"State confirmed in {elapsed * 1000:.0f}ms")
+        return True
+        
+    def test_relay_cycle(self, relay_num):
+        """Turn one relay on and off, confirming each state"""
+        passed = True
+        for state in (True, False):
+            if self.test_relay_control(relay_num, state):
+                passed &= self.wait_for_relays(f"Relay {relay_num} State", {relay_num: state})
+            else:
+                passed = False
+        return passed
+        
     def test_relay_sequence(self):
         """Test a sequence of relay operations"""
         self.log("Starting relay sequence test...")
         
         # Test individual relays
-        for relay in range(1, 5):
-            # Turn on
-            self.test_relay_control(relay, True)
-            time.sleep(0.5)
-            
-            # Turn off
-            self.test_relay_control(relay, False)
-            time.sleep(0.5)
+        passed = True
+        for relay_num in range(1, 5):
+            passed &= self.test_relay_cycle(relay_num)
+        return passed
             
     def test_bulk_operations(self):
         """Test bulk operations"""
         self.log("Testing bulk operations...")
         
-        # Turn all on
-        self.test_all_relays_control(True)
-        time.sleep(1)
+        passed = True
+        for state in (True, False):
+            if self.test_all_relays_control(state):
+                passed &= self.wait_for_relays("Bulk Relay State", {number: state for number in range(1, 5)})
+            else:
+                passed = False
+        return passed
         
-        # Turn all off
-        self.test_all_relays_control(False)
-        time.sleep(1)
+    def test_batched_relay_order(self, relay_num=1):
+        """Flush on, off, on for one relay back to back; the board must end up on"""
+        self.log("Testing batched command ordering...")
+        
+        batcher = CommandBatcher()
+        try:
+            futures = []
+            for state in (True, False, True):
+                futures.append(batcher.submit(self.base_url, relay_num, state))
+                batcher.flush()
+                # Let the batcher start sending before the next command arrives
+                time.sleep(0.002)
+            for future in futures:
+                future.result(self.timeout)
+        except Exception as e:
+            self.add_test_result("Batched Command Order", False, f"Batch failed: {e}")
+            return False
+        finally:
+            batcher.close()
+            
+        passed = self.wait_for_relays("Batched Command Order", {relay_num: True})
+        if self.test_relay_control(relay_num, False):
+            passed &= self.wait_for_relays(f"Relay {relay_num} State", {relay_num: False})
+        else:
+            passed = False
+        return passed
         
     def test_response_times(self):
         """Test API response times"""
         self.log("Testing response times...")
         
         start_time = time.time()
-        response = requests.get(f"{self.base_url}/api/status", timeout=self.timeout)
+        response = self.client.get_status()
         end_time = time.time()
         
         response_time = (end_time - start_time) * 1000  # Convert to milliseconds
@@ -161,7 +231,7 @@ class ESP32Tester:
         
         def make_request():
             try:
-                response = requests.get(f"{self.base_url}/api/status", timeout=self.timeout)
+                response = self.client.get_status()
                 return response.status_code == 200
             except:
                 return False
@@ -191,7 +261,7 @@ class ESP32Tester:
         
         # Test invalid relay number
         try:
-            response = requests.get(f"{self.base_url}/api/relay?relay=99&state=true", timeout=self.timeout)
+            response = self.client.get("/api/relay", params={"relay": 99, "state": "true"})
             if response.status_code == 400:
                 self.add_test_result("Error Handling Test", True, "Invalid relay number handled correctly")
             else:
@@ -204,7 +274,7 @@ class ESP32Tester:
         self.log("Testing web dashboard...")
         
         try:
-            response = requests.get(f"{self.base_url}/", timeout=self.timeout)
+            response = self.client.get("/")
             if response.status_code == 200:
                 content = response.text
                 if "Home Automation" in content and "relay" in content.lower():
@@ -223,7 +293,7 @@ class ESP32Tester:
         assets = ['/style.css', '/script.js']
         for asset in assets:
             try:
-                response = requests.get(f"{self.base_url}{asset}", timeout=self.timeout)
+                response = self.client.get(asset)
                 if response.status_code == 200:
                     self.add_test_result(f"Asset Test - {asset}", True, f"{asset} loaded successfully")
                 else:
@@ -231,33 +301,185 @@ class ESP32Tester:
             except requests.exceptions.RequestException as e:
                 self.add_test_result(f"Asset Test - {asset}", False, f"Request failed: {str(e)}")
                 
+    def test_fleet_status(self, fleet):
+        """Test a concurrent status sweep across a fleet of boards"""
+        self.log("Testing fleet status sweep...")
+        
+        client = FleetClient(fleet, read_timeout=self.timeout)
+        start = time.perf_counter()
+        results = client.run(client.get_status)
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        for name, result in results.items():
+            if result['ok']:
+                self.add_test_result(f"Fleet Status - {name}", True, f"{result['latency_ms']:.1f}ms")
+            else:
+                self.add_test_result(f"Fleet Status - {name}", False, result['error'] or f"HTTP {result['status']}")
+                
+        summary = summarize(results)
+        slowest = max((result['latency_ms'] for result in results.values()), default=0)
+        self.log(f"Swept {summary['boards']} boards in {elapsed:.1f}ms (slowest board {slowest:.1f}ms)")
+        
+        # Voice control sweeps with the same client on every query, each in a new event loop
+        try:
+            repeat = summarize(client.run(client.get_status))
+            self.add_test_result("Fleet Status Repeat Sweep", repeat['reachable'] == summary['reachable'],
+                                 f"{repeat['reachable']}/{repeat['boards']} boards reachable")
+        except RuntimeError as e:
+            self.add_test_result("Fleet Status Repeat Sweep", False, f"Error: {e}")
+            return False
+        return summary['reachable'] == summary['boards'] and repeat['reachable'] == repeat['boards']
+        
+    def run_load_test(self, mix=None, rate=None, concurrency=4, duration=10, sensor_url=None, max_error_rate=0.01):
+        """Drive a mixed endpoint load and record latency percentiles"""
+        target = f"{rate:g} req/s" if rate else f"{concurrency} concurrent clients"
+        self.log(f"Running load test: {target} for {duration}s...")
+        
+        generator = LoadGenerator(self.base_url, sensor_url=sensor_url, mix=mix or DEFAULT_MIX, rate=rate,
+                                  concurrency=concurrency, duration=duration, timeout=self.timeout)
+        self.load_results = generator.run()
+        
+        for line in format_report(self.load_results).splitlines():
+            self.log(line)
+            
+        for name, stats in self.load_results['endpoints'].items():
+            message = (f"p50 {stats['p50_ms']:.1f}ms, p99 {stats['p99_ms']:.1f}ms, "
+                       f"{stats['throughput_rps']:.1f} req/s, {stats['error_rate'] * 100:.2f}% errors")
+            self.add_test_result(f"Load Test - {name}", stats['error_rate'] <= max_error_rate, message)
+            
+        return self.load_results['overall']['error_rate'] <= max_error_rate
+        
+    def run_load_comparison(self, baseline_url, mix=None, rate=None, concurrency=4, duration=10, sensor_url=None,
+                            baseline_sensor_url=None, max_error_rate=0.01):
+        """Run the same load against a baseline board (e.g. older firmware) and this one"""
+        self.log(f"Load comparison baseline: {baseline_url}")
+        baseline = ESP32Tester(baseline_url, self.timeout, name="baseline")
+        baseline.run_load_test(mix, rate, concurrency, duration, baseline_sensor_url, max_error_rate)
+        passed = self.run_load_test(mix, rate, concurrency, duration, sensor_url, max_error_rate)
+        
+        rows = compare_reports(baseline.load_results, self.load_results)
+        for line in format_comparison(rows).splitlines():
+            self.log(line)
+        self.load_comparison = {'baseline_url': baseline_url, 'baseline': baseline.load_results, 'rows': rows}
+        return passed
+        
+    def run_soak_test(self, hours, mix=None, rate=DEFAULT_SOAK_RATE, concurrency=4, window=DEFAULT_SOAK_WINDOW,
+                      sensor_url=None, max_error_rate=0.01, p99_drift=DEFAULT_P99_DRIFT):
+        """Drive realistic traffic for hours and watch for drift and client leaks"""
+        self.log(f"Running soak test: {rate:g} req/s for {hours:g}h in {window:g}s windows (Ctrl+C ends early)...")
+        
+        def on_window(window_report, findings):
+            self.log(format_window(window_report))
+            for finding in findings:
+                self.log(f"Drift: {finding['message']}", "WARNING")
+                
+        soak = SoakTest(self.base_url, sensor_url=sensor_url, mix=mix or DEFAULT_MIX, rate=rate,
+                        concurrency=concurrency, duration=hours * 3600, window=window, timeout=self.timeout,
+                        on_window=on_window, p99_drift=p99_drift, max_error_rate=max_error_rate)
+        self.soak_results = soak.run()
+        
+        for line in format_report(self.soak_results).splitlines():
+            self.log(line)
+        trends = self.soak_results['trends']
+        if trends['p99_ms_per_hour'] is not None:
+            self.log(f"Trends per hour: p99 {trends['p99_ms_per_hour']:+.2f}ms"
+                     + (f", client RSS {trends['rss_bytes_per_hour'] / 2 ** 20:+.2f}MB"
+                        if trends['rss_bytes_per_hour'] is not None else "")
+                     + (f", open FDs {trends['open_fds_per_hour']:+.1f}"
+                        if trends['open_fds_per_hour'] is not None else ""))
+            
+        findings = self.soak_results['findings']
+        for kind, test_name in (('p99_drift', "Soak - p99 Drift"), ('error_burst', "Soak - Error Bursts"),
+                                ('rss_growth', "Soak - Client Memory"), ('fd_growth', "Soak - Client File Descriptors")):
+            matching = [finding['message'] for finding in findings if finding['kind'] == kind]
+            message = f"{len(matching)} finding(s), first: {matching[0]}" if matching else \
+                f"none over {len(self.soak_results['windows'])} windows"
+            self.add_test_result(test_name, not matching, message)
+            
+        return not findings
+        
+    def run_suite(self):
+        """Run every test, overlapping those that touch independent resources"""
+        scheduler = SuiteScheduler(max_workers=self.workers)
+        
+        # Basic connectivity gates everything else
+        scheduler.add("connection", self.test_connection)
+        after = ["connection"]
+        
+        # API tests only read status
+        scheduler.add("api_status", self.test_api_status, reads=[STATUS], after=after)
+        scheduler.add("response_times", self.test_response_times, reads=[STATUS], after=after)
+        scheduler.add("concurrent_requests", self.test_concurrent_requests, reads=[STATUS], after=after)
+        scheduler.add("error_handling", self.test_error_handling, after=after)
+        
+        # Web interface tests
+        scheduler.add("web_dashboard", self.test_web_dashboard, reads=[ASSETS], after=after)
+        scheduler.add("assets", self.test_css_js_assets, reads=[ASSETS], after=after)
+        
+        # Relay control tests: each relay is independent, bulk control owns them all
+        for relay_num in range(1, 5):
+            scheduler.add(f"relay_{relay_num}", lambda relay_num=relay_num: self.test_relay_cycle(relay_num),
+                          writes=[relay(relay_num)], after=after)
+        scheduler.add("bulk_operations", self.test_bulk_operations, writes=[ALL_RELAYS], after=after)
+        scheduler.add("batched_order", self.test_batched_relay_order, writes=[relay(1)], after=after)
+        
+        start = time.perf_counter()
+        results = scheduler.run()
+        
+        for task in scheduler.tasks.values():
+            if task.error is not None:
+                self.add_test_result(task.name, False, f"Error: {task.error}")
+                
+        if results["connection"] is False:
+            self.log("Cannot connect to ESP32. Please check IP address and network connection.")
+            return False
+            
+        self.log(f"Suite finished in {time.perf_counter() - start:.2f}s")
+        return all(result is not False for result in results.values())
+        
     def run_all_tests(self):
-        """Run all tests in sequence"""
+        """Run all tests and generate the report"""
         self.log("Starting ESP32 Home Automation Test Suite")
         self.log("=" * 50)
         
-        # Basic connectivity tests
-        if not self.test_connection():
-            self.log("Cannot connect to ESP32. Please check IP address and network connection.")
+        if not self.run_suite() and not self.test_results:
             return False
             
-        # API tests
-        self.test_api_status()
-        self.test_response_times()
-        self.test_concurrent_requests()
-        self.test_error_handling()
+        # Generate report
+        return self.generate_report()
         
-        # Web interface tests
-        self.test_web_dashboard()
-        self.test_css_js_assets()
+    def run_fleet_tests(self, fleet):
+        """Run the full suite against every board in a fleet concurrently"""
+        self.log("Starting ESP32 Home Automation Fleet Test Suite")
+        self.log("=" * 50)
         
-        # Relay control tests
-        self.test_relay_sequence()
-        self.test_bulk_operations()
+        devices = load_fleet(fleet)
+        self.board_testers = [ESP32Tester(url, self.timeout, name=name, workers=self.workers,
+                                          state_timeout=self.state_timeout)
+                              for name, url in devices.items()]
         
-        # Generate report
-        self.generate_report()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(self.board_testers))) as executor:
+            list(executor.map(lambda tester: tester.run_suite(), self.board_testers))
+        self.log(f"Tested {len(self.board_testers)} boards in {time.perf_counter() - start:.2f}s")
         
+        for tester in self.board_testers:
+            self.test_results.extend(tester.test_results)
+            
+        return self.generate_report()
+        
+    def connection_stats(self):
+        """Connection reuse across this tester and any per-board testers"""
+        clients = [self.client] + [tester.client for tester in self.board_testers]
+        totals = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+        for client in {id(client): client for client in clients}.values():
+            stats = client.connection_stats()
+            for key in totals:
+                totals[key] += stats[key]
+        totals['reuse_ratio'] = totals['connections_reused'] / totals['requests'] if totals['requests'] else 0.0
+        return totals
+        
+
     def generate_report(self):
         """Generate test report"""
         self.log("=" * 50)
@@ -273,6 +495,9 @@ class ESP32Tester:
         self.log(f"Failed: {failed_tests}")
         self.log(f"Success Rate: {(passed_tests/total_tests)*100:.1f}%")
         
+        stats = self.connection_stats()
+        self.log(f"Connections: {stats['connections_opened']} opened, {stats['connections_reused']} reused")
+        
         if failed_tests > 0:
             self.log("\nFAILED TESTS:")
             for result in self.test_results:
@@ -286,8 +511,15 @@ class ESP32Tester:
             'passed_tests': passed_tests,
             'failed_tests': failed_tests,
             'success_rate': (passed_tests/total_tests)*100,
+            'connection_stats': self.connection_stats(),
             'results': self.test_results
         }
+        if self.load_results is not None:
+            report_data['load'] = self.load_results
+        if self.soak_results is not None:
+            report_data['soak'] = self.soak_results
+        if self.load_comparison is not None:
+            report_data['load_comparison'] = self.load_comparison
         
         with open('test_report.json', 'w') as f:
             json.dump(report_data, f, indent=2)
@@ -300,13 +532,50 @@ def main():
     parser = argparse.ArgumentParser(description='ESP32 Home Automation Test Suite')
     parser.add_argument('--url', default='http://192.168.1.100', help='ESP32 IP address (default: http://192.168.1.100)')
     parser.add_argument('--timeout', type=int, default=5, help='Request timeout in seconds (default: 5)')
-    parser.add_argument('--test', choices=['connection', 'api', 'relays', 'web', 'all'], default='all', help='Specific test to run')
+    parser.add_argument('--test', choices=['connection', 'api', 'relays', 'web', 'fleet', 'all'], default='all', help='Specific test to run')
+    parser.add_argument('--fleet', help='JSON file mapping board names to URLs (--test fleet sweeps status, --test all runs the suite on every board)')
+    parser.add_argument('--workers', type=int, default=4, help='Tests run concurrently per board (default: 4)')
+    parser.add_argument('--state-timeout', type=float, default=2.0, help='Seconds to wait for relay state confirmation (default: 2)')
+    parser.add_argument('--load', action='store_true', help='Run a load test instead of the functional tests')
+    parser.add_argument('--duration', type=float, default=10, help='Load test duration in seconds (default: 10)')
+    parser.add_argument('--rate', type=float, help='Target request rate in req/s (default: as fast as --concurrency allows)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent load clients (default: 4)')
+    parser.add_argument('--mix', default='status=6,relay=3,sensors=1', help='Endpoint weights (default: status=6,relay=3,sensors=1)')
+    parser.add_argument('--sensor-url', help='Sensor board URL for /api/sensors load (default: --url)')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Highest passing load error rate (default: 0.01)')
+    parser.add_argument('--compare-url', help='With --load, run the same load against this board first and compare')
+    parser.add_argument('--compare-sensor-url', help='Sensor board URL for the --compare-url run (default: --compare-url)')
+    parser.add_argument('--soak', type=float, metavar='HOURS', help='Run an endurance test for this many hours')
+    parser.add_argument('--window', type=float, default=DEFAULT_SOAK_WINDOW,
+                        help=f'Soak reporting window in seconds (default: {DEFAULT_SOAK_WINDOW:g})')
+    parser.add_argument('--p99-drift', type=float, default=DEFAULT_P99_DRIFT * 100,
+                        help=f'Soak p99 rise over the early windows that counts as drift, in percent (default: {DEFAULT_P99_DRIFT * 100:g})')
     
     args = parser.parse_args()
     
-    tester = ESP32Tester(args.url, args.timeout)
+    tester = ESP32Tester(args.url, args.timeout, workers=args.workers, state_timeout=args.state_timeout)
     
-    if args.test == 'connection':
+    if args.soak:
+        try:
+            mix = parse_mix(args.mix)
+        except ValueError as e:
+            parser.error(str(e))
+        success = tester.run_soak_test(args.soak, mix, args.rate or DEFAULT_SOAK_RATE, args.concurrency, args.window,
+                                       args.sensor_url, args.max_error_rate, args.p99_drift / 100)
+        tester.generate_report()
+    elif args.load:
+        try:
+            mix = parse_mix(args.mix)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.compare_url:
+            success = tester.run_load_comparison(args.compare_url, mix, args.rate, args.concurrency, args.duration,
+                                                 args.sensor_url, args.compare_sensor_url, args.max_error_rate)
+        else:
+            success = tester.run_load_test(mix, args.rate, args.concurrency, args.duration, args.sensor_url,
+                                           args.max_error_rate)
+        tester.generate_report()
+    elif args.test == 'connection':
         success = tester.test_connection()
     elif args.test == 'api':
         tester.test_connection()
@@ -323,6 +592,12 @@ def main():
         tester.test_web_dashboard()
         tester.test_css_js_assets()
         success = True
+    elif args.test == 'fleet':
+        if not args.fleet:
+            parser.error("--test fleet requires --fleet")
+        success = tester.test_fleet_status(args.fleet)
+    elif args.fleet:
+        success = tester.run_fleet_tests(args.fleet)
     else:  # all
         success = tester.run_all_tests()
         
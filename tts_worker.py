@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Text-to-Speech Worker
+Background speech output with priority scheduling and an on-disk utterance cache
+"""
+
+import os
+import sys
+import time
+import queue
+import shutil
+import hashlib
+import itertools
+import threading
+import subprocess
+from collections import OrderedDict
+
+from metrics import METRICS
+
+# Lower values are spoken first
+PRIORITY_ALERT = 0
+PRIORITY_CONFIRMATION = 1
+PRIORITY_INFO = 2
+
+# Confirmations older than this are no longer worth saying
+DEFAULT_MAX_AGE = 10.0
+
+
+class UtteranceCache:
+    """LRU cache of rendered utterances keyed by text and voice settings"""
+
+    def __init__(self, cache_dir, max_entries=128, extension=".wav"):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.extension = extension
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Rebuild LRU order from file access times
+        files = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(extension):
+                path = os.path.join(cache_dir, name)
+                files.append((os.path.getmtime(path), name[:-len(extension)], path))
+        for _, key, path in sorted(files):
+            self.entries[key] = path
+        self._evict()
+
+    def key(self, text, settings):
+        """Cache key for an utterance rendered with the given voice settings"""
+        material = "|".join([text] + [f"{name}={settings[name]}" for name in sorted(settings)])
+        return hashlib.sha1(material.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def get(self, key):
+        """Return the cached file for key, marking it most recently used"""
+        path = self.entries.get(key)
+        if path is None or not os.path.exists(path):
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        os.utime(path, None)
+        self.hits += 1
+        return path
+
+    def add(self, key, path):
+        """Register a freshly rendered file"""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        self.entries[key] = path
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            _, path = self.entries.popitem(last=False)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class AudioPlayer:
+    """Plays cached audio files with whatever player the platform provides"""
+
+    def __init__(self):
+        self.process = None
+        self.command = None
+
+        if sys.platform == "darwin" and shutil.which("afplay"):
+            self.command = ["afplay"]
+        elif shutil.which("paplay"):
+            self.command = ["paplay"]
+        elif shutil.which("aplay"):
+            self.command = ["aplay", "-q"]
+
+        self.winsound = None
+        if os.name == "nt":
+            try:
+                import winsound
+                self.winsound = winsound
+            except ImportError:
+                pass
+
+    @property
+    def available(self):
+        return self.command is not None or self.winsound is not None
+
+    def play(self, path):
+        """Play a file to completion unless stop() is called"""
+        if self.winsound is not None:
+            self.winsound.PlaySound(path, self.winsound.SND_FILENAME)
+            return
+        self.process = subprocess.Popen(self.command + [path], stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        self.process.wait()
+        self.process = None
+
+    def stop(self):
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        if self.winsound is not None:
+            self.winsound.PlaySound(None, self.winsound.SND_PURGE)
+
+
+class TTSWorker:
+    """Speaks queued utterances on a dedicated thread.
+
+    engine_factory is called on the worker thread to create and configure the
+    pyttsx3 engine, since most pyttsx3 drivers must be driven from the thread
+    that created them.
+    """
+
+    def __init__(self, engine_factory, cache_dir=None, cache_size=128, max_age=DEFAULT_MAX_AGE):
+        self.engine_factory = engine_factory
+        self.engine = None
+        self.max_age = max_age
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.pending_keys = {}
+        self.idle = threading.Event()
+        self.idle.set()
+        self.is_running = False
+        self.thread = None
+        self.current = None
+
+        self.player = AudioPlayer()
+        self.cache = None
+        if cache_dir and self.player.available:
+            self.cache = UtteranceCache(cache_dir, cache_size)
+        self.render_queue = []
+
+        self.spoken = 0
+        self.dropped = 0
+
+    def start(self):
+        """Start the worker thread"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self.thread.start()
+
+    def say(self, text, priority=PRIORITY_CONFIRMATION, key=None, preempt=False, max_age=None):
+        """Queue text for speech without blocking the caller.
+
+        A newer utterance with the same key replaces one that is still queued,
+        and preempt=True also cuts off whatever is currently being spoken.
+        """
+        if not self.is_running:
+            self.start()
+
+        seq = next(self.counter)
+        expires = time.monotonic() + (self.max_age if max_age is None else max_age)
+
+        # Enqueue under the lock so the worker cannot see an empty queue and
+        # set idle between idle.clear() and the put
+        with self.lock:
+            self.idle.clear()
+            if key is not None:
+                self.pending_keys[key] = seq
+            if preempt:
+                self._drop_pending(priority)
+            self.queue.put((priority, seq, text, key, expires))
+
+        if preempt:
+            self.interrupt()
+
+    def interrupt(self):
+        """Stop the utterance currently being spoken"""
+        self.player.stop()
+        if self.engine is not None and self.current is not None:
+            try:
+                self.engine.stop()
+            except Exception:
+                pass
+
+    def wait(self, timeout=None):
+        """Block until every queued utterance has been spoken"""
+        return self.idle.wait(timeout)
+
+    def stop(self, drain=True, timeout=10):
+        """Stop the worker, optionally speaking what is still queued"""
+        if drain:
+            self.wait(timeout)
+        self.is_running = False
+        self.queue.put((-1, -1, None, None, 0))
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            'spoken': self.spoken,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+            'cache_hits': self.cache.hits if self.cache else 0,
+            'cache_misses': self.cache.misses if self.cache else 0,
+        }
+
+    def _drop_pending(self, priority):
+        # Called with self.lock held: mark every queued item at or below the
+        # new utterance's urgency as stale
+        kept = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[2] is not None and item[0] >= priority:
+                self.dropped += 1
+            else:
+                kept.append(item)
+        for item in kept:
+            self.queue.put(item)
+
+    def _run(self):
+        try:
+            self.engine = self.engine_factory()
+        except Exception as e:
+            print(f"Text-to-speech unavailable: {e}")
+            self.engine = None
+
+        while self.is_running:
+            try:
+                priority, seq, text, key, expires = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                self._render_idle()
+                continue
+            if text is None:
+                break
+
+            with self.lock:
+                superseded = key is not None and self.pending_keys.get(key, seq) != seq
+                if key is not None and not superseded:
+                    self.pending_keys.pop(key, None)
+
+            if superseded or time.monotonic() > expires:
+                self.dropped += 1
+            else:
+                self.current = text
+                try:
+                    self._speak(text)
+                    self.spoken += 1
+                except Exception as e:
+                    print(f"Error speaking: {e}")
+                self.current = None
+
+            with self.lock:
+                if self.queue.empty():
+                    self.idle.set()
+
+    def _voice_settings(self):
+        settings = {}
+        for name in ('voice', 'rate', 'volume'):
+            try:
+                settings[name] = self.engine.getProperty(name)
+            except Exception:
+                settings[name] = None
+        return settings
+
+    def _speak(self, text):
+        if self.engine is None:
+            return
+
+        if self.cache is not None:
+            key = self.cache.key(text, self._voice_settings())
+            path = self.cache.get(key)
+            if path is not None:
+                with METRICS.span("tts", source="cache"):
+                    self.player.play(path)
+                return
+            if key not in (k for k, _ in self.render_queue):
+                self.render_queue.append((key, text))
+
+        with METRICS.span("tts", source="engine"):
+            self.engine.say(text)
+            self.engine.runAndWait()
+
+    def _render_idle(self):
+        """Render uncached utterances to disk while nothing else is queued"""
+        if self.engine is None or self.cache is None:
+            return
+        while self.render_queue and self.queue.empty() and self.is_running:
+            key, text = self.render_queue.pop(0)
+            path = self.cache.path_for(key)
+            try:
+                self.engine.save_to_file(text, path)
+                self.engine.runAndWait()
+                self.cache.add(key, path)
+            except Exception as e:
+                print(f"Error caching utterance: {e}")
@@ -4,60 +4,183 @@ ESP32 Home Automation - Voice Control Integration
 Voice control system using speech recognition and text-to-speech
 """
 
-import speech_recognition as sr
-import pyttsx3
+import os
+import sys
 import requests
 import time
 import threading
 import queue
 import json
+import subprocess
 from datetime import datetime
 import argparse
 
+from command_matcher import CommandMatcher
+from command_batcher import CommandBatcher
+from scene_scheduler import SceneScheduler
+from speech_backends import create_backend, StreamingSession, BACKENDS
+from device_client import get_client
+from fleet_client import FleetClient, summarize
+from state_sync import StateSync, DeviceStateCache
+from tts_worker import TTSWorker, PRIORITY_ALERT, PRIORITY_CONFIRMATION
+from voice_pipeline import VoicePipeline, DROP_OLDEST, format_stats
+from metrics import METRICS, StatsDSink, parse_address, format_metrics
+
+# speech_recognition, pyttsx3, pyaudio and numpy (voice_gate) are imported on
+# first use, so --test and --help-commands start without loading them
+
+DEFAULT_CALIBRATION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "esp32-home", "mic_calibration.json")
+CALIBRATION_MAX_AGE = 24 * 3600
+
+# Voice commands mapping
+DEFAULT_COMMANDS = {
+    # Relay control commands
+    "turn on light": {"relay": 1, "state": True},
+    "turn off light": {"relay": 1, "state": False},
+    "turn on fan": {"relay": 2, "state": True},
+    "turn off fan": {"relay": 2, "state": False},
+    "turn on tv": {"relay": 3, "state": True},
+    "turn off tv": {"relay": 3, "state": False},
+    "turn on garage": {"relay": 4, "state": True},
+    "turn off garage": {"relay": 4, "state": False},
+
+    # Bulk control commands
+    "turn on all": {"action": "all", "state": True},
+    "turn off all": {"action": "all", "state": False},
+    "turn on everything": {"action": "all", "state": True},
+    "turn off everything": {"action": "all", "state": False},
+
+    # Status commands
+    "what's the status": {"action": "status"},
+    "show me the status": {"action": "status"},
+    "check status": {"action": "status"},
+    "check all boards": {"action": "fleet_status"},
+    "what's the fleet status": {"action": "fleet_status"},
+
+    # Help commands
+    "help": {"action": "help"},
+    "what can you do": {"action": "help"},
+    "list commands": {"action": "help"},
+}
+
+
 class VoiceController:
-    def __init__(self, esp32_url="http://192.168.1.100"):
+    def __init__(self, esp32_url="http://192.168.1.100", tts_cache_dir=None, fleet=None,
+                 status_ttl=5.0, max_staleness=15.0, verify=False, scenes=None, recognizer="google",
+                 vosk_model=None, vad=None, wake_word=None, wake_template=None,
+                 calibration_cache=DEFAULT_CALIBRATION_CACHE, recalibrate=False):
         self.esp32_url = esp32_url.rstrip('/')
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone()
-        self.tts_engine = pyttsx3.init()
-        self.command_queue = queue.Queue()
+        self.client = get_client(self.esp32_url)
+        self.fleet = FleetClient(fleet) if fleet else None
+        self.state_sync = StateSync()
+        self.state_cache = DeviceStateCache(self.client, self.esp32_url, self.state_sync, ttl=status_ttl,
+                                            max_staleness=max_staleness, verify=verify,
+                                            on_mismatch=self.report_mismatch)
+        # Audio devices, recognizer, gate, batcher and scheduler are created on first use
+        self.recognizer_name = recognizer
+        self.vosk_model = vosk_model
+        self.gate_options = (vad, wake_word, wake_template)
+        self._recognizer = None
+        self._backend = None
+        self._gate = None
+        self._microphone = None
+        self._batcher = None
+        self._scheduler = None
+        self.calibration_cache = calibration_cache
+        self.recalibrate = recalibrate
+        self.calibrated = threading.Event()
+        self.calibration_thread = None
+        self.stream_session = None
+        self.tts_engine = None
+        self.tts = TTSWorker(self.create_tts_engine, cache_dir=tts_cache_dir)
+        self.command_queue = queue.Queue(maxsize=4)
+        self.pipeline = None
+        self.audio_queue_size = 2
+        self.audio_overflow = DROP_OLDEST
         self.is_listening = False
         self.is_running = False
         
-        # Voice commands mapping
-        self.commands = {
-            # Relay control commands
-            "turn on light": {"relay": 1, "state": True},
-            "turn off light": {"relay": 1, "state": False},
-            "turn on fan": {"relay": 2, "state": True},
-            "turn off fan": {"relay": 2, "state": False},
-            "turn on tv": {"relay": 3, "state": True},
-            "turn off tv": {"relay": 3, "state": False},
-            "turn on garage": {"relay": 4, "state": True},
-            "turn off garage": {"relay": 4, "state": False},
-            
-            # Bulk control commands
-            "turn on all": {"action": "all", "state": True},
-            "turn off all": {"action": "all", "state": False},
-            "turn on everything": {"action": "all", "state": True},
-            "turn off everything": {"action": "all", "state": False},
-            
-            # Status commands
-            "what's the status": {"action": "status"},
-            "show me the status": {"action": "status"},
-            "check status": {"action": "status"},
-            
-            # Help commands
-            "help": {"action": "help"},
-            "what can you do": {"action": "help"},
-            "list commands": {"action": "help"},
-        }
+        # Voice commands mapping, compiled into a single matcher
+        self.commands = dict(DEFAULT_COMMANDS)
+        self.matcher = CommandMatcher(self.commands)
         
-        # Initialize TTS
-        self.setup_tts()
+        if scenes:
+            self.scheduler.load(scenes)
+            for name in self.scheduler.scenes:
+                for phrase in (name, f"activate {name}", f"start {name}"):
+                    self.commands[phrase] = {"action": "scene", "scene": name}
+            self.matcher.build(self.commands)
+        
+        # The TTS worker thread starts with the first utterance
+        
+    @property
+    def batcher(self):
+        if self._batcher is None:
+            self._batcher = CommandBatcher()
+        return self._batcher
         
-        # Calibrate microphone
-        self.calibrate_microphone()
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            # Scenes and schedules share the batcher; "esp32" names this board
+            boards = dict(self.fleet.devices) if self.fleet else {}
+            boards.setdefault("esp32", self.esp32_url)
+            self._scheduler = SceneScheduler(boards, batcher=self.batcher)
+        return self._scheduler
+        
+    @property
+    def recognizer(self):
+        if self._recognizer is None:
+            import speech_recognition as sr
+            self._recognizer = sr.Recognizer()
+        return self._recognizer
+        
+    @property
+    def backend(self):
+        if self._backend is None:
+            recognizer = self.recognizer if self.recognizer_name == "google" else None
+            self._backend = create_backend(self.recognizer_name, recognizer, self.vosk_model)
+            self._backend.set_phrases(self.commands)
+        return self._backend
+        
+    @property
+    def gate(self):
+        if self._gate is None and any(self.gate_options):
+            self._gate = self.create_gate(*self.gate_options)
+        return self._gate
+        
+    @property
+    def microphone(self):
+        if self._microphone is None:
+            import speech_recognition as sr
+            if any(self.gate_options):
+                from voice_gate import GATE_SAMPLE_RATE, GATE_FRAME_SAMPLES
+                # The gate works on 20ms frames at 16kHz
+                self._microphone = sr.Microphone(sample_rate=GATE_SAMPLE_RATE, chunk_size=GATE_FRAME_SAMPLES)
+            else:
+                self._microphone = sr.Microphone(sample_rate=self.backend.sample_rate)
+        return self._microphone
+        
+    def create_gate(self, vad=None, wake_word=None, wake_template=None):
+        """Build the VAD / wake-word stage, or None to send every phrase to the recognizer"""
+        if not (vad or wake_word or wake_template):
+            return None
+        from voice_gate import VoiceGate, TemplateWakeWord, VoskWakeWord, create_vad
+        wake = None
+        if wake_template:
+            wake = TemplateWakeWord.load(wake_template)
+        elif wake_word:
+            if self.backend.name != "vosk":
+                raise ValueError("--wake-word needs --recognizer vosk; use --wake-template otherwise")
+            wake = VoskWakeWord(self.backend, wake_word)
+        return VoiceGate(create_vad(vad or "energy"), wake, on_wake=lambda: print("Wake word detected"))
+        
+    def create_tts_engine(self):
+        """Create the text-to-speech engine (called on the TTS worker thread)"""
+        import pyttsx3
+        self.tts_engine = pyttsx3.init()
+        self.setup_tts()
+        return self.tts_engine
         
     def setup_tts(self):
         """Setup text-to-speech engine"""
@@ -73,84 +196,198 @@ class VoiceController:
         self.tts_engine.setProperty('rate', 150)
         self.tts_engine.setProperty('volume', 0.8)
         
+    def start_calibration(self):
+        """Calibrate for ambient noise on a background thread; capture waits for it"""
+        if self.calibration_thread is not None:
+            return
+        if self.gate is not None or self.backend.streaming:
+            # The VAD and streaming recognizers do not use the energy threshold
+            self.calibrated.set()
+            return
+        self.calibration_thread = threading.Thread(target=self.calibrate_microphone, name="mic-calibration",
+                                                   daemon=True)
+        self.calibration_thread.start()
+        
     def calibrate_microphone(self):
-        """Calibrate microphone for ambient noise"""
-        print("Calibrating microphone for ambient noise...")
-        with self.microphone as source:
-            self.recognizer.adjust_for_ambient_noise(source, duration=2)
-        print("Microphone calibrated!")
+        """Calibrate microphone for ambient noise, reusing a recent result for the same device"""
+        try:
+            with self.microphone as source:
+                key = self.microphone_key(source)
+                cache = self.load_calibration()
+                entry = cache.get(key)
+                if entry and not self.recalibrate and time.time() - entry['calibrated_at'] < CALIBRATION_MAX_AGE:
+                    self.recognizer.energy_threshold = entry['energy_threshold']
+                    print(f"Microphone calibration reused for {key}")
+                    return
+                print("Calibrating microphone for ambient noise...")
+                self.recognizer.adjust_for_ambient_noise(source, duration=2)
+            cache[key] = {'energy_threshold': self.recognizer.energy_threshold, 'calibrated_at': time.time()}
+            self.save_calibration(cache)
+            print("Microphone calibrated!")
+        except Exception as e:
+            print(f"Microphone calibration failed: {e}")
+        finally:
+            self.calibrated.set()
         
-    def speak(self, text):
-        """Convert text to speech"""
+    @staticmethod
+    def microphone_key(source):
+        """Identify the input device so calibrations are not mixed up between devices"""
+        if source.device_index is None:
+            info = source.audio.get_default_input_device_info()
+        else:
+            info = source.audio.get_device_info_by_index(source.device_index)
+        return f"{info['name']}@{source.SAMPLE_RATE}"
+        
+    def load_calibration(self):
+        try:
+            with open(self.calibration_cache, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    def save_calibration(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.calibration_cache), exist_ok=True)
+            with open(self.calibration_cache, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print(f"Could not save microphone calibration: {e}")
+        
+    def speak(self, text, priority=PRIORITY_CONFIRMATION, key=None, preempt=False):
+        """Queue text for speech without blocking the caller"""
         print(f"Speaking: {text}")
-        self.tts_engine.say(text)
-        self.tts_engine.runAndWait()
+        self.tts.say(text, priority=priority, key=key, preempt=preempt)
         
-    def listen(self):
-        """Listen for voice commands"""
+    def capture_audio(self):
+        """Record a single phrase from the microphone"""
+        import speech_recognition as sr
+        self.calibrated.wait()
         try:
-            with self.microphone as source:
+            with METRICS.span("capture", mode="phrase"), self.microphone as source:
                 print("Listening...")
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
-                
-            print("Processing speech...")
-            text = self.recognizer.recognize_google(audio).lower()
+                return self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
+        except sr.WaitTimeoutError:
+            return None
+            
+    def recognize(self, audio):
+        """Convert recorded audio to lowercase text"""
+        print("Processing speech...")
+        with METRICS.span("recognition", backend=self.backend.name):
+            text = self.backend.recognize(audio)
+        if text:
             print(f"Heard: {text}")
-            return text
+        return text
+        
+    def capture_stream(self, max_seconds=5):
+        """Feed microphone frames to a streaming recognizer until a command is heard"""
+        if self.stream_session is None:
+            self.stream_session = StreamingSession(self.backend.open_stream(), self.matcher)
+        deadline = time.monotonic() + max_seconds
+        # Recognition runs inside capture here, so both share one span
+        with METRICS.span("capture", mode="stream", backend=self.backend.name), self.microphone as source:
+            while time.monotonic() < deadline:
+                frame = source.stream.read(source.CHUNK)
+                frames = self.gate.process(frame)[0] if self.gate is not None else [frame]
+                for frame in frames:
+                    text = self.stream_session.feed(frame)
+                    if text:
+                        print(f"Heard: {text}")
+                        return text
+        return None
+        
+    def capture_gated(self, max_seconds=5, phrase_time_limit=10):
+        """Read microphone frames through the gate and return the next utterance it lets through"""
+        frames = []
+        deadline = time.monotonic() + max_seconds
+        with METRICS.span("capture", mode="gated"), self.microphone as source:
+            while time.monotonic() < (deadline + phrase_time_limit if frames else deadline):
+                forward, ended = self.gate.process(source.stream.read(source.CHUNK))
+                frames.extend(forward)
+                if ended:
+                    break
+            if not frames:
+                return None
+            import speech_recognition as sr
+            return sr.AudioData(b"".join(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+        
+    def enroll_wake_word(self, path, samples=3):
+        """Record the wake word a few times and save a template for --wake-template"""
+        from voice_gate import VoiceGate, WakeWordRecorder, TemplateWakeWord, create_vad
+        recorder = WakeWordRecorder()
+        gate = VoiceGate(self.gate.vad if self.gate is not None else create_vad("energy"), recorder)
+        print(f"Say the wake word {samples} times, pausing in between...")
+        with self.microphone as source:
+            while len(recorder.segments) < samples:
+                gate.process(source.stream.read(source.CHUNK))
+        TemplateWakeWord.enroll(recorder.segments).save(path)
+        print(f"✅ Wake word template saved to {path}")
             
-        except sr.WaitTimeoutError:
+    def listen(self):
+        """Listen for voice commands"""
+        audio = self.capture_audio()
+        if audio is None:
             print("No speech detected")
             return None
-        except sr.UnknownValueError:
-            print("Could not understand speech")
-            return None
-        except sr.RequestError as e:
-            print(f"Speech recognition error: {e}")
-            return None
+        return self.recognize(audio)
+            
+    def add_command(self, phrase, action):
+        """Register a voice command and recompile the matcher"""
+        self.commands[phrase.lower()] = action
+        self.matcher.build(self.commands)
+        self.update_grammar()
+        
+    def remove_command(self, phrase):
+        """Unregister a voice command and recompile the matcher"""
+        if self.commands.pop(phrase.lower(), None) is not None:
+            self.matcher.build(self.commands)
+            self.update_grammar()
+            
+    def update_grammar(self):
+        """Restrict the recognizer to the current command phrases"""
+        if self._backend is not None:
+            self._backend.set_phrases(self.commands)
+        # The next capture opens a stream with the new grammar
+        self.stream_session = None
             
     def process_command(self, text):
         """Process voice command and execute action"""
         if not text:
             return False
             
-        # Find matching command
-        for command, action in self.commands.items():
-            if command in text:
-                return self.execute_command(action)
+        with METRICS.span("matching"):
+            # "turn on light and fan" becomes one batched request
+            matches = self.matcher.match_all(text)
+            if matches and all("relay" in action for _, action in matches):
+                action = {"action": "batch", "commands": [action for _, action in matches]}
+            else:
+                # Find the most specific registered phrase in one pass
+                match = self.matcher.match(text)
+                action = match[1] if match else None
+                
+        if action is not None:
+            return self.execute_command(action)
                 
         # If no exact match, try fuzzy matching
         return self.fuzzy_match_command(text)
         
     def fuzzy_match_command(self, text):
         """Fuzzy matching for voice commands"""
-        # Extract key words
-        words = text.split()
-        
-        # Check for relay numbers
-        relay_num = None
-        for word in words:
-            if word.isdigit() and 1 <= int(word) <= 4:
-                relay_num = int(word)
-                break
-                
-        # Check for on/off states
-        state = None
-        if any(word in text for word in ['on', 'enable', 'activate', 'start']):
-            state = True
-        elif any(word in text for word in ['off', 'disable', 'deactivate', 'stop']):
-            state = False
+        # Extract relay number, on/off state and intent keywords
+        with METRICS.span("matching", mode="fuzzy"):
+            keywords = self.matcher.match_keywords(text)
+        relay_num = keywords["relay"]
+        state = keywords["state"]
             
         # Check for bulk commands
-        if any(word in text for word in ['all', 'everything', 'all devices']):
-            if state is not None:
-                return self.execute_command({"action": "all", "state": state})
+        if keywords["bulk"] and state is not None:
+            return self.execute_command({"action": "all", "state": state})
                 
         # Check for individual relay commands
         if relay_num and state is not None:
             return self.execute_command({"relay": relay_num, "state": state})
             
         # Check for status requests
-        if any(word in text for word in ['status', 'state', 'check', 'show']):
+        if keywords["status"]:
             return self.execute_command({"action": "status"})
             
         return False
@@ -169,10 +406,22 @@ class VoiceController:
                 state = action["state"]
                 return self.control_all_relays(state)
                 
+            elif action.get("action") == "batch":
+                # Several relays in one request
+                return self.control_relays({command["relay"]: command["state"] for command in action["commands"]})
+                
+            elif action.get("action") == "scene":
+                # Apply a named scene
+                return self.activate_scene(action["scene"])
+                
             elif action.get("action") == "status":
                 # Get status
                 return self.get_status()
                 
+            elif action.get("action") == "fleet_status":
+                # Sweep every board concurrently
+                return self.get_fleet_status()
+                
             elif action.get("action") == "help":
                 # Show help
                 return self.show_help()
@@ -187,14 +436,14 @@ class VoiceController:
     def control_relay(self, relay, state):
         """Control individual relay"""
         try:
-            url = f"{self.esp32_url}/api/relay?relay={relay}&state={state}"
-            response = requests.get(url, timeout=5)
+            response = self.client.set_relay(relay, state)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
+                    self.state_cache.write_through({f"relay{relay}": bool(state)})
                     action = "turned on" if state else "turned off"
-                    self.speak(f"Device {relay} has been {action}")
+                    self.speak(f"Device {relay} has been {action}", key=f"relay{relay}")
                     return True
                 else:
                     self.speak(f"Sorry, I couldn't control device {relay}")
@@ -210,14 +459,16 @@ class VoiceController:
     def control_all_relays(self, state):
         """Control all relays"""
         try:
-            url = f"{self.esp32_url}/api/all?state={state}"
-            response = requests.get(url, timeout=5)
+            response = self.client.set_all(state)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
+                    relays = [key for key in (self.state_sync.state(self.esp32_url) or {}) if key.startswith('relay')]
+                    relays = relays or [f"relay{i}" for i in range(1, 5)]
+                    self.state_cache.write_through({key: bool(state) for key in relays})
                     action = "turned on" if state else "turned off"
-                    self.speak(f"All devices have been {action}")
+                    self.speak(f"All devices have been {action}", key="relays", preempt=True)
                     return True
                 else:
                     self.speak("Sorry, I couldn't control all devices")
@@ -230,34 +481,96 @@ class VoiceController:
             self.speak("Sorry, I couldn't connect to the device")
             return False
             
-    def get_status(self):
-        """Get device status"""
+    def control_relays(self, states):
+        """Control several relays with a single batched request"""
         try:
-            response = requests.get(f"{self.esp32_url}/api/status", timeout=5)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Count active devices
-                active_count = sum(1 for key, value in data.items() if key.startswith('relay') and value)
-                total_count = len([key for key in data.keys() if key.startswith('relay')])
-                
-                if active_count == 0:
-                    self.speak("All devices are currently off")
-                elif active_count == total_count:
-                    self.speak("All devices are currently on")
-                else:
-                    self.speak(f"{active_count} out of {total_count} devices are currently on")
-                    
-                return True
-            else:
-                self.speak("Sorry, I couldn't get the device status")
-                return False
-                
+            result = self.batcher.apply(self.esp32_url, states)
         except requests.exceptions.RequestException:
             self.speak("Sorry, I couldn't connect to the device")
             return False
+        
+        self.state_cache.write_through(result)
+        devices = sorted(states)
+        if len(devices) == 1:
+            names = f"Device {devices[0]} has"
+        else:
+            names = "Devices " + ", ".join(str(relay) for relay in devices[:-1]) + f" and {devices[-1]} have"
+        if all(states.values()) or not any(states.values()):
+            action = "turned on" if states[devices[0]] else "turned off"
+            self.speak(f"{names} been {action}", key="relays")
+        else:
+            self.speak(f"{names} been updated", key="relays")
+        return True
+        
+    def activate_scene(self, name):
+        """Apply a scene with one batched request per board and wait for every board"""
+        scene = self.scheduler.scenes.get(name.lower())
+        if scene is None:
+            raise ValueError(f"Unknown scene '{name}'")
+        futures = {board: [self.batcher.submit(board, relay, state) for relay, state in states.items()]
+                   for board, states in scene.items()}
+        self.batcher.flush()
+        
+        failed = False
+        for board, waiting in futures.items():
+            try:
+                results = [future.result(10) for future in waiting]
+            except requests.exceptions.RequestException:
+                failed = True
+                continue
+            if board == self.esp32_url and results:
+                self.state_cache.write_through(results[-1])
+        if failed:
+            self.speak(f"Sorry, I couldn't activate {name}")
+            return False
+        self.speak(f"{name.capitalize()} activated", key="scene")
+        return True
+        
+    def get_status(self):
+        """Get device status from the state cache"""
+        # Answered from memory unless the cache is older than its staleness bound
+        data, age = self.state_cache.get()
+        if data is None:
+            self.speak("Sorry, I couldn't connect to the device")
+            return False
+        
+        # Count active devices
+        active_count = sum(1 for key, value in data.items() if key.startswith('relay') and value)
+        total_count = len([key for key in data.keys() if key.startswith('relay')])
+        
+        if active_count == 0:
+            message = "All devices are currently off"
+        elif active_count == total_count:
+            message = "All devices are currently on"
+        else:
+            message = f"{active_count} out of {total_count} devices are currently on"
+        
+        if age is not None and age > self.state_cache.max_staleness:
+            # The refresh failed, so say how old the answer is
+            message = f"As of {int(age)} seconds ago, {message[0].lower()}{message[1:]}"
+        self.speak(message, key="status")
+        return True
+        
+    def report_mismatch(self, expected, actual):
+        """Warn when the board did not end up in the state a command reported"""
+        devices = [key[len('relay'):] for key in expected if actual.get(key) != expected[key]]
+        self.speak(f"Warning, device {', '.join(devices)} did not switch", priority=PRIORITY_ALERT)
+            
+    def get_fleet_status(self):
+        """Get status from every board in the fleet concurrently"""
+        if self.fleet is None:
+            self.speak("No other boards are configured")
+            return False
             
+        summary = summarize(self.fleet.run(self.fleet.get_status))
+        if summary['reachable'] == 0:
+            self.speak("Sorry, I couldn't reach any boards", key="status")
+            return False
+            
+        self.speak(f"{summary['reachable']} of {summary['boards']} boards are online, "
+                   f"with {summary['relays_on']} devices on", key="status")
+        return True
+        
     def show_help(self):
         """Show available commands"""
         help_text = """
@@ -273,6 +586,10 @@ class VoiceController:
         - Turn on all, turn off all
         - Turn on everything, turn off everything
         
+        To control several devices at once:
+        - Turn on light and fan
+        - Turn off TV and turn on garage
+        
         To check status:
         - What's the status
         - Show me the status
@@ -286,49 +603,88 @@ class VoiceController:
         self.speak("I can help you control your home automation system. You can say things like turn on light, turn off fan, or turn on all devices")
         return True
         
+    def handle_command(self, text):
+        """Execute a recognized command and report the outcome"""
+        with METRICS.span("command"):
+            handled = self.process_command(text)
+        METRICS.count("commands", outcome="success" if handled else "failure")
+        if handled:
+            print("Command executed successfully")
+            return True
+            
+        print("Command not recognized")
+        self.speak("Sorry, I didn't understand that command")
+        return False
+        
     def start_listening(self):
         """Start continuous voice listening"""
         self.is_running = True
         self.is_listening = True
         
+        self.start_calibration()
         print("Voice control started! Say 'help' for available commands.")
         self.speak("Voice control activated. How can I help you?")
         
-        while self.is_running:
-            try:
-                # Listen for command
-                text = self.listen()
-                
-                if text:
-                    # Process command
-                    if self.process_command(text):
-                        print("Command executed successfully")
-                    else:
-                        print("Command not recognized")
-                        self.speak("Sorry, I didn't understand that command")
-                        
-                # Small delay before next listen
-                time.sleep(0.5)
-                
-            except KeyboardInterrupt:
-                print("\nStopping voice control...")
-                break
-            except Exception as e:
-                print(f"Error in voice control loop: {e}")
-                time.sleep(1)
+        # Capture, recognition and execution run concurrently so the microphone
+        # keeps listening while the previous command is still being handled.
+        # Streaming backends recognize while capturing and pass text straight on.
+        if self.backend.streaming:
+            capture, recognize = self.capture_stream, lambda text: text
+        elif self.gate is not None:
+            capture, recognize = self.capture_gated, self.recognize
+        else:
+            capture, recognize = self.capture_audio, self.recognize
+        self.pipeline = VoicePipeline(
+            capture,
+            recognize,
+            self.handle_command,
+            audio_queue_size=self.audio_queue_size,
+            audio_overflow=self.audio_overflow,
+            command_queue=self.command_queue,
+        )
+        self.pipeline.start()
+        self.state_cache.start()
+        self.scheduler.start()
+        
+        try:
+            while self.is_running and self.pipeline.is_running:
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print("\nStopping voice control...")
+        finally:
+            self.pipeline.stop(timeout=6)
+            print(format_stats(self.pipeline.stats()))
+            if self.gate is not None:
+                from voice_gate import format_gate_stats
+                print(format_gate_stats(self.gate.stats()))
+            print(format_metrics())
+            self.state_cache.stop()
+            self.scheduler.stop()
                 
         self.is_listening = False
-        self.speak("Voice control deactivated")
+        self.speak("Voice control deactivated", priority=PRIORITY_ALERT, preempt=True)
+        self.tts.stop(drain=True)
+        
+    def pipeline_stats(self):
+        """Per-stage queue depth and latency of the running pipeline"""
+        if self.pipeline is None:
+            return []
+        return self.pipeline.stats()
         
     def stop_listening(self):
         """Stop voice listening"""
         self.is_running = False
         self.is_listening = False
+        if self.pipeline is not None:
+            self.pipeline.is_running = False
+        self.state_cache.stop()
+        if self._scheduler is not None:
+            self._scheduler.stop()
         
     def test_connection(self):
         """Test connection to ESP32"""
         try:
-            response = requests.get(f"{self.esp32_url}/", timeout=5)
+            response = self.client.get("/")
             if response.status_code == 200:
                 print("✅ ESP32 connection successful")
                 return True
@@ -339,16 +695,80 @@ class VoiceController:
             print(f"❌ ESP32 connection failed: {e}")
             return False
 
+def import_profile(args):
+    """Total import time (ms) and the slowest top-level imports of one CLI run, from -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), *args],
+                            capture_output=True, text=True, timeout=60)
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name[1:].startswith(" "):
+            top_level.append((int(cumulative) / 1000, name.strip()))
+    top_level.sort(reverse=True)
+    return sum(ms for ms, _ in top_level), top_level[:3]
+
+
+def run_startup_benchmark(runs=5):
+    """Cold-start time of each CLI mode that does not need a microphone"""
+    from esp32_emulator import ESP32Emulator
+
+    with ESP32Emulator() as emulator:
+        modes = [("--help",), ("--help-commands",), ("--test", "--url", emulator.url)]
+        print(f"{'mode':<16} {'wall ms':>8} {'import ms':>10}  slowest imports")
+        for args in modes:
+            walls = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, os.path.abspath(__file__), *args], capture_output=True, timeout=60)
+                walls.append((time.perf_counter() - start) * 1000)
+            walls.sort()
+            imports_ms, slowest = import_profile(args)
+            print(f"{args[0]:<16} {walls[len(walls) // 2]:>8.0f} {imports_ms:>10.0f}  "
+                  + ", ".join(f"{name} {ms:.0f}ms" for ms, name in slowest))
+
+
 def main():
     parser = argparse.ArgumentParser(description='ESP32 Home Automation Voice Control')
     parser.add_argument('--url', default='http://192.168.1.100', help='ESP32 IP address')
     parser.add_argument('--test', action='store_true', help='Test connection only')
     parser.add_argument('--help-commands', action='store_true', help='Show available commands')
+    parser.add_argument('--tts-cache', help='Directory for cached spoken confirmations')
+    parser.add_argument('--fleet', help='JSON file mapping board names to URLs')
+    parser.add_argument('--status-ttl', type=float, default=5.0, help='Seconds between background status refreshes (default: 5)')
+    parser.add_argument('--max-staleness', type=float, default=15.0,
+                        help='Oldest cached status answered without asking the board (default: 15)')
+    parser.add_argument('--verify', action='store_true', help='Confirm every relay command against the board')
+    parser.add_argument('--scenes', help='JSON file with scenes and schedules')
+    parser.add_argument('--recognizer', choices=BACKENDS, default='google',
+                        help='Speech recognizer: google (online) or vosk (offline, streaming)')
+    parser.add_argument('--vosk-model', help='Vosk model directory for --recognizer vosk')
+    parser.add_argument('--vad', choices=['energy', 'webrtc'], help='Only send detected speech to the recognizer')
+    parser.add_argument('--wake-word', help='Wake phrase spotted by the vosk recognizer, e.g. "hey home"')
+    parser.add_argument('--wake-template', help='Wake word template recorded with --enroll-wake-word')
+    parser.add_argument('--enroll-wake-word', metavar='FILE', help='Record the wake word and save a template to FILE')
+    parser.add_argument('--calibration-cache', default=DEFAULT_CALIBRATION_CACHE,
+                        help='File with ambient-noise calibrations per input device')
+    parser.add_argument('--recalibrate', action='store_true', help='Ignore the cached microphone calibration')
+    parser.add_argument('--startup-benchmark', action='store_true', help='Measure cold-start time of each CLI mode')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this port at /metrics')
+    parser.add_argument('--statsd', metavar='HOST[:PORT]', help='Send timings and counters to a StatsD agent')
+    parser.add_argument('--trace', metavar='FILE', help='Write collapsed stacks of the session for flame graphs')
     
     args = parser.parse_args()
     
+    if args.startup_benchmark:
+        run_startup_benchmark()
+        return
+    
     # Create voice controller
-    controller = VoiceController(args.url)
+    controller = VoiceController(args.url, tts_cache_dir=args.tts_cache, fleet=args.fleet,
+                                 status_ttl=args.status_ttl, max_staleness=args.max_staleness,
+                                 verify=args.verify, scenes=args.scenes, recognizer=args.recognizer,
+                                 vosk_model=args.vosk_model, vad=args.vad or ('energy' if args.enroll_wake_word else None),
+                                 wake_word=args.wake_word, wake_template=args.wake_template,
+                                 calibration_cache=args.calibration_cache, recalibrate=args.recalibrate)
     
     if args.test:
         # Test connection
@@ -358,10 +778,29 @@ def main():
             print("Cannot connect to ESP32. Please check the IP address.")
         return
         
+    if args.enroll_wake_word:
+        controller.enroll_wake_word(args.enroll_wake_word)
+        controller.tts.stop(drain=True)
+        return
+        
     if args.help_commands:
         controller.show_help()
+        controller.tts.stop(drain=True)
         return
         
+    if args.metrics_port:
+        METRICS.serve(args.metrics_port)
+        print(f"Metrics at http://localhost:{args.metrics_port}/metrics")
+    statsd = None
+    if args.statsd:
+        statsd = StatsDSink(*parse_address(args.statsd, 8125))
+        METRICS.sinks.append(statsd)
+    if args.trace:
+        METRICS.start_trace()
+        
+    # Calibration runs while the board connection is checked
+    controller.start_calibration()
+    
     # Test connection first
     if not controller.test_connection():
         print("Cannot connect to ESP32. Please check the IP address and network connection.")
@@ -376,6 +815,11 @@ def main():
         print(f"Error: {e}")
     finally:
         controller.stop_listening()
+        if statsd is not None:
+            statsd.close()
+        if args.trace:
+            stacks = METRICS.dump_trace(args.trace)
+            print(f"Wrote {stacks} stacks to {args.trace} (render with flamegraph.pl or speedscope)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Voice Gate
+Voice activity detection and wake-word gating ahead of speech recognition
+"""
+
+import json
+import time
+import argparse
+
+import numpy as np
+
+GATE_SAMPLE_RATE = 16000
+GATE_FRAME_SAMPLES = 320          # 20ms, a frame size webrtcvad accepts
+GATE_FRAME_BYTES = GATE_FRAME_SAMPLES * 2
+
+IDLE = "idle"
+ARMED = "armed"
+COMMAND = "command"
+
+
+class EnergyVAD:
+    """Speech when a frame's RMS rises well above an adaptive noise floor"""
+
+    name = "energy"
+
+    def __init__(self, ratio=3.0, min_level=300.0, adapt=0.05):
+        self.ratio = ratio
+        self.min_level = min_level
+        self.adapt = adapt
+        self.noise = None
+
+    def is_speech(self, frame):
+        samples = np.frombuffer(frame, dtype='<i2').astype(np.float32)
+        rms = float(np.sqrt(np.dot(samples, samples) / max(1, samples.size)))
+        if self.noise is None:
+            self.noise = rms
+        speech = rms > max(self.min_level, self.noise * self.ratio)
+        if not speech:
+            self.noise += self.adapt * (rms - self.noise)
+        return speech
+
+
+class WebRTCVAD:
+    """Google's WebRTC VAD (webrtcvad package); more robust to steady noise"""
+
+    name = "webrtc"
+
+    def __init__(self, aggressiveness=2, sample_rate=GATE_SAMPLE_RATE):
+        try:
+            import webrtcvad
+        except ImportError:
+            raise RuntimeError("The webrtc VAD needs the webrtcvad package (pip install webrtcvad)")
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.sample_rate = sample_rate
+
+    def is_speech(self, frame):
+        return self.vad.is_speech(frame, self.sample_rate)
+
+
+def create_vad(name):
+    if name == 'energy':
+        return EnergyVAD()
+    if name == 'webrtc':
+        return WebRTCVAD()
+    raise ValueError(f"Unknown VAD '{name}'")
+
+
+def mfcc(samples, sample_rate=GATE_SAMPLE_RATE, n_mels=26, n_ceps=13):
+    """Mean-normalized MFCCs (25ms windows, 10ms hop) of int16 samples"""
+    frame_len, hop, n_fft = sample_rate // 40, sample_rate // 100, 512
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.size < frame_len:
+        samples = np.pad(samples, (0, frame_len - samples.size))
+    count = 1 + (samples.size - frame_len) // hop
+    index = np.arange(frame_len)[None, :] + hop * np.arange(count)[:, None]
+    frames = samples[index] * np.hamming(frame_len)
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2
+
+    mel = lambda hz: 2595 * np.log10(1 + hz / 700)
+    points = 700 * (10 ** (np.linspace(mel(0), mel(sample_rate / 2), n_mels + 2) / 2595) - 1)
+    bins = np.floor((n_fft + 1) * points / sample_rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1))
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        filters[m - 1, left:center] = (np.arange(left, center) - left) / max(1, center - left)
+        filters[m - 1, center:right] = (right - np.arange(center, right)) / max(1, right - center)
+    energies = np.log(power @ filters.T + 1e-10)
+
+    n = np.arange(n_mels)
+    dct = np.cos(np.pi / n_mels * (n[None, :] + 0.5) * np.arange(n_ceps)[:, None])
+    features = energies @ dct.T
+    return features - features.mean(axis=0)
+
+
+def dtw_distance(a, b):
+    """Length-normalized dynamic time warping distance between feature sequences"""
+    cost = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2))
+    n, m = cost.shape
+    total = np.full((n + 1, m + 1), np.inf)
+    total[0, 0] = 0.0
+    for i in range(1, n + 1):
+        row, previous, local = total[i], total[i - 1], cost[i - 1]
+        # Diagonal and vertical moves vectorize; horizontal moves need a running pass
+        row[1:] = local + np.minimum(previous[:-1], previous[1:])
+        for j in range(2, m + 1):
+            horizontal = row[j - 1] + local[j - 1]
+            if horizontal < row[j]:
+                row[j] = horizontal
+    return total[n, m] / (n + m)
+
+
+class TemplateWakeWord:
+    """Wake word matched by DTW against a few enrolled recordings.
+
+    Needs no model or network: the user records the wake word a few times
+    (--enroll-wake-word) and a segment is accepted when it is closer to any
+    recording than the recordings are to each other, times a margin.
+    """
+
+    name = "template"
+
+    def __init__(self, templates, threshold):
+        self.templates = templates
+        self.threshold = threshold
+
+    @classmethod
+    def enroll(cls, segments, margin=1.25):
+        templates = [mfcc(np.frombuffer(segment, dtype='<i2')) for segment in segments]
+        if len(templates) < 2:
+            raise ValueError("Enroll at least two recordings of the wake word")
+        spread = max(dtw_distance(a, b) for i, a in enumerate(templates) for b in templates[i + 1:])
+        return cls(templates, spread * margin)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, *self.templates, threshold=self.threshold)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            templates = [data[key] for key in data.files if key.startswith('arr_')]
+            return cls(templates, float(data['threshold']))
+
+    def detect(self, segment):
+        features = mfcc(np.frombuffer(segment, dtype='<i2'))
+        shortest = min(len(template) for template in self.templates)
+        longest = max(len(template) for template in self.templates)
+        # A segment much longer or shorter than every recording is not the wake word
+        if not shortest / 2 <= len(features) <= longest * 2:
+            return False
+        return min(dtw_distance(features, template) for template in self.templates) <= self.threshold
+
+
+class WakeWordRecorder:
+    """Stands in for a wake word during enrollment and keeps every segment heard"""
+
+    name = "enroll"
+
+    def __init__(self):
+        self.segments = []
+
+    def detect(self, segment):
+        self.segments.append(segment)
+        print(f"Recorded sample {len(self.segments)} ({len(segment) / 2 / GATE_SAMPLE_RATE:.2f}s)")
+        return False
+
+
+class VoskWakeWord:
+    """Wake phrase spotted by the offline recognizer with a one-phrase grammar"""
+
+    name = "vosk"
+
+    def __init__(self, backend, phrase):
+        self.backend = backend
+        self.phrase = phrase.lower()
+        self.grammar = json.dumps([self.phrase, "[unk]"])
+
+    def detect(self, segment):
+        recognizer = self.backend.vosk.KaldiRecognizer(self.backend.model, GATE_SAMPLE_RATE, self.grammar)
+        recognizer.AcceptWaveform(segment)
+        return self.phrase in json.loads(recognizer.FinalResult()).get('text', '')
+
+
+class VoiceGate:
+    """Decides which microphone frames reach the recognizer.
+
+    Every 20ms frame goes through the VAD. Without a wake word, speech
+    segments (plus a short pre-roll) are forwarded and everything else is
+    rejected. With a wake word, each speech segment is checked against it
+    first; only after a match is the next utterance forwarded, for up to
+    armed_seconds. process() returns (frames to forward, utterance ended).
+    """
+
+    def __init__(self, vad, wake=None, armed_seconds=5.0, pause=0.8, wake_pause=0.3,
+                 max_wake_seconds=2.0, preroll=0.2, on_wake=None):
+        self.vad = vad
+        self.wake = wake
+        self.on_wake = on_wake
+        self.armed_seconds = armed_seconds
+        self.pause_frames = int(pause / 0.02)
+        self.wake_pause_frames = int(wake_pause / 0.02)
+        self.max_wake_frames = int(max_wake_seconds / 0.02)
+        self.preroll_frames = int(preroll / 0.02)
+        self.state = IDLE if wake is not None else ARMED
+        self.armed_until = None
+        self.recent = []
+        self.segment = []
+        self.segment_speech = None
+        self.silence = 0
+        self.frames = 0
+        self.forwarded = 0
+        self.speech_frames = 0
+        self.wake_checks = 0
+        self.wakes = 0
+        self.utterances = 0
+        self.cpu_seconds = 0.0
+        self.started = time.monotonic()
+
+    def process(self, frame, now=None):
+        start = time.thread_time()
+        try:
+            return self._process(frame, time.monotonic() if now is None else now)
+        finally:
+            self.cpu_seconds += time.thread_time() - start
+
+    def _process(self, frame, now):
+        self.frames += 1
+        speech = self.vad.is_speech(frame)
+        if speech:
+            self.speech_frames += 1
+
+        if self.state == COMMAND:
+            self.forwarded += 1
+            self.silence = 0 if speech else self.silence + 1
+            if self.silence >= self.pause_frames:
+                self.utterances += 1
+                self._reset()
+                return [frame], True
+            return [frame], False
+
+        if self.state == ARMED:
+            if speech:
+                # Start forwarding, including the audio just before speech began
+                forward = self.recent + [frame]
+                self.recent = []
+                self.forwarded += len(forward)
+                self.state = COMMAND
+                self.silence = 0
+                return forward, False
+            if self.wake is not None and now > self.armed_until:
+                self.state = IDLE
+            self._remember(frame)
+            return [], False
+
+        # Idle: collect a candidate wake-word segment
+        if speech or self.segment:
+            if speech:
+                if self.segment_speech is None:
+                    self.segment_speech = [len(self.segment), 0]
+                self.segment_speech[1] = len(self.segment) + 1
+            self.segment.append(frame)
+            self.silence = 0 if speech else self.silence + 1
+            if self.silence >= self.wake_pause_frames or len(self.segment) >= self.max_wake_frames:
+                self.wake_checks += 1
+                # Only the voiced part is compared, so pauses do not skew the match
+                first, last = self.segment_speech
+                segment = b"".join(self.segment[first:last])
+                self.segment, self.segment_speech = [], None
+                if self.wake.detect(segment):
+                    self.wakes += 1
+                    self.state = ARMED
+                    self.armed_until = now + self.armed_seconds
+                    self.recent = []
+                    if self.on_wake is not None:
+                        self.on_wake()
+                return [], False
+        self._remember(frame)
+        return [], False
+
+    def _remember(self, frame):
+        self.recent.append(frame)
+        if len(self.recent) > self.preroll_frames:
+            del self.recent[0]
+
+    def _reset(self):
+        self.state = IDLE if self.wake is not None else ARMED
+        self.silence = 0
+        self.recent = []
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'frames': self.frames,
+            'rejected_fraction': 1 - self.forwarded / self.frames if self.frames else 0.0,
+            'speech_fraction': self.speech_frames / self.frames if self.frames else 0.0,
+            'wake_checks': self.wake_checks,
+            'wakes': self.wakes,
+            'utterances': self.utterances,
+            'cpu_seconds': self.cpu_seconds,
+            'cpu_percent': self.cpu_seconds / elapsed * 100 if elapsed > 0 else 0.0,
+        }
+
+
+def format_gate_stats(stats):
+    return (f"gate: {stats['frames']} frames, {stats['rejected_fraction'] * 100:.1f}% rejected, "
+            f"{stats['wakes']}/{stats['wake_checks']} wake checks matched, {stats['utterances']} utterances "
+            f"forwarded, {stats['cpu_percent']:.2f}% CPU")
+
+
+def synthetic_word(kind, rng, seconds=0.6):
+    """Harmonic sweep standing in for a spoken word; kinds differ in contour"""
+    t = np.arange(int(seconds * GATE_SAMPLE_RATE)) / GATE_SAMPLE_RATE
+    contours = {
+        'wake': 180 + 140 * np.sin(np.pi * t / seconds),
+        'other': 320 - 160 * t / seconds,
+        'chatter': 220 + 60 * np.sin(9 * np.pi * t / seconds),
+    }
+    phase = 2 * np.pi * np.cumsum(contours[kind] * rng.uniform(0.95, 1.05)) / GATE_SAMPLE_RATE
+    voice = sum(np.sin(h * phase) / h for h in (1, 2, 3, 4))
+    return (voice * np.hanning(t.size) * 6000).astype(np.int16)
+
+
+def run_benchmark(seconds=300, seed=3):
+    """Gate a synthetic room recording and report rejection, wake accuracy and CPU"""
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 80, seconds * GATE_SAMPLE_RATE)
+    events = []
+    position = GATE_SAMPLE_RATE
+    while position < audio.size - 3 * GATE_SAMPLE_RATE:
+        kind = rng.choice(['wake', 'other', 'chatter', 'silence'], p=[0.1, 0.3, 0.3, 0.3])
+        if kind != 'silence':
+            word = synthetic_word(kind, rng)
+            audio[position:position + word.size] += word
+            events.append(kind)
+            if kind == 'wake':
+                # Command follows the wake word
+                command = synthetic_word('other', rng, seconds=1.2)
+                start = position + word.size + GATE_SAMPLE_RATE // 2
+                audio[start:start + command.size] += command
+                position = start + command.size
+        position += int(rng.uniform(1.5, 4.0) * GATE_SAMPLE_RATE)
+    pcm = np.clip(audio, -32768, 32767).astype('<i2').tobytes()
+    frames = [pcm[i:i + GATE_FRAME_BYTES] for i in range(0, len(pcm) - GATE_FRAME_BYTES + 1, GATE_FRAME_BYTES)]
+
+    # Enroll from three noisy recordings through the same segmentation the gate uses
+    enrollment = rng.normal(0, 80, 6 * GATE_SAMPLE_RATE)
+    for start in (0.5, 2.5, 4.5):
+        word = synthetic_word('wake', rng)
+        offset = int(start * GATE_SAMPLE_RATE)
+        enrollment[offset:offset + word.size] += word
+    recorder = WakeWordRecorder()
+    enroller = VoiceGate(EnergyVAD(), recorder)
+    enrollment = enrollment.astype('<i2').tobytes()
+    for i in range(0, len(enrollment) - GATE_FRAME_BYTES + 1, GATE_FRAME_BYTES):
+        enroller.process(enrollment[i:i + GATE_FRAME_BYTES])
+    wake = TemplateWakeWord.enroll(recorder.segments)
+
+    for label, gate in (("vad only", VoiceGate(EnergyVAD())), ("vad + wake word", VoiceGate(EnergyVAD(), wake))):
+        now = 0.0
+        for frame in frames:
+            gate.process(frame, now)
+            now += 0.02
+        stats = gate.stats()
+        print(f"{label:<16} {stats['rejected_fraction'] * 100:5.1f}% of frames rejected, "
+              f"{stats['utterances']} utterances forwarded, {stats['wakes']} wakes "
+              f"({events.count('wake')} spoken, {events.count('other') + events.count('chatter')} other words), "
+              f"{stats['cpu_seconds'] / seconds * 100:.2f}% of one core in real time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ESP32 Home Automation Voice Gate')
+    parser.add_argument('--benchmark', action='store_true', help='Gate a synthetic recording and report CPU use')
+    parser.add_argument('--seconds', type=int, default=300, help='Length of the benchmark recording (default: 300)')
+
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.seconds)
+        return
+    parser.print_help()
+
+if __name__ == "__main__":
+    main()
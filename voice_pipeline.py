@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+ESP32 Home Automation - Voice Pipeline
+Multi-stage capture / recognition / execution pipeline for voice control
+"""
+
+import time
+import queue
+import threading
+
+# Overflow policies for a full stage queue
+DROP_OLDEST = "drop_oldest"   # Discard the stalest queued item to make room
+DROP_NEWEST = "drop_newest"   # Discard the incoming item
+COALESCE = "coalesce"         # Keep only the newest item, discarding the backlog
+
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.total_wait = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency, wait=0.0):
+        with self.lock:
+            self.processed += 1
+            self.total_latency += latency
+            self.total_wait += wait
+            self.last_latency = latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+    def record_drop(self, count=1):
+        with self.lock:
+            self.dropped += count
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self, queue_depth=None):
+        with self.lock:
+            processed = self.processed
+            return {
+                'stage': self.name,
+                'processed': processed,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'queue_depth': queue_depth,
+                'avg_latency_ms': (self.total_latency / processed * 1000) if processed else 0.0,
+                'max_latency_ms': self.max_latency * 1000,
+                'last_latency_ms': self.last_latency * 1000,
+                'avg_queue_wait_ms': (self.total_wait / processed * 1000) if processed else 0.0,
+            }
+
+
+class BoundedStageQueue:
+    """Bounded queue between two stages that applies an overflow policy instead of blocking"""
+
+    def __init__(self, maxsize, overflow=DROP_OLDEST, stats=None, backing=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.queue = backing if backing is not None else queue.Queue(maxsize=maxsize)
+        self.overflow = overflow
+        self.stats = stats
+
+    def put(self, item):
+        """Enqueue an item, returning False if it was dropped"""
+        entry = (time.perf_counter(), item)
+
+        if self.overflow == COALESCE:
+            self._drain(drop=True)
+
+        while True:
+            try:
+                self.queue.put_nowait(entry)
+                return True
+            except queue.Full:
+                if self.overflow == DROP_NEWEST:
+                    self._count_drop()
+                    return False
+                self._drain(drop=True, limit=1)
+
+    def get(self, timeout=None):
+        """Dequeue an item, returning (item, seconds spent queued)"""
+        enqueued_at, item = self.queue.get(timeout=timeout)
+        return item, time.perf_counter() - enqueued_at
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def _drain(self, drop=False, limit=None):
+        removed = 0
+        while limit is None or removed < limit:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            removed += 1
+        if drop and removed:
+            self._count_drop(removed)
+
+    def _count_drop(self, count=1):
+        if self.stats:
+            self.stats.record_drop(count)
+
+
+class VoicePipeline:
+    """Runs capture, recognition and execution on separate threads.
+
+    capture() blocks until a phrase is recorded and returns the audio (or None),
+    recognize(audio) returns the transcript (or None) and execute(text) acts on
+    it. While a command is executing, the next phrase is already being captured
+    and recognized.
+    """
+
+    def __init__(self, capture, recognize, execute, audio_queue_size=2, command_queue_size=4,
+                 audio_overflow=DROP_OLDEST, command_overflow=DROP_OLDEST, command_queue=None):
+        self.capture = capture
+        self.recognize = recognize
+        self.execute = execute
+
+        self.capture_stats = StageStats('capture')
+        self.recognition_stats = StageStats('recognition')
+        self.execution_stats = StageStats('execution')
+
+        # Recognition is the slow, network-bound stage; when it falls behind,
+        # stale audio is dropped in favour of what the user said most recently.
+        self.audio_queue = BoundedStageQueue(audio_queue_size, audio_overflow, self.recognition_stats)
+        self.command_queue = BoundedStageQueue(command_queue_size, command_overflow, self.execution_stats,
+                                               backing=command_queue)
+
+        self.is_running = False
+        self.threads = []
+
+    def start(self):
+        """Start all pipeline stages"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name='voice-capture', daemon=True),
+            threading.Thread(target=self._recognition_loop, name='voice-recognition', daemon=True),
+            threading.Thread(target=self._execution_loop, name='voice-execution', daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Signal every stage to stop and wait for them to exit"""
+        self.is_running = False
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def wait(self):
+        """Block until the pipeline stops"""
+        while self.is_running:
+            time.sleep(0.2)
+
+    def stats(self):
+        """Per-stage queue depth and latency"""
+        return [
+            self.capture_stats.snapshot(),
+            self.recognition_stats.snapshot(self.audio_queue.qsize()),
+            self.execution_stats.snapshot(self.command_queue.qsize()),
+        ]
+
+    def _capture_loop(self):
+        while self.is_running:
+            start = time.perf_counter()
+            try:
+                audio = self.capture()
+            except Exception as e:
+                print(f"Error capturing audio: {e}")
+                self.capture_stats.record_error()
+                time.sleep(1)
+                continue
+            if audio is None:
+                continue
+            self.capture_stats.record(time.perf_counter() - start)
+            self.audio_queue.put(audio)
+
+    def _recognition_loop(self):
+        while self.is_running:
+            try:
+                audio, waited = self.audio_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                text = self.recognize(audio)
+            except Exception as e:
+                print(f"Error recognizing speech: {e}")
+                self.recognition_stats.record_error()
+                continue
+            self.recognition_stats.record(time.perf_counter() - start, waited)
+
+            if text:
+                self.command_queue.put(text)
+
+    def _execution_loop(self):
+        while self.is_running:
+            try:
+                text, waited = self.command_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.execute(text)
+            except Exception as e:
+                print(f"Error executing command: {e}")
+                self.execution_stats.record_error()
+                continue
+            self.execution_stats.record(time.perf_counter() - start, waited)
+
+
+def format_stats(stats):
+    """Render pipeline stats as a short table"""
+    lines = [f"{'stage':<12} {'done':>6} {'drop':>5} {'err':>4} {'depth':>6} {'avg ms':>8} {'max ms':>8} {'wait ms':>8}"]
+    for stage in stats:
+        depth = '-' if stage['queue_depth'] is None else stage['queue_depth']
+        lines.append(f"{stage['stage']:<12} {stage['processed']:>6} {stage['dropped']:>5} {stage['errors']:>4} "
+                     f"{depth:>6} {stage['avg_latency_ms']:>8.1f} {stage['max_latency_ms']:>8.1f} "
+                     f"{stage['avg_queue_wait_ms']:>8.1f}")
+    return "\n".join(lines)